@@ -1,2 +1,4 @@
 from aes.encrypt import encrypt as aesEncrypt
-from aes.decrypt import decrypt as aesDecrypt
\ No newline at end of file
+from aes.decrypt import decrypt as aesDecrypt
+from aes.ctr import crypt as aesCtr
+from aes.key_extension import AESKey
\ No newline at end of file
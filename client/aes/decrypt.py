@@ -1,24 +1,20 @@
 import numpy as np
-from aes.key_extension import extend_key, createRoundKey
+from aes.key_extension import extend_key, createRoundKey, get_key
 from aes.common import get_blocks, KEY_SIZE, addRoundKey, shiftRows, sbox, mixColumns
+from aes.common import get_block_array, flatten_block_array, shiftRows_many, sbox_many, mixColumns_many, pack_columns, unpack_columns, t_round_inverse
 
+# key can be raw bytes or an AESKey
 def decrypt(msg, key):
-    # Sanity check
-    assert len(key) == KEY_SIZE
+    # Get the extended key (only extends it if it hasn't been used recently)
+    key = get_key(key)
 
-    # Divide data into blocks
-    blocks = get_blocks(msg)
+    # Divide data into an array of blocks
+    blocks = get_block_array(msg)
 
-    # Derive a series of other keys
-    extended_keys = extend_key(key)
+    # Decrypt every block at once
+    blocks = decrypt_blocks(blocks, key.round_keys, key.inverse_round_keys)
 
-    # Decrypt each block
-    ## For each block of data
-    for i in range(0, len(blocks)):
-        ## Decrypt
-        blocks[i] = decrypt_block(blocks[i], extended_keys)
-
-    return bytearray(list(np.array([x.flatten(order='F') for x in blocks]).flatten()))
+    return bytearray(flatten_block_array(blocks).tobytes())
 
 def decrypt_block(block, extended_keys):
     # Reverse the final operations
@@ -53,3 +49,29 @@ def aes_decrypt_round(block, round_key):
     block = sbox(block, True)
     
     return block
+
+# Same as decrypt_block, but for an (N,4,4) array of blocks and a (15,4,4) array of round keys
+# inverse_round_keys is the round keys with their columns unmixed, which is worked out if it isn't given
+def decrypt_blocks(blocks, round_keys, inverse_round_keys=None):
+    # Work on columns as 32 bit words, so each round can use the T-Tables
+    words = pack_columns(blocks)
+
+    # The T-Tables mix columns after substituting, rather than after adding the round key like
+    # decrypt_block does. Mixing is linear, so this works as long as the round keys are mixed too.
+    if inverse_round_keys is None:
+        inverse_round_keys = mixColumns_many(round_keys, True)
+    key_words = pack_columns(inverse_round_keys)
+
+    # Reverse the final operations
+    words = words ^ pack_columns(round_keys[14:15])
+
+    # For round 14 -> 1
+    for round_ in range(13, 0, -1):
+        words = t_round_inverse(words) ^ key_words[round_]
+
+    # Undo the last shift and substitution, then reverse the first key
+    blocks = unpack_columns(words)
+    blocks = shiftRows_many(blocks, True)
+    blocks = sbox_many(blocks, True)
+    blocks = blocks ^ round_keys[0]
+    return blocks
@@ -1,25 +1,21 @@
 import numpy as np
-from aes.key_extension import extend_key, createRoundKey
+from aes.key_extension import extend_key, createRoundKey, get_key
 from aes.common import get_blocks, KEY_SIZE, addRoundKey, shiftRows, sbox, mixColumns
+from aes.common import get_block_array, flatten_block_array, shiftRows_many, sbox_many, pack_columns, unpack_columns, t_round
 
+# key can be raw bytes or an AESKey
 def encrypt(msg, key):
-    # Sanity check
-    assert len(key) == KEY_SIZE
+    # Get the extended key (only extends it if it hasn't been used recently)
+    key = get_key(key)
 
-    # Divide data into blocks
-    blocks = get_blocks(msg)
+    # Divide data into an array of blocks
+    blocks = get_block_array(msg)
 
-    # Derive a series of other keys
-    extended_keys = extend_key(key)
-
-    # Encrypt each block with 14 rounds
-    ## For each block of data
-    for i in range(0, len(blocks)):
-        ## Encrypt with 14 rounds
-        blocks[i] = encrypt_block(blocks[i], extended_keys)
+    # Encrypt every block at once with 14 rounds
+    blocks = encrypt_blocks(blocks, key.round_keys)
 
     # Return the ciphertext flattened to a bytearray
-    return bytearray(list(np.array([x.flatten(order='F') for x in blocks]).flatten()))
+    return bytearray(flatten_block_array(blocks).tobytes())
 
 def encrypt_block(block, extended_keys):
     # Add the first key to start
@@ -54,3 +50,24 @@ def aes_round(block, round_key):
     # XOR the block with the key
     block = addRoundKey(block, round_key)
     return block
+
+# Same as encrypt_block, but for an (N,4,4) array of blocks and a (15,4,4) array of round keys
+def encrypt_blocks(blocks, round_keys):
+    # Work on columns as 32 bit words, so each round can use the T-Tables
+    words = pack_columns(blocks)
+    key_words = pack_columns(round_keys)
+
+    # Add the first key to start
+    words = words ^ key_words[0]
+
+    # For round 1 -> 14
+    for round_ in range(1, 14):
+        words = t_round(words) ^ key_words[round_]
+
+    # Some final operations (no mixing this time)
+    blocks = unpack_columns(words)
+    blocks = sbox_many(blocks)
+    blocks = shiftRows_many(blocks)
+    blocks = blocks ^ round_keys[14]
+
+    return blocks
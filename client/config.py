@@ -9,6 +9,7 @@ import sys
 
 from aes import aesEncrypt, aesDecrypt
 from hash import sha256
+from hash_cache import HashCache
 from rsa import RSAKeypair
 from rsa.classes import PRIV_KEY_START
 
@@ -27,6 +28,9 @@ class Config:
 		# Get the path for the config
 		self.config_path = Path.home().joinpath('securevcs.config')
 
+		# Load the cache of local files' hashes
+		self.hash_cache = HashCache()
+
 		# Check if it exists
 		if self.config_path.exists():
 			# If so, try to load it
@@ -141,6 +145,9 @@ class Config:
 				'local_files': self.local_files
 			}, f)
 
+		# Save the hash cache as well
+		self.hash_cache.save()
+
 	def add_local_file(self, local_file):
 		# TODO: Don't duplicate paths
 		self.local_files.append(local_file)
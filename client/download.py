@@ -0,0 +1,77 @@
+# Downloading files from the server
+# Downloads go to a separate file until they're done, so if the connection drops part way through,
+# they can carry on from where they got to with a Range request instead of starting again.
+
+from requests.exceptions import RequestException
+
+# How much of a download to handle at once
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# How many times to try a download, carrying on from where it got to each time, before giving up
+DOWNLOAD_ATTEMPTS = 5
+
+# Downloads are saved to their path with these added to the end until they're done
+## The partly downloaded file
+PART_SUFFIX = ".part"
+## The ETag of the version being downloaded, so we know if we can carry on with it
+ETAG_SUFFIX = ".part.etag"
+
+# Download url to part_path, carrying on from what's already there if it's the same version.
+# get is used to make requests (see App.get). The ETag of the version being downloaded is kept at etag_path.
+# If the connection drops, it tries again from where it got to, up to DOWNLOAD_ATTEMPTS times
+# Returns None if it's all downloaded, or an error message
+def download_part(get, url, part_path, etag_path):
+	error = None
+	for _ in range(0, DOWNLOAD_ATTEMPTS):
+		# Ask for the rest of it if we've already got some, as long as it's still the same version
+		## The server sends the whole thing if it's not
+		headers = {}
+		have = None
+		if part_path.exists() and etag_path.exists():
+			have = part_path.stat().st_size
+			headers['Range'] = "bytes=%s-" % have
+			headers['If-Range'] = etag_path.read_text()
+
+		try:
+			## stream=True means we can write it out a piece at a time
+			res = get(url, stream=True, headers=headers)
+
+			if res.status_code == 206 and have != None and res.headers.get('Content-Range', "").startswith("bytes %s-" % have):
+				## Carry on from the end of what we've got
+				mode = "ab"
+				total = int(res.headers['Content-Range'].split("/")[-1])
+			elif res.status_code == 200:
+				## Start again, remembering which version this is first so we can carry on with it
+				mode = "wb"
+				total = int(res.headers['Content-Length'])
+				if res.headers.get('ETag') != None:
+					etag_path.write_text(res.headers['ETag'])
+				elif etag_path.exists():
+					etag_path.unlink()
+			elif res.status_code == 416 and have != None and res.headers.get('Content-Range') == "bytes */%s" % have:
+				## We already had all of it
+				return None
+			elif res.status_code in (206, 416):
+				## What we've got doesn't make sense, so start again
+				res.close()
+				if etag_path.exists():
+					etag_path.unlink()
+				continue
+			else:
+				return res.json()['message']
+
+			with open(part_path, mode) as f:
+				for piece in res.iter_content(DOWNLOAD_CHUNK_SIZE):
+					f.write(piece)
+
+			## The connection can also close early without an error
+			if part_path.stat().st_size != total:
+				error = "got %s of %s bytes" % (part_path.stat().st_size, total)
+				continue
+
+			return None
+		except RequestException as e:
+			## Cut off, so try again
+			error = e
+
+	return "Download was interrupted too many times (%s)" % error
@@ -0,0 +1,82 @@
+# Remembers the hashes of local files between runs, so files that haven't changed don't need to be
+# read and hashed again every time we want to know if they've changed
+
+import os
+import pickle
+import time
+from pathlib import Path
+
+from hash import sha256_file
+
+# Files modified this recently (seconds) aren't cached, since they could be changed again
+# without their modification time changing
+RACY_SECONDS = 2
+
+# Cache format (pickled):
+# { path: ((size, mtime_ns, inode), hash) }
+class HashCache:
+	# + HashCache(Path)
+	def __init__(self, cache_path=None):
+		if cache_path == None:
+			cache_path = Path.home().joinpath('securevcs.hashcache')
+
+		self.cache_path = cache_path
+		self.entries = {}
+
+		# Load the existing cache, if there is one
+		if self.cache_path.exists():
+			try:
+				with open(self.cache_path, "rb") as f:
+					self.entries = pickle.load(f)
+			except Exception as _:
+				# If it's invalid, just start again
+				self.entries = {}
+
+	# + get(Path): bytearray
+	# Returns the hash of the file at path, only reading it if it's changed since it was last hashed
+	def get(self, path):
+		key = str(path)
+		stat = stat_tuple(path)
+
+		# If the file looks the same as it did last time, use the stored hash
+		if key in self.entries and self.entries[key][0] == stat:
+			return self.entries[key][1]
+
+		# Otherwise, hash it and remember it
+		with open(path, "rb") as f:
+			digest = sha256_file(f)
+
+		self.put(path, digest, stat)
+
+		return digest
+
+	# + put(Path, bytearray)
+	# Store a hash we already know, eg because we just wrote the file
+	def put(self, path, digest, stat=None):
+		if stat == None:
+			stat = stat_tuple(path)
+
+		# Don't trust a modification time that's too recent
+		if time.time_ns() - stat[1] < RACY_SECONDS * 1_000_000_000:
+			self.entries.pop(str(path), None)
+			return
+
+		self.entries[str(path)] = (stat, digest)
+
+	# + prune(List<Path>)
+	# Forget about every file except the given ones
+	def prune(self, paths):
+		keep = set([str(path) for path in paths])
+		for key in [key for key in self.entries if key not in keep]:
+			del self.entries[key]
+
+	# + save()
+	def save(self):
+		with open(self.cache_path, "w+b") as f:
+			pickle.dump(self.entries, f)
+
+# Returns (size, mtime_ns, inode) for the file at path
+# If any of these change, the file's contents might have as well
+def stat_tuple(path):
+	stat = os.stat(path)
+	return (stat.st_size, stat.st_mtime_ns, stat.st_ino)
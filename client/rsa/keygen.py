@@ -1,5 +1,21 @@
-from rsa.gen_primes import generate_prime
-from math import gcd
+from rsa.gen_primes import generate_prime, search_window
+from math import gcd, isqrt
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import multiprocessing
+import os
+
+# Public exponent
+E = 65537
+
+# Sizes of n that keys can be generated with (bits)
+KEY_SIZES = [2048, 3072, 4096]
+DEFAULT_KEY_SIZE = 4096
+
+# Keys smaller than this aren't accepted (bits)
+MIN_KEY_SIZE = 2048
+
+# How often KeygenService checks if it's been cancelled while waiting (seconds)
+POLL_SECONDS = 0.1
 
 # Returns g, x, y
 # Where ax + by = g
@@ -31,25 +47,45 @@ def mod_mult_inverse(a, m):
 
 	return x
 
-def generate_key():
-	# e is a constant
-	e = 65537
+# Returns (minimum, maximum) to pick p and q from for a key of the given size
+# Both are half the size, and big enough that n = pq is exactly `bits` bits long
+def prime_range(bits):
+	# Sanity check
+	assert bits in KEY_SIZES
+
+	half = bits // 2
 
-	# Get p, q and X where X is coprime to e
-	p, q, X = None, None, None
-	
-	## Until we find a correct candidate
+	# p, q >= sqrt(2) * 2^(half - 1), so pq >= 2^(bits - 1)
+	return (isqrt(2 ** (bits - 1)) + 1, 2 ** half)
+
+def generate_key(bits=DEFAULT_KEY_SIZE):
+	minimum, maximum = prime_range(bits)
+
+	# Until we find a correct candidate
 	while True:
 		## Get 2 primes p and q
-		p = generate_prime(2 ** 1024, 2 ** 2048)
-		q = generate_prime(2 ** 1024, 2 ** 2048)
+		p = generate_prime(minimum, maximum)
+		q = generate_prime(minimum, maximum)
+
+		## If they make a valid key, we're done
+		key = key_from_primes(p, q)
+		if key != None:
+			return key
+
+# Make a key from 2 primes
+# Returns (e, d, n, p, q), or None if they can't be used together
+def key_from_primes(p, q):
+	# e is a constant
+	e = E
 
-		## Find X = phi(pq)
-		X = (p - 1) * (q - 1)
+	# p and q need to be different
+	if p == q:
+		return None
 
-		## If X is coprime to e, break out of the loop
-		if gcd(X, e) == 1:
-			break
+	# Find X = phi(pq), which needs to be coprime to e
+	X = (p - 1) * (q - 1)
+	if gcd(X, e) != 1:
+		return None
 
 	# n = pq
 	n = p * q
@@ -57,4 +93,120 @@ def generate_key():
 	# Find d with the extended Euclidean Algorithm
 	d = mod_mult_inverse(e, X)
 
-	return (e, d, n)
+	# p and q are kept so private key operations can use the CRT
+	return (e, d, n, p, q)
+
+# Find p and q from a private key that doesn't have them (eg one saved before they were kept)
+# e * d - 1 is a multiple of phi(n), so we can use it to find a square root of 1 (mod n) that isn't +-1,
+# which gives a factor of n.
+# Returns (p, q)
+def recover_primes(e, d, n):
+	# k = 2^s * t, with t odd
+	k = e * d - 1
+	t = k
+	while t % 2 == 0:
+		t //= 2
+
+	# Try different bases until we find a root that works
+	# Each base has at least a 1/2 chance of working, so this won't take long
+	for g in range(2, 1000):
+		x = pow(g, t, n)
+
+		## Keep squaring until we get to 1
+		while x != 1:
+			y = pow(x, 2, n)
+
+			## If x^2 = 1 but x isn't -1, x - 1 shares a factor with n
+			if y == 1 and x != n - 1:
+				p = gcd(x - 1, n)
+				return (p, n // p)
+
+			x = y
+
+	raise Exception("Couldn't find the factors of n")
+
+# Raised by KeygenService.generate() if it's cancelled
+class KeygenCancelled(Exception):
+	pass
+
+# Set in each worker process by init_worker, so searches can be stopped early
+worker_stop = None
+
+def init_worker(stop):
+	global worker_stop
+	worker_stop = stop
+
+# Search one window for a prime, giving up if the service is stopped
+# This is what the worker processes run
+def find_prime(minimum, maximum):
+	return search_window(minimum, maximum, worker_stop)
+
+# Generates a key by searching for primes on every core at once
+# Each instance generates one key. It can be cancelled from another thread, and reports how it's
+# getting on through progress, which is called with (primes found, windows searched).
+# Note that progress is called from whichever thread calls generate().
+class KeygenService:
+	# + KeygenService(int, int, function)
+	def __init__(self, bits=DEFAULT_KEY_SIZE, workers=None, progress=None):
+		if workers == None:
+			workers = os.cpu_count() or 1
+
+		self.bits = bits
+		self.workers = workers
+		self.progress = progress
+		self.cancelled = False
+
+		# Uses spawn rather than fork, so workers don't inherit things like open windows
+		self.context = multiprocessing.get_context('spawn')
+		self.stop = self.context.Event()
+
+	# + cancel()
+	# Stop generating. generate() will raise KeygenCancelled
+	def cancel(self):
+		self.cancelled = True
+		self.stop.set()
+
+	# + generate(): (e, d, n, p, q)
+	def generate(self):
+		minimum, maximum = prime_range(self.bits)
+		executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=self.context,
+			initializer=init_worker, initargs=(self.stop,))
+
+		primes = []
+		searched = 0
+		pending = set()
+
+		try:
+			while True:
+				# Keep every worker busy
+				while len(pending) < self.workers:
+					pending.add(executor.submit(find_prime, minimum, maximum))
+
+				# Wait for a search to finish, checking if we've been cancelled now and then
+				done, pending = wait(pending, timeout=POLL_SECONDS, return_when=FIRST_COMPLETED)
+				if self.cancelled:
+					raise KeygenCancelled()
+
+				for future in done:
+					searched += 1
+					prime = future.result()
+					if prime == None:
+						continue
+
+					## Try it with each prime we already have
+					for other in primes:
+						key = key_from_primes(other, prime)
+						if key != None:
+							return key
+
+					primes.append(prime)
+
+				if self.progress != None and len(done) > 0:
+					self.progress(len(primes), searched)
+		finally:
+			# Stop any searches that are still going
+			self.stop.set()
+			for future in pending:
+				future.cancel()
+
+			executor.shutdown(wait=False)
@@ -1,3 +1,12 @@
+from hash import sha256_many
+from rsa.crypt import signed_to_bytes
+
+# hashPrev of the first statement in a file's history
+ZEROS_32 = bytearray([0 for _ in range(32)])
+
+# How many statements each worker process checks at once, when verifying in parallel
+STATEMENTS_PER_TASK = 256
+
 class HistoryStatement:
 	def __init__(self, hashPrev, hashUploaded, username, comment=""):
 		self.hashPrev = hashPrev
@@ -34,4 +43,97 @@ class HistoryStatement:
 		return HistoryStatement(hashPrev, hashUploaded, username, comment)
 
 	def __str__(self):
-		return "<HistoryStatement %s uploaded %s, previous was %s, comment: %s>" % (self.username, self.hashUploaded, self.hashPrev, self.comment)
\ No newline at end of file
+		return "<HistoryStatement %s uploaded %s, previous was %s, comment: %s>" % (self.username, self.hashUploaded, self.hashPrev, self.comment)
+
+# Check the signatures on a list of decoded payloads (see signed_to_bytes) which all claim to be from key
+# This is what the worker processes run
+# Returns a list with the signed message or False for each one
+def verify_payloads(key, payloads):
+	results = []
+	for payload in payloads:
+		try:
+			results.append(key.decrypt_signed_bytes(payload))
+		except Exception as _:
+			results.append(False)
+
+	return results
+
+# Verify a whole chain of history statements at once
+# statements is a list of (alleged username, signed payload), oldest first
+# key_lookup is called with each username once, and should return their RSAKeypair or None
+# hashPrev is what the first statement's hashPrev should be, or None to not check it
+# If an executor is given, the signatures are checked in parallel on it
+# Returns a list with the HistoryStatement, or False if it's invalid, for each statement
+def verify_chain(statements, key_lookup, executor=None, hashPrev=ZEROS_32):
+	# Decode every payload once
+	payloads = []
+	for _, payload in statements:
+		try:
+			payloads.append(signed_to_bytes(payload))
+		except Exception as _:
+			payloads.append(None)
+
+	# Hash every payload at once, since each one's hash is the next one's hashPrev
+	hashes = sha256_many([payload if payload != None else b"" for payload in payloads])
+
+	# Group the statements by who signed them, so each key is only looked up once
+	groups = {}
+	for index, (username, _) in enumerate(statements):
+		if payloads[index] != None:
+			groups.setdefault(username, []).append(index)
+
+	# Split each group into tasks
+	tasks = []
+	for username, indices in groups.items():
+		key = key_lookup(username)
+		if key == None:
+			continue
+
+		for start in range(0, len(indices), STATEMENTS_PER_TASK):
+			tasks.append((key, indices[start:start + STATEMENTS_PER_TASK]))
+
+	# Check the signatures
+	## Not worth sending to other processes if there's only one task
+	task_payloads = [[payloads[index] for index in indices] for _, indices in tasks]
+	if executor == None or len(tasks) <= 1:
+		task_results = [verify_payloads(key, chunk) for (key, _), chunk in zip(tasks, task_payloads)]
+	else:
+		task_results = executor.map(verify_payloads, [key for key, _ in tasks], task_payloads)
+
+	decrypted = [False] * len(statements)
+	for (_, indices), results in zip(tasks, task_results):
+		for index, result in zip(indices, results):
+			decrypted[index] = result
+
+	# Check the contents of each statement
+	verified = []
+	for index, (username, _) in enumerate(statements):
+		if decrypted[index] == False:
+			verified.append(False)
+			continue
+
+		try:
+			hs = HistoryStatement.from_bytes(decrypted[index])
+		except Exception as _:
+			verified.append(False)
+			continue
+
+		## Make sure previous hash matches what's expected
+		## If the previous payload couldn't be decoded, there's nothing valid to match
+		expected_prev = hashes[index - 1] if index > 0 else hashPrev
+		if index > 0 and payloads[index - 1] == None:
+			verified.append(False)
+			continue
+
+		if expected_prev != None and bytes(expected_prev) != bytes(hs.hashPrev):
+			verified.append(False)
+			continue
+
+		## Make sure username matches what it should be
+		if username != hs.username:
+			verified.append(False)
+			continue
+
+		verified.append(hs)
+
+	return verified
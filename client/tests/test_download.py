@@ -0,0 +1,208 @@
+# Test script for resuming downloads
+# Downloads from a fake server, which handles Range and If-Range like the real one does, and can
+# cut responses off part way through
+
+import os
+import tempfile
+from pathlib import Path
+
+from requests.exceptions import ChunkedEncodingError
+from requests.structures import CaseInsensitiveDict
+
+from download import download_part, DOWNLOAD_ATTEMPTS
+
+# What the fake server has
+DATA = os.urandom(200 * 1024)
+ETAG = '"1600000000-abcdef"'
+
+URL = 'file/download?file_id=1'
+
+# Response from FakeServer, with the parts of requests.Response that download_part uses
+# cut is None, or (how, count) to stop after count bytes of the body, either raising (how = 'raise')
+# like a dropped connection, or just ending early (how = 'short')
+class FakeResponse:
+	def __init__(self, status_code, headers, body, cut=None):
+		self.status_code = status_code
+		self.headers = CaseInsensitiveDict(headers)
+		self.body = body
+		self.cut = cut
+
+	def iter_content(self, chunk_size):
+		end = len(self.body) if self.cut == None else min(self.cut[1], len(self.body))
+		for i in range(0, end, chunk_size):
+			yield self.body[i:min(i + chunk_size, end)]
+
+		if self.cut != None and self.cut[0] == 'raise':
+			raise ChunkedEncodingError("Connection broken")
+
+	def json(self):
+		return {'success': False, 'message': self.body.decode('ascii')}
+
+	def close(self):
+		pass
+
+# Serves DATA, cutting off each response as given in cuts (see FakeResponse), in order
+# Only handles Range headers like download_part sends ("bytes=n-")
+class FakeServer:
+	def __init__(self, cuts=[], etag=ETAG, status_code=None):
+		self.cuts = list(cuts)
+		self.etag = etag
+		self.status_code = status_code
+
+		# Headers of every request made
+		self.requests = []
+
+	def get(self, url, stream=False, headers={}):
+		self.requests.append(dict(headers))
+		cut = self.cuts.pop(0) if len(self.cuts) > 0 else None
+
+		if url != URL or self.status_code != None:
+			return FakeResponse(self.status_code or 404, {}, b"File not found")
+
+		## Send the whole thing unless the client has the same version
+		if 'Range' not in headers or headers.get('If-Range') != self.etag:
+			return FakeResponse(200, {'Content-Length': len(DATA), 'ETag': self.etag}, DATA, cut)
+
+		start = int(headers['Range'][len("bytes="):-1])
+		if start >= len(DATA):
+			return FakeResponse(416, {'Content-Range': "bytes */%s" % len(DATA)}, b"Range Not Satisfiable")
+
+		return FakeResponse(206, {
+			'Content-Length': len(DATA) - start,
+			'Content-Range': "bytes %s-%s/%s" % (start, len(DATA) - 1, len(DATA)),
+			'ETag': self.etag
+		}, DATA[start:], cut)
+
+# Run download_part against server in a new folder
+# setup(part_path, etag_path) can put things there first
+# Returns (result, part_path, etag_path)
+def download(folder, server, setup=None):
+	part_path = Path(folder).joinpath("file.part")
+	etag_path = Path(folder).joinpath("file.part.etag")
+
+	if setup != None:
+		setup(part_path, etag_path)
+
+	return (download_part(server.get, URL, part_path, etag_path), part_path, etag_path)
+
+# Each test returns (True,) or (False, reason)
+def test_whole(folder):
+	server = FakeServer()
+	res, part_path, etag_path = download(folder, server)
+
+	if res != None or part_path.read_bytes() != DATA:
+		return (False, "Download failed (%s)" % res)
+
+	if len(server.requests) != 1 or 'Range' in server.requests[0]:
+		return (False, "Made the wrong requests: %s" % server.requests)
+
+	if etag_path.read_text() != ETAG:
+		return (False, "Didn't save the ETag")
+
+	return (True,)
+
+def test_resume(folder):
+	# Dropped after 1000 bytes, then ends early after another 5000
+	server = FakeServer([('raise', 1000), ('short', 5000)])
+	res, part_path, _ = download(folder, server)
+
+	if res != None or part_path.read_bytes() != DATA:
+		return (False, "Download failed (%s)" % res)
+
+	if [request.get('Range') for request in server.requests] != [None, "bytes=1000-", "bytes=6000-"]:
+		return (False, "Didn't carry on from the right places: %s" % server.requests)
+
+	if server.requests[1].get('If-Range') != ETAG:
+		return (False, "Didn't send If-Range")
+
+	return (True,)
+
+def test_resume_later(folder):
+	# Part of it from an earlier try
+	def setup(part_path, etag_path):
+		part_path.write_bytes(DATA[:12345])
+		etag_path.write_text(ETAG)
+
+	server = FakeServer()
+	res, part_path, _ = download(folder, server, setup)
+
+	if res != None or part_path.read_bytes() != DATA:
+		return (False, "Download failed (%s)" % res)
+
+	if server.requests[0].get('Range') != "bytes=12345-":
+		return (False, "Didn't carry on from what was there: %s" % server.requests)
+
+	return (True,)
+
+def test_changed_version(folder):
+	# Part of a different version, which has to be thrown away
+	def setup(part_path, etag_path):
+		part_path.write_bytes(os.urandom(50000))
+		etag_path.write_text('"1500000000-012345"')
+
+	res, part_path, _ = download(folder, FakeServer(), setup)
+
+	if res != None or part_path.read_bytes() != DATA:
+		return (False, "Download failed (%s)" % res)
+
+	return (True,)
+
+def test_already_complete(folder):
+	def setup(part_path, etag_path):
+		part_path.write_bytes(DATA)
+		etag_path.write_text(ETAG)
+
+	server = FakeServer()
+	res, part_path, _ = download(folder, server, setup)
+
+	if res != None or part_path.read_bytes() != DATA or len(server.requests) != 1:
+		return (False, "Didn't notice it was already downloaded (%s)" % res)
+
+	return (True,)
+
+def test_gives_up(folder):
+	# Dropped every time, after a bit more each time
+	server = FakeServer([('raise', 100)] * DOWNLOAD_ATTEMPTS)
+	res, part_path, _ = download(folder, server)
+
+	if res == None or len(server.requests) != DOWNLOAD_ATTEMPTS:
+		return (False, "Didn't give up after %s tries" % DOWNLOAD_ATTEMPTS)
+
+	# What it got should be kept for next time
+	if part_path.read_bytes() != DATA[:100 * DOWNLOAD_ATTEMPTS]:
+		return (False, "Didn't keep what it downloaded")
+
+	return (True,)
+
+def test_error(folder):
+	res, _, _ = download(folder, FakeServer(status_code=404))
+
+	if res != "File not found":
+		return (False, "Wrong error: %s" % res)
+
+	return (True,)
+
+TESTS = [test_whole, test_resume, test_resume_later, test_changed_version, test_already_complete, test_gives_up, test_error]
+
+# Each entry = (test name, reason)
+failures = []
+
+for test in TESTS:
+	with tempfile.TemporaryDirectory() as folder:
+		res = test(folder)
+
+	# If it failed, add it to failures
+	if res[0] != True:
+		failures.append((test.__name__, res[1]))
+		print("x", end="")
+	else:
+		print(".", end="")
+
+print()
+print("%s tests, %s failures" % (len(TESTS), len(failures)))
+print("---")
+
+# Print failures
+for name, reason in failures:
+	print("%s: %s" % (name, reason))
+	print("---")
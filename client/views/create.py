@@ -6,7 +6,6 @@ from pathlib import Path
 import json
 
 from config import LocalFile
-from hash import sha256
 from statement import HistoryStatement
 from common import labelled_entry, header
 from views import ViewHasBackButton
@@ -107,10 +106,7 @@ class CreateFileView(ViewHasBackButton):
 		self.flash_message("Hashing file...")
 		self.app.tk.update()
 
-		with open(file_path, "rb") as f:
-			data = bytearray(f.read())
-
-		hashed = sha256(data)
+		hashed = self.app.config.hash_cache.get(file_path)
 
 		# Create a history statement using the hash and 32 0s
 		hs = HistoryStatement([0 for _ in range(0, 32)], hashed, self.app.config.username, comment)
@@ -128,13 +124,14 @@ class CreateFileView(ViewHasBackButton):
 		self.app.tk.update()
 		
 		self.app.ensure_authorised()
-		res = self.app.post('file/create', files={
-			'meta': ('meta', json.dumps({
-				'name': file_name,
-				'statement': signed
-			}), 'application/json'),
-			'data': ('data', data, 'application/octet-stream')
-		})
+		with open(file_path, "rb") as f:
+			res = self.app.post('file/create', files={
+				'meta': ('meta', json.dumps({
+					'name': file_name,
+					'statement': signed
+				}), 'application/json'),
+				'data': ('data', f, 'application/octet-stream')
+			})
 		res = res.json()
 
 
@@ -2,12 +2,16 @@ from tkinter import *
 from tkinter.ttk import *
 import tkinter.filedialog as filedialog
 
+import os
+from pathlib import Path
+
 from config import LocalFile
-from hash import sha256
+from hash import sha256_file
 from common import bool_to_tick, header
 from views import ViewHasBackButton
 from views.verify import VerifyHistoryView
 from views.permissions import FilePermissionsView
+from download import download_part, PART_SUFFIX, ETAG_SUFFIX
 
 class ServerFileListView(ViewHasBackButton):
 	def __init__(self, app, frame):
@@ -172,13 +176,18 @@ class ServerFileListView(ViewHasBackButton):
 		self.app.tk.update()
 
 		# Download the file
+		## It's saved next to where it's going until it's all there, so if it gets cut off, it can carry on
+		## from where it got to (including if they try again later)
+		part_path = Path(path + PART_SUFFIX)
+		etag_path = Path(path + ETAG_SUFFIX)
+
 		self.app.ensure_authorised()
-		res = self.app.get('file/download?file_id=%s' % selected_id)
+		error = download_part(self.app.get, 'file/download?file_id=%s' % selected_id, part_path, etag_path)
 
 		# If it fails
-		if res.status_code != 200:
+		if error != None:
 			# Show an error
-			messagebox.showerror('Error', 'Error downloading file: %s' % res.json()['message'])
+			messagebox.showerror('Error', 'Error downloading file: %s' % error)
 			
 			# Remove progress bar
 			self.progress_bar.destroy()
@@ -187,13 +196,16 @@ class ServerFileListView(ViewHasBackButton):
 			# Leave
 			return
 
-		data = res.content
 		self.progress_bar['value'] += 1
 		self.app.tk.update()
 
-		# Save to given location
-		with open(path, "wb") as f:
-			f.write(data)
+		# Hash it and move it to the given location
+		with open(part_path, "rb") as f:
+			digest = sha256_file(f)
+
+		os.replace(part_path, path)
+		if etag_path.exists():
+			etag_path.unlink()
 
 		self.progress_bar['value'] += 1
 		self.app.tk.update()
@@ -223,7 +235,7 @@ class ServerFileListView(ViewHasBackButton):
 		self.app.config.add_local_file(LocalFile(
 			selected_id,
 			path,
-			sha256(bytearray(data)),
+			digest,
 			last_statement,
 		))
 
@@ -1,10 +1,16 @@
 from tkinter import *
 from tkinter.ttk import *
+from threading import Thread
+from queue import Queue, Empty
 import requests
 
 from views import HomeView
 from common import labelled_entry
 from rsa import RSAKeypair
+from rsa.keygen import KeygenService, KeygenCancelled, KEY_SIZES, DEFAULT_KEY_SIZE
+
+# How often to check on key generation (ms)
+KEYGEN_POLL_MS = 100
 
 # Initial window to set the server url
 class SetServerURLView:
@@ -37,8 +43,9 @@ class SetServerURLView:
 			serverBaseUrl += '/'
 
 		# Make a test connection
+		# This goes through the app's session, so the connection can be used again for the next requests
 		try:
-			requests.get(serverBaseUrl)
+			self.app.session.get(serverBaseUrl)
 		except requests.exceptions.ConnectionError as _:
 			# If it fails,, notify the user and wait for them to try again
 			messagebox.showerror('Server not Found', 'The server doesnt seem to be responding.')	
@@ -79,16 +86,23 @@ class NewAccountView:
 		## Invite code
 		self.invite_code_entry = labelled_entry(self.frame, 4, "Invite Code: ")
 
+		## Key size (bits). Smaller keys are quicker to generate and use, but less secure
+		Label(self.frame, text="Key Size: ").grid(sticky=W, row=5, column=0)
+		self.key_size = StringVar(value=str(DEFAULT_KEY_SIZE))
+		self.key_size_combo = Combobox(self.frame, textvariable=self.key_size,
+			values=[str(x) for x in KEY_SIZES], state="readonly")
+		self.key_size_combo.grid(sticky=W, row=5, column=1)
+
 		## Submit button
 		self.submit_button = Button(self.frame, text="Submit", command=self.on_submit)
-		self.submit_button.grid(row=5)
+		self.submit_button.grid(row=6)
 	
 	# Flash a message to the bottom
 	def flash_message(self, msg):
 		# Create the label if it doesn't exist
 		if not hasattr(self, 'flash_label'):
 			self.flash_label = Label(self.frame, text="")
-			self.flash_label.grid(row=6, column=0)
+			self.flash_label.grid(row=7, column=0)
 
 		# Set the text
 		self.flash_label.config(text=msg)
@@ -145,15 +159,63 @@ class NewAccountView:
 	def create_user(self, username, bio, invite_code, password):
 		# Generate key
 		self.flash_message("Generating keypair...")
-		self.app.tk.update()
 
-		key = RSAKeypair.generate_keypair()
+		## Key generation runs on another thread (and other processes), so the window stays responsive
+		## It sends back messages through the queue, which we check every so often
+		self.keygen_queue = Queue()
+		self.keygen = KeygenService(bits=int(self.key_size.get()),
+			progress=lambda found, searched: self.keygen_queue.put(('progress', found, searched)))
+		Thread(target=self.run_keygen, daemon=True).start()
 
+		## Let the user cancel it
+		self.cancel_button = Button(self.frame, text="Cancel", command=self.keygen.cancel)
+		self.cancel_button.grid(row=6, column=1)
+
+		self.app.tk.after(KEYGEN_POLL_MS, self.poll_keygen, username, bio, invite_code, password)
+
+	# Runs on its own thread to generate the key
+	def run_keygen(self):
+		try:
+			key = RSAKeypair.generate_keypair(self.keygen)
+			self.keygen_queue.put(('done', key))
+		except KeygenCancelled as _:
+			self.keygen_queue.put(('cancelled',))
+		except Exception as e:
+			self.keygen_queue.put(('error', str(e)))
+
+	# Check for messages from the key generation thread
+	def poll_keygen(self, username, bio, invite_code, password):
+		## Deal with everything that's been sent so far
+		while True:
+			try:
+				msg = self.keygen_queue.get_nowait()
+			except Empty:
+				break
+
+			if msg[0] == 'progress':
+				self.flash_message("Generating keypair... (found %s primes after %s searches)" % (msg[1], msg[2]))
+			elif msg[0] == 'done':
+				self.cancel_button.destroy()
+				self.register_user(msg[1], username, bio, invite_code, password)
+				return
+			else:
+				## Cancelled or failed, so let them try again
+				self.cancel_button.destroy()
+				self.flash_message("Key generation cancelled" if msg[0] == 'cancelled' else "Key generation failed: %s" % msg[1])
+				self.set_all_state(NORMAL)
+				if not self.encrypt_key:
+					self.password_entry.config(state=DISABLED)
+				return
+
+		## Check again later
+		self.app.tk.after(KEYGEN_POLL_MS, self.poll_keygen, username, bio, invite_code, password)
+
+	def register_user(self, key, username, bio, invite_code, password):
 		# Register with server
 		self.flash_message("Registering with server...")
 		self.app.tk.update()
 		
-		res = requests.post(self.serverBaseUrl + 'register', json={
+		res = self.app.session.post(self.serverBaseUrl + 'register', json={
 			'invite_code': invite_code,
 			'name': username,
 			'bio': bio,
@@ -189,5 +251,6 @@ class NewAccountView:
 		self.encrypt_key_check.config(state=state)
 		self.password_entry.config(state=state)
 		self.invite_code_entry.config(state=state)
+		self.key_size_combo.config(state="readonly" if state == NORMAL else state)
 		self.submit_button.config(state=state)
 		
\ No newline at end of file
@@ -53,8 +53,8 @@ class UploadLocalView(ViewHasBackButton):
 				continue
 
 			## Otherwise, hash it
-			with open(local_file.path, "rb") as f:
-				currentHash = sha256(bytearray(f.read()))
+			## The cache only actually reads the file if it's changed since it was last hashed
+			currentHash = self.app.config.hash_cache.get(local_file.path)
 
 			## Check if the hash is different
 			if currentHash != local_file.hashAcquired:
@@ -63,6 +63,9 @@ class UploadLocalView(ViewHasBackButton):
 					local_file.path,
 				))
 
+		# Stop remembering hashes of files that aren't tracked anymore
+		self.app.config.hash_cache.prune([local_file.path for local_file in self.app.config.local_files])
+
 		# Clear focus and disable upload button
 		self.tree.focus("")
 
@@ -90,10 +93,8 @@ class UploadLocalView(ViewHasBackButton):
 		local_file = self.app.config.local_files[selected_idx]
 
 		# Make a history statement
-		## Get the file's current hash and data
-		with open(local_file.path, "rb") as f:
-			data = bytearray(f.read())
-			hashUploaded = sha256(data)
+		## Get the file's current hash
+		hashUploaded = self.app.config.hash_cache.get(local_file.path)
 		
 		self.progress_bar['value'] = 1
 		self.app.tk.update()
@@ -122,13 +123,14 @@ class UploadLocalView(ViewHasBackButton):
 
 		# Upload it to the server
 		self.app.ensure_authorised()
-		res = self.app.post('file/upload', files={
-			'meta': ('meta', json.dumps({
-				'file_id': local_file.id,
-				'statement': signed
-			}), 'application/json'),
-			'data': data
-		})
+		with open(local_file.path, "rb") as f:
+			res = self.app.post('file/upload', files={
+				'meta': ('meta', json.dumps({
+					'file_id': local_file.id,
+					'statement': signed
+				}), 'application/json'),
+				'data': f
+			})
 		res = res.json()
 
 		self.progress_bar['value'] = 4
@@ -6,35 +6,9 @@ from queue import Queue
 from threading import Thread
 
 from views import ViewHasBackButton
-from statement import HistoryStatement
+from statement import verify_chain, STATEMENTS_PER_TASK
+from workers import make_executor
 from rsa import RSAKeypair
-from hash import sha256
-from common import signed_message_to_bytes
-
-ZEROS_32 = bytearray([0 for _ in range(32)])
-
-# Returns a deserialised HistoryStatement or false
-def verify_statement(statement, key, alleged_username, hashPrev=ZEROS_32):
-	# Decrypt it
-	decrypted = key.decrypt_signed(statement['payload'])
-
-	# If it fails, this is invalid
-	if decrypted == False:
-		return False
-
-	# Deserialise it
-	hs = HistoryStatement.from_bytes(decrypted)
-
-	# Make sure previous hash matches what's expected
-	if hashPrev != hs.hashPrev:
-		return False
-
-	# Make sure username matches what it should be
-	if alleged_username != hs.username:
-		return False
-
-	# Looks valid
-	return hs
 
 # TODO: Error handling
 def verify_history(app, file, queue):
@@ -47,7 +21,9 @@ def verify_history(app, file, queue):
 
 	public_keys = {}
 	for row in res['users']:
-		public_keys[row['name']] = RSAKeypair.deserialise(row['public_key'])
+		## Users without a valid key can't have signed anything
+		if row['public_key'] != None:
+			public_keys[row['name']] = RSAKeypair.deserialise(row['public_key'])
 
 	# Get all history statements
 	res = app.get('file/getHistory?id=%s' % file['id'])
@@ -56,18 +32,19 @@ def verify_history(app, file, queue):
 	if not res['success']:
 		raise Exception(res['message'])
 
+	# Verify the whole chain at once
+	history = res['file']['history']
+	statements = [(statement['alleged_username'], statement['payload']) for statement in history]
+
+	## Long histories are checked on every core
+	if len(statements) > STATEMENTS_PER_TASK:
+		with make_executor() as executor:
+			verified = verify_chain(statements, public_keys.get, executor)
+	else:
+		verified = verify_chain(statements, public_keys.get)
+
 	# For each one,
-	for index, statement in enumerate(res['file']['history']):
-		# Find the correct public key to use
-		key = public_keys[statement['alleged_username']]
-
-		if index > 0:
-			prev_statement = res['file']['history'][index - 1]
-			hs = verify_statement(statement, key, statement['alleged_username'],
-				sha256(signed_message_to_bytes(prev_statement['payload'])))
-		else:
-			hs = verify_statement(statement, key, statement['alleged_username'])
-		
+	for statement, hs in zip(history, verified):
 		if hs != False:
 			# Add it to the queue so it's displayed
 			queue.put({
@@ -0,0 +1,9 @@
+# Pools of worker processes, for spreading slow work (like checking signatures) across CPUs
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# Make a pool of worker processes
+# Uses spawn rather than fork, so workers start clean instead of inheriting a copy of the GUI
+def make_executor(workers=None):
+	return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
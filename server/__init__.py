@@ -6,6 +6,7 @@ from config import SERVER_CONFIG
 from app import App, Handler
 from sys import exit, stdin
 from utils import random_string
+import hash
 
 if __name__ == "__main__":
 	# Configure logging
@@ -14,13 +15,20 @@ if __name__ == "__main__":
 	    format='[%(levelname)s %(threadName)s] %(message)s',
 	)
 
-	# Start server
+	logging.info("Using %s SHA-256 backend" % hash.active_backend.name)
+
+	# Start server, with whichever engine is configured
 	server_address = (SERVER_CONFIG['listen_host'], SERVER_CONFIG['listen_port'])
-	app = App(server_address, Handler)
+	if SERVER_CONFIG['engine'] == 'asyncio':
+		## Only import it if it's used
+		from async_app import AsyncApp
+		app = AsyncApp(server_address)
+	else:
+		app = App(server_address, Handler)
 
 	thread = threading.Thread(target=app.serve_forever)
 	thread.start()
-	logging.info("Started serving at %s:%s" % server_address)
+	logging.info("Started serving at %s:%s (%s engine)" % (server_address + (SERVER_CONFIG['engine'],)))
 
 	try:
 		# Recieve commands
@@ -44,6 +52,22 @@ if __name__ == "__main__":
 				else:
 					logging.warn("Failed to create invite code.")
 
+			elif cmd.startswith("findhash "):
+				# Look up which stored versions have the given content hash
+				content_hash = cmd.split(" ")[-1]
+				with app.pool.acquire() as conn:
+					sql = """SELECT file.name, StoredVersion.file_id, StoredVersion.created_at, StoredVersion.size
+						FROM StoredVersion, file
+						WHERE StoredVersion.content_hash = UNHEX(%s) AND file.id = StoredVersion.file_id"""
+					conn.execute(sql, (content_hash,))
+					rows = conn.fetchall()
+
+				if len(rows) == 0:
+					logging.info("No stored versions with hash %s" % content_hash)
+
+				for row in rows:
+					logging.info("%s (file %s) at %s, %s bytes" % row)
+
 			elif "make_admin" in cmd:
 				# TODO
 				pass
@@ -53,3 +77,7 @@ if __name__ == "__main__":
 	logging.info("Shutting down...")
 	app.shutdown()
 	thread.join()
+
+	# Stop the tree hashing workers
+	if app.hash_executor != None:
+		app.hash_executor.shutdown()
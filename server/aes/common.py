@@ -41,6 +41,30 @@ SBOX_REVERSE = [
         0x17, 0x2b, 0x04, 0x7e, 0xba, 0x77, 0xd6, 0x26, 0xe1, 0x69, 0x14, 0x63, 0x55, 0x21, 0x0c, 0x7d
         ]
 
+# The S-Boxes as NumPy arrays, so a whole array of bytes can be substituted at once
+SBOX_ARRAY = np.array(SBOX, dtype=np.uint8)
+SBOX_REVERSE_ARRAY = np.array(SBOX_REVERSE, dtype=np.uint8)
+
+# Indexes used to shift the rows of every block at once
+# Row r of the output is row r of the input, starting r columns along
+SHIFT_ROWS = np.array([[row for _ in range(4)] for row in range(4)])
+SHIFT_COLS = np.array([[(col + row) % 4 for col in range(4)] for row in range(4)])
+SHIFT_COLS_INVERSE = np.array([[(col - row) % 4 for col in range(4)] for row in range(4)])
+
+# Matrices used for mixing columns
+MIX_MATRIX = [
+    [2, 3, 1, 1],
+    [1, 2, 3, 1],
+    [1, 1, 2, 3],
+    [3, 1, 1, 2]
+]
+MIX_MATRIX_INVERSE = [
+    [14, 11, 13, 9],
+    [9, 14, 11, 13],
+    [13, 9, 14, 11],
+    [11, 13, 9, 14]
+]
+
 
 def addRoundKey(block, round_key):
     # For each value in the block
@@ -128,19 +152,9 @@ def mixColumn(orig, inverse):
     # Get the right multiplicative matrix
     mult = None
     if inverse:
-        mult = [
-            [14, 11, 13, 9],
-            [9, 14, 11, 13],
-            [13, 9, 14, 11],
-            [11, 13, 9, 14]
-        ]
+        mult = MIX_MATRIX_INVERSE
     else:
-        mult = [
-            [2, 3, 1, 1],
-            [1, 2, 3, 1],
-            [1, 1, 2, 3],
-            [3, 1, 1, 2]
-        ]
+        mult = MIX_MATRIX
 
     # Make space for output
     col = np.zeros(shape=(4,), dtype='int')
@@ -154,7 +168,7 @@ def mixColumn(orig, inverse):
         # For each row in orig column
         for j in range(0,4):
             # XOR accumulator with this row (index j) times the column index j of the row in the multiplication matrix (i) our output comes from
-            accumulator ^= galois_multiplication(orig[j], mult[i][j])
+            accumulator ^= MUL_TABLES[mult[i][j]][orig[j]]
 
         # Set this row to accumulator
         col[i] = accumulator
@@ -224,4 +238,122 @@ def galois_multiplication(a, b):
         # Right shift b 1 (Equivalent to / x)
         b >>= 1
         
-    return product
\ No newline at end of file
+    return product
+
+
+# Multiplication tables, so multiplying by a constant is just a lookup
+# MULn[x] = galois_multiplication(x, n)
+MUL2 = [galois_multiplication(x, 2) for x in range(256)]
+MUL3 = [galois_multiplication(x, 3) for x in range(256)]
+MUL9 = [galois_multiplication(x, 9) for x in range(256)]
+MUL11 = [galois_multiplication(x, 11) for x in range(256)]
+MUL13 = [galois_multiplication(x, 13) for x in range(256)]
+MUL14 = [galois_multiplication(x, 14) for x in range(256)]
+
+# Every number that's in one of the mix column matrices
+MUL_TABLES = {
+    1: list(range(256)),
+    2: MUL2,
+    3: MUL3,
+    9: MUL9,
+    11: MUL11,
+    13: MUL13,
+    14: MUL14
+}
+MUL_ARRAYS = dict([(factor, np.array(table, dtype=np.uint8)) for factor, table in MUL_TABLES.items()])
+
+# T-Tables
+# A column of the state is stored as a 32 bit word, with row 0 in the lowest byte.
+# TE[i][x] is the column you get from mixing a column with just SBOX[x] in row i, so a whole round
+# (SubBytes, ShiftRows, MixColumns) is 4 lookups and 4 XORs for each column.
+# TD is the same, but for the inverse S-Box and mix matrix.
+def make_t_tables(box, matrix):
+    tables = []
+    for row in range(4):
+        table = np.zeros(256, dtype='<u4')
+        for x in range(256):
+            word = 0
+            ## Column `row` of the matrix says how much of this byte goes in each output row
+            for out_row in range(4):
+                word |= MUL_TABLES[matrix[out_row][row]][box[x]] << (8 * out_row)
+            table[x] = word
+        tables.append(table)
+
+    return tables
+
+TE = make_t_tables(SBOX, MIX_MATRIX)
+TD = make_t_tables(SBOX_REVERSE, MIX_MATRIX_INVERSE)
+
+# Which column each row comes from after shifting rows, for each output column
+T_SHIFT = [np.array([(col + row) % 4 for col in range(4)]) for row in range(4)]
+T_SHIFT_INVERSE = [np.array([(col - row) % 4 for col in range(4)]) for row in range(4)]
+
+
+# The functions below work on every block of a message at once.
+# The message is held as an (N,4,4) array of uint8s, where [n, row, col] is byte (col * 4) + row of block n.
+
+# Turn data into an (N,4,4) array of blocks, padding the last one with 0s
+def get_block_array(data):
+    # Read it as bytes
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        arr = np.frombuffer(data, dtype=np.uint8)
+    else:
+        arr = np.array(data, dtype=np.uint8).flatten()
+
+    # Pad it to a whole number of blocks
+    padding = (BLOCK_SIZE - len(arr) % BLOCK_SIZE) % BLOCK_SIZE
+    arr = np.concatenate((arr, np.zeros(padding, dtype=np.uint8)))
+
+    # Each block is filled in column by column
+    return arr.reshape(-1, 4, 4).transpose(0, 2, 1)
+
+# Reverse of get_block_array, returns a flat array of bytes
+def flatten_block_array(blocks):
+    return np.ascontiguousarray(blocks.transpose(0, 2, 1)).flatten()
+
+# Replace every byte of every block using the S-Box
+def sbox_many(blocks, inverse=False):
+    if inverse:
+        return SBOX_REVERSE_ARRAY[blocks]
+    else:
+        return SBOX_ARRAY[blocks]
+
+# Circular shift each row of every block
+def shiftRows_many(blocks, inverse=False):
+    if inverse:
+        return blocks[:, SHIFT_ROWS, SHIFT_COLS_INVERSE]
+    else:
+        return blocks[:, SHIFT_ROWS, SHIFT_COLS]
+
+# Mix the columns of every block
+def mixColumns_many(blocks, inverse=False):
+    mult = MIX_MATRIX_INVERSE if inverse else MIX_MATRIX
+
+    # Multiply every byte by each number in the matrix once
+    products = {}
+    for factor in set([x for row in mult for x in row]):
+        products[factor] = MUL_ARRAYS[factor][blocks]
+
+    # Row i of each output column is the XOR of each row j of the input times mult[i][j]
+    out = np.empty_like(blocks)
+    for i in range(4):
+        out[:, i, :] = products[mult[i][0]][:, 0, :] ^ products[mult[i][1]][:, 1, :] ^ products[mult[i][2]][:, 2, :] ^ products[mult[i][3]][:, 3, :]
+
+    return out
+
+# Turn an (N,4,4) array of blocks into an (N,4) array of column words
+def pack_columns(blocks):
+    return np.ascontiguousarray(blocks.transpose(0, 2, 1)).view('<u4').reshape(-1, 4)
+
+# Reverse of pack_columns
+def unpack_columns(words):
+    return np.ascontiguousarray(words, dtype='<u4').view(np.uint8).reshape(-1, 4, 4).transpose(0, 2, 1)
+
+# SubBytes, ShiftRows and MixColumns on an (N,4) array of column words, using the T-Tables
+def t_round(words):
+    return TE[0][words[:, T_SHIFT[0]] & 0xff] ^ TE[1][(words[:, T_SHIFT[1]] >> 8) & 0xff] ^ TE[2][(words[:, T_SHIFT[2]] >> 16) & 0xff] ^ TE[3][words[:, T_SHIFT[3]] >> 24]
+
+# Inverse ShiftRows, SubBytes and MixColumns, using the T-Tables
+# Note that this mixes after substituting, so the round keys need to be mixed as well (see decrypt_blocks)
+def t_round_inverse(words):
+    return TD[0][words[:, T_SHIFT_INVERSE[0]] & 0xff] ^ TD[1][(words[:, T_SHIFT_INVERSE[1]] >> 8) & 0xff] ^ TD[2][(words[:, T_SHIFT_INVERSE[2]] >> 16) & 0xff] ^ TD[3][words[:, T_SHIFT_INVERSE[3]] >> 24]
@@ -0,0 +1,78 @@
+import numpy as np
+from secrets import token_bytes
+from aes.key_extension import get_key
+from aes.common import BLOCK_SIZE, get_block_array, flatten_block_array
+from aes.encrypt import encrypt_blocks
+
+# Counter (CTR) mode
+# Each block of keystream is the encryption of a counter block, which is the nonce followed by the
+# block's index as a 64 bit BE integer. The data is XORed with the keystream, so encrypting and
+# decrypting are the same thing, nothing needs padding, and any part of the keystream can be made
+# without the rest.
+
+NONCE_SIZE = 8
+
+# How many blocks of keystream each worker process makes at once (1MiB)
+BLOCKS_PER_TASK = 65536
+
+# Make a new random nonce
+# A nonce should never be used twice with the same key
+def new_nonce():
+    return token_bytes(NONCE_SIZE)
+
+# Make the counter blocks for blocks [first_block, first_block + count)
+def counter_blocks(nonce, first_block, count):
+    # Sanity check
+    assert len(nonce) == NONCE_SIZE
+
+    counters = np.arange(first_block, first_block + count, dtype='>u8').view(np.uint8).reshape(count, 8)
+    nonces = np.tile(np.frombuffer(bytes(nonce), dtype=np.uint8), (count, 1))
+
+    return get_block_array(np.concatenate((nonces, counters), axis=1))
+
+# Make keystream for blocks [first_block, first_block + count) from already extended round keys
+# This is what the worker processes run
+def keystream_blocks(round_keys, nonce, first_block, count):
+    return flatten_block_array(encrypt_blocks(counter_blocks(nonce, first_block, count), round_keys))
+
+# Returns the keystream for blocks [first_block, first_block + count) as a uint8 array
+# key can be raw bytes or an AESKey
+# If an executor is given, big ranges are split up and made in parallel on it
+def keystream(key, nonce, first_block, count, executor=None):
+    round_keys = get_key(key).round_keys
+
+    # Not worth sending to other processes if there's only one task
+    if executor == None or count <= BLOCKS_PER_TASK:
+        return keystream_blocks(round_keys, nonce, first_block, count)
+
+    # Hand out runs of blocks to the workers
+    futures = []
+    for start in range(first_block, first_block + count, BLOCKS_PER_TASK):
+        futures.append(executor.submit(keystream_blocks, round_keys, nonce, start, min(BLOCKS_PER_TASK, first_block + count - start)))
+
+    # Put them back together in order
+    return np.concatenate([future.result() for future in futures])
+
+# Encrypt or decrypt data, which starts offset bytes into the stream
+# Returns a bytearray the same length as data
+def crypt(data, key, nonce, offset=0, executor=None):
+    data = np.frombuffer(bytes(data), dtype=np.uint8)
+    if len(data) == 0:
+        return bytearray()
+
+    # Work out which blocks of keystream we need
+    first_block = offset // BLOCK_SIZE
+    last_block = (offset + len(data) - 1) // BLOCK_SIZE
+    stream = keystream(key, nonce, first_block, last_block - first_block + 1, executor)
+
+    # Skip any of the first block that comes before offset
+    skip = offset - first_block * BLOCK_SIZE
+
+    return bytearray((data ^ stream[skip:skip + len(data)]).tobytes())
+
+# Encrypt or decrypt an iterable of chunks (eg from reading a file bit by bit)
+# Yields a bytearray for each chunk, the same length as the chunk
+def crypt_chunks(chunks, key, nonce, offset=0, executor=None):
+    for chunk in chunks:
+        yield crypt(chunk, key, nonce, offset, executor)
+        offset += len(chunk)
@@ -1,5 +1,9 @@
 import numpy as np
-from aes.common import rotate_circular_left, sbox
+from functools import lru_cache
+from aes.common import rotate_circular_left, sbox, mixColumns_many, KEY_SIZE
+
+# How many keys to keep extended at once
+KEY_CACHE_SIZE = 16
 
 # Constant
 RCON = [
@@ -69,3 +73,39 @@ def createRoundKey(extended_keys, round_):
     # Interpret it as a 4x4 matrix
     arr = np.reshape(arr, (4,4), order='F')
     return arr
+
+# Get every round key at once, as a (15,4,4) array
+def createRoundKeys(extended_keys):
+    # Same layout as createRoundKey, but for every round
+    return np.array(extended_keys, dtype=np.uint8).reshape(15, 4, 4).transpose(0, 2, 1)
+
+# A key with its schedule already extended, so it can be used again and again without redoing it
+# Treat it as read only, since the same object is handed out to everything using the same key
+class AESKey:
+    # + AESKey(bytearray)
+    def __init__(self, key):
+        # Sanity check
+        assert len(key) == KEY_SIZE
+
+        self.key = bytes(key)
+
+        # Every round key as a (15,4,4) array
+        self.round_keys = createRoundKeys(extend_key(list(self.key)))
+
+        # The round keys with their columns unmixed, which decrypt_blocks needs
+        self.inverse_round_keys = mixColumns_many(self.round_keys, True)
+
+        self.round_keys.flags.writeable = False
+        self.inverse_round_keys.flags.writeable = False
+
+# Returns an AESKey for key, which can be raw bytes or already an AESKey
+# The last few keys used are remembered, so using the same key again doesn't extend it again
+def get_key(key):
+    if isinstance(key, AESKey):
+        return key
+
+    return cached_key(bytes([int(x) for x in key]))
+
+@lru_cache(maxsize=KEY_CACHE_SIZE)
+def cached_key(key):
+    return AESKey(key)
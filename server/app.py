@@ -1,81 +1,354 @@
 # Code & Objects for the web server, handles receiving requests and
 # handing them off to be processed
 
+import json
 import logging
+import selectors
+import socket
+import time
 import traceback
 
 from sys import stdin
 from http.server import BaseHTTPRequestHandler, HTTPServer
-from socketserver import ThreadingMixIn
+from queue import Queue, Full
+from threading import Thread, Lock
 
 from session import SessionStore
 from config import SERVER_CONFIG
 from routes import GET_ROUTES, POST_ROUTES, send_not_found, send_server_error
+from routes.common import OVERLOADED_MESSAGE
 from context import Context
 from pool import ConnectionPool
+from workers import make_executor
+from key_cache import PublicKeyCache
 
 # Main App, holds shared variables, listens for requests and creates handlers for them.
-class App(ThreadingMixIn, HTTPServer):
-	daemon_threads = True
+# Requests are handled by a fixed number of worker threads. Connections with a request to handle wait
+# in .queue for a worker to be free, and if that's full they're turned away with a 503 straight away.
+# Between requests, kept-alive connections are watched by .idle instead of holding on to a worker.
+class App(HTTPServer):
 	def __init__(self, *args, **kwargs):
 		# Call parent constructor
 		super(HTTPServer, self).__init__(*args, **kwargs)
 
-		# Make connection pool
-		self.pool = ConnectionPool(
-			SERVER_CONFIG['db_host'],
-			SERVER_CONFIG['db_port'],
-			SERVER_CONFIG['db_username'],
-			SERVER_CONFIG['db_password'],
-			SERVER_CONFIG['db_database'],
-			SERVER_CONFIG['db_pool_size']
-		)
-
-		# Initialise session store
-		self.session_store = SessionStore()
-
-# Handles a single request
-# This runs in its own thread
+		init_shared(self)
+
+		# Start the workers
+		# Each entry in the queue = (socket, client address, Handler or None if it's a new connection)
+		self.queue = Queue(admission_queue_size())
+		for i in range(0, worker_count()):
+			Thread(target=self.worker, name="Worker-%s" % i, daemon=True).start()
+
+		self.idle = IdleConnections(self)
+
+	# + process_request(socket, (str, int))
+	# Called by serve_forever for each new connection
+	def process_request(self, request, client_address):
+		self.admit((request, client_address, None))
+
+	# + resume(Handler)
+	# Called once a kept-alive connection has sent its next request
+	def resume(self, handler):
+		self.admit((handler.request, handler.client_address, handler))
+
+	# Add a connection to the queue, or turn it away if the queue's full
+	def admit(self, entry):
+		try:
+			self.queue.put_nowait(entry)
+		except Full as _:
+			self.reject(entry[0])
+
+	# Handle requests from the queue, forever
+	# This is what each worker thread runs
+	def worker(self):
+		while True:
+			request, client_address, handler = self.queue.get()
+			try:
+				# Handle a request, either from a new connection or a kept-alive one
+				if handler == None:
+					handler = self.RequestHandlerClass(request, client_address, self)
+				else:
+					handler.handle_next()
+			except Exception as _:
+				self.handle_error(request, client_address)
+				self.shutdown_request(request)
+				continue
+
+			# Either close it, or wait for the next request without holding on to this thread
+			if handler.close_connection:
+				self.shutdown_request(request)
+			elif handler.has_buffered_request():
+				self.resume(handler)
+			else:
+				self.idle.add(handler)
+
+	# Turn away a connection because we're too busy
+	# This runs on the thread accepting connections, so it doesn't wait for the client to read the response
+	# The response is the same as send_overloaded
+	def reject(self, request):
+		body = json.dumps({
+			'success': False,
+			'message': OVERLOADED_MESSAGE
+		}).encode('ascii')
+
+		head = "HTTP/1.1 503 Service Unavailable\r\nContent-Type: application/json\r\nContent-Length: %s\r\nRetry-After: %s\r\nConnection: close\r\n\r\n" % (
+			len(body), SERVER_CONFIG['overload_retry_after'])
+
+		try:
+			request.setblocking(False)
+			request.send(head.encode('ascii') + body)
+		except OSError as _:
+			pass
+
+		self.shutdown_request(request)
+
+# Connections being kept alive between requests
+# Rather than a worker thread waiting for each one's next request, they're all watched by one thread
+# here, and handed back to the workers (see App.resume) once there's something to read.
+# Ones that are idle for keep_alive_timeout seconds are closed.
+class IdleConnections:
+	# + IdleConnections(App)
+	def __init__(self, server):
+		self.server = server
+		self.selector = selectors.DefaultSelector()
+
+		# Handlers added from worker threads, waiting to be registered with the selector
+		# The selector's only used by our thread, so they're passed over in this list
+		self.added = []
+		self.lock = Lock()
+
+		# When each connection we're watching was last used (time.monotonic())
+		self.idle_since = {}
+
+		# Writing to wake_writer wakes up our thread, so it sees new connections straight away
+		self.wake_reader, self.wake_writer = socket.socketpair()
+		self.wake_reader.setblocking(False)
+		self.selector.register(self.wake_reader, selectors.EVENT_READ)
+
+		Thread(target=self.run, name="Keep-Alive", daemon=True).start()
+
+	# + add(Handler)
+	# Watch a connection until it sends another request. This is called from the worker threads
+	def add(self, handler):
+		with self.lock as _:
+			self.added.append(handler)
+
+		self.wake_writer.send(b"\0")
+
+	# Watch connections forever
+	def run(self):
+		while True:
+			## Wake up every second to close any connections that have timed out
+			events = self.selector.select(1)
+			now = time.monotonic()
+
+			# Hand back connections with something to read
+			for key, _ in events:
+				if key.fileobj == self.wake_reader:
+					self.clear_wakeups()
+					continue
+
+				self.selector.unregister(key.fileobj)
+				del self.idle_since[key.data]
+
+				## Ones the client closed are closed here, so they don't take up space in the queue
+				if key.data.client_closed():
+					key.data.close()
+				else:
+					self.server.resume(key.data)
+
+			# Start watching new ones
+			with self.lock as _:
+				added = self.added
+				self.added = []
+
+			for handler in added:
+				self.selector.register(handler.connection, selectors.EVENT_READ, handler)
+				self.idle_since[handler] = now
+
+			# Close ones that have been idle too long
+			for handler, since in list(self.idle_since.items()):
+				if now - since > SERVER_CONFIG['keep_alive_timeout']:
+					self.selector.unregister(handler.connection)
+					del self.idle_since[handler]
+					handler.close()
+
+	def clear_wakeups(self):
+		try:
+			while self.wake_reader.recv(4096):
+				pass
+		except BlockingIOError as _:
+			pass
+
+# Returns how many threads to handle requests on (see worker_threads in config.py)
+def worker_count():
+	if SERVER_CONFIG['worker_threads'] != None:
+		return SERVER_CONFIG['worker_threads']
+
+	return 2 * SERVER_CONFIG['db_pool_size']
+
+# Returns how many connections or requests can wait for a worker (see admission_queue_size in config.py)
+def admission_queue_size():
+	if SERVER_CONFIG['admission_queue_size'] != None:
+		return SERVER_CONFIG['admission_queue_size']
+
+	return 4 * worker_count()
+
+# Set up the variables shared by every request on server
+# Routes get to these through res.server, whichever engine is serving them (see also AsyncApp)
+def init_shared(server):
+	# Make connection pool
+	server.pool = ConnectionPool(
+		SERVER_CONFIG['db_host'],
+		SERVER_CONFIG['db_port'],
+		SERVER_CONFIG['db_username'],
+		SERVER_CONFIG['db_password'],
+		SERVER_CONFIG['db_database'],
+		SERVER_CONFIG['db_pool_size']
+	)
+
+	# Initialise session store
+	server.session_store = SessionStore()
+
+	# Cache of parsed public keys
+	server.key_cache = PublicKeyCache(SERVER_CONFIG['key_cache_size'])
+
+	# Make worker processes for tree hashing, if it's enabled
+	server.hash_executor = None
+	if SERVER_CONFIG['tree_hash']:
+		server.hash_executor = make_executor(SERVER_CONFIG['tree_hash_workers'])
+
+# Find the route for a request and call it
+# handler is what's passed to the route as res. It needs path, headers, rfile and server, as well as
+# the methods routes use to respond (send_response, send_header, end_headers, send_file and wfile)
+def handle_request(handler, routing_dict, has_body):
+	# Strip URL parameters & trailing / from URL
+	normalized_path = handler.path.split("?")[0] ## Get Everything before '?'
+
+	## Cut off last character if it's /
+	if normalized_path[-1] == "/":
+		normalized_path = normalized_path[:-1]
+
+	## Special case for index
+	if normalized_path == "":
+		normalized_path = "index"
+
+	# Look for a route that matches
+
+	## If none found, 404
+	if normalized_path not in routing_dict.keys():
+		### Skip over the body, so the next request on this connection can be read
+		if has_body and handler.headers['Content-Length'] != None:
+			handler.rfile.read(int(handler.headers['Content-Length']))
+
+		return send_not_found(handler)
+
+	route = routing_dict[normalized_path]
+
+	# Parse all the data into a context
+	ctx = Context(handler.path, handler.headers, handler.rfile, handler.server.session_store, has_body, handler.server.pool)
+
+	# Call appropriate handler
+	try:
+		route(ctx, handler)
+	except Exception as e:
+		# If there's an error, write 503 and log to console.
+		# We could be half way through a response, so don't use this connection again
+		handler.close_connection = True
+		send_server_error(handler)
+		logging.error("Error serving %s to %s: %s " % (handler.client_address, normalized_path, e))
+		traceback.print_tb(e.__traceback__)
+
+# Handles a single connection, which can have many requests on it
+# Each request is handled by whichever worker thread is free. The constructor handles the first one,
+# then App calls handle_next() for each one after that, until close_connection is set.
 class Handler(BaseHTTPRequestHandler):
-	# Actual logic for handling a request
-	def handle_request(self, routing_dict, has_body):
-		# Strip URL parameters & trailing / from URL
-		normalized_path = self.path.split("?")[0] ## Get Everything before '?'
+	# HTTP/1.1 keeps connections open between requests, as long as every response has a Content-Length
+	protocol_version = "HTTP/1.1"
 
-		## Cut off last character if it's /
-		if normalized_path[-1] == "/":
-			normalized_path = normalized_path[:-1]
+	# Give up on clients that stop sending part way through a request after this long (seconds)
+	timeout = SERVER_CONFIG['keep_alive_timeout']
 
-		## Special case for index
-		if normalized_path == "":
-			normalized_path = "index"
+	def setup(self):
+		super().setup()
 
-		# Look for a route that matches
+		# How many requests have come in on this connection
+		self.requests_handled = 0
 
-		## If none found, 404
-		if normalized_path not in routing_dict.keys():
-			return send_not_found(self)
+	# Handle one request
+	# BaseHTTPRequestHandler would keep handling requests until the connection closes, holding on to
+	# this thread while it waits for the next one
+	def handle(self):
+		self.close_connection = True
+		self.handle_one_request()
 
-		handler = routing_dict[normalized_path]
+	# + handle_next()
+	# Handle the next request on a kept-alive connection
+	def handle_next(self):
+		self.handle()
+		self.finish()
 
-		# Parse all the data into a context
-		ctx = Context(self.path, self.headers, self.rfile, self.server.session_store, has_body, self.server.pool)
+	# Only close the connection's files if we're done with it
+	def finish(self):
+		if self.close_connection:
+			super().finish()
 
-		# Call appropriate handler
+	# + has_buffered_request(): bool
+	# Returns true if the client has already sent (part of) another request, which has been read in
+	# with the last one. The socket won't show it as readable, so it needs handling straight away.
+	def has_buffered_request(self):
+		self.connection.setblocking(False)
 		try:
-			handler(ctx, self)
-		except Exception as e:
-			# If there's an error, write 503 and log to console.
-			send_server_error(self)
-			logging.error("Error serving %s to %s: %s " % (self.client_address, normalized_path, e))
-			traceback.print_tb(e.__traceback__)
+			return len(self.rfile.peek(1)) > 0
+		except OSError as _:
+			return False
+		finally:
+			self.connection.settimeout(self.timeout)
+
+	# + client_closed(): bool
+	# Whether the client has closed the connection, for when it's readable without a buffered request
+	def client_closed(self):
+		self.connection.setblocking(False)
+		try:
+			return self.connection.recv(1, socket.MSG_PEEK) == b""
+		except BlockingIOError as _:
+			return False
+		except OSError as _:
+			return True
+		finally:
+			self.connection.settimeout(self.timeout)
+
+	# + close()
+	# Close the connection, eg if it's been idle too long
+	def close(self):
+		self.close_connection = True
+		self.finish()
+		self.server.shutdown_request(self.request)
+
+	# Tell the client when it's sent as many requests on this connection as we allow
+	# Sending Connection: close also makes BaseHTTPRequestHandler close it after this response
+	def send_response(self, code, message=None):
+		super().send_response(code, message)
+
+		if self.requests_handled >= SERVER_CONFIG['keep_alive_max_requests']:
+			self.send_header('Connection', 'close')
+
+	# + send_file(file, int, int)
+	# Send count bytes of f from offset as the body, after end_headers()
+	# socket.sendfile uses os.sendfile where it can, so the file goes straight to the connection without
+	# being read into memory, and otherwise sends it in chunks
+	def send_file(self, f, offset, count):
+		self.wfile.flush()
+		self.connection.sendfile(f, offset, count)
 
 	# Redirect python's methods to ours
 	def do_GET(self):
-		self.handle_request(GET_ROUTES, False)
+		self.requests_handled += 1
+		handle_request(self, GET_ROUTES, False)
 
 	def do_POST(self):
-		self.handle_request(POST_ROUTES, True)
+		self.requests_handled += 1
+		handle_request(self, POST_ROUTES, True)
 
 	# Don't log every request
 	def log_message(self, format, *args):
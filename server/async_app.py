@@ -0,0 +1,342 @@
+# asyncio engine for the web server
+# An alternative to App, which uses a thread for every connection. Here connections are read and written
+# by coroutines on one event loop, so an idle or slow client only costs a coroutine. Once a whole request
+# has arrived, it's handed to the same route functions as App, on a fixed number of threads, since routes
+# block on the database.
+
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from http import HTTPStatus
+from http.client import parse_headers
+from io import BytesIO
+
+from config import SERVER_CONFIG
+from routes import GET_ROUTES, POST_ROUTES, send_bad_request
+from routes.common import send_json, send_overloaded
+from app import init_shared, handle_request, worker_count, admission_queue_size
+
+# Longest request line or header line we accept (bytes), same as http.server
+MAX_LINE = 65536
+
+# Most headers a request can have, same as http.client
+MAX_HEADERS = 100
+
+# Sent in the Server header of every response
+SERVER_VERSION = "SecureVCS (asyncio)"
+
+# Raised while reading a request if it's not valid HTTP
+class BadRequest(Exception):
+	pass
+
+# Main App when using the asyncio engine
+# Holds the same shared variables as App (see init_shared), so routes can use either
+class AsyncApp:
+	# + AsyncApp((str, int))
+	def __init__(self, server_address):
+		self.server_address = server_address
+
+		# Route handlers run on these threads
+		# Requests that come in when they're all busy wait for one, unless there's already too many waiting
+		self.executor = ThreadPoolExecutor(max_workers=worker_count(), thread_name_prefix='Handler')
+		self.max_in_flight = worker_count() + admission_queue_size()
+
+		# How many requests are being handled or waiting for a thread, and every open connection's StreamWriter
+		# These are only used on the event loop, so they don't need a lock
+		self.in_flight = 0
+		self.connections = set()
+
+		# Set up once we start serving
+		self.loop = None
+		self.stopping = None
+		self.started = threading.Event()
+
+		init_shared(self)
+
+	# + serve_forever()
+	# Serve until shutdown() is called
+	# The event loop runs on whichever thread calls this
+	def serve_forever(self):
+		self.loop = asyncio.new_event_loop()
+		asyncio.set_event_loop(self.loop)
+
+		try:
+			self.loop.run_until_complete(self.serve())
+		finally:
+			## Make sure shutdown() doesn't wait forever if we couldn't start
+			self.started.set()
+			self.loop.close()
+			self.executor.shutdown()
+
+	# + shutdown()
+	# Stop serving. This is called from another thread
+	def shutdown(self):
+		self.started.wait()
+		if self.stopping != None and not self.loop.is_closed():
+			self.loop.call_soon_threadsafe(self.stopping.set)
+
+	# Listen for connections until we're told to stop
+	async def serve(self):
+		self.stopping = asyncio.Event()
+		server = await asyncio.start_server(self.handle_connection, self.server_address[0], self.server_address[1], limit=MAX_LINE)
+		self.started.set()
+
+		async with server:
+			await self.stopping.wait()
+
+			## Stop accepting connections, then close any that are still open (eg ones being kept alive)
+			## Their coroutines see the connection close and finish up
+			server.close()
+			for writer in self.connections:
+				writer.close()
+
+			tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+			await asyncio.gather(*tasks, return_exceptions=True)
+
+	# Handles a single connection, which can have many requests on it
+	async def handle_connection(self, reader, writer):
+		client_address = writer.get_extra_info('peername')
+		requests_handled = 0
+		self.connections.add(writer)
+
+		try:
+			while True:
+				# Wait for the next request
+				# After the first one, the connection is only kept open for keep_alive_timeout if nothing's sent
+				if requests_handled == 0:
+					idle_timeout = SERVER_CONFIG['async_request_timeout']
+				else:
+					idle_timeout = SERVER_CONFIG['keep_alive_timeout']
+
+				try:
+					request = await read_request(reader, idle_timeout)
+				except BadRequest as e:
+					## Tell them what was wrong
+					await self.send_buffered(writer, client_address, lambda res: send_bad_request(res, str(e)))
+					return
+
+				## Connection closed without sending anything
+				if request == None:
+					return
+
+				command, path, headers, body, keep_alive = request
+				requests_handled += 1
+
+				# Find which routes we're using
+				if command == 'GET':
+					routing_dict = GET_ROUTES
+				elif command == 'POST':
+					routing_dict = POST_ROUTES
+				else:
+					await self.send_buffered(writer, client_address, lambda res: send_json(res, {
+						'success': False,
+						'message': "Unsupported method (%s)" % command
+					}, 501))
+					return
+
+				# Turn it away if too many requests are waiting already
+				if self.in_flight >= self.max_in_flight:
+					await self.send_buffered(writer, client_address, lambda res: send_overloaded(res, SERVER_CONFIG['overload_retry_after']))
+					return
+
+				# Call the route on one of the handler threads
+				# It writes straight to the connection as it goes, through the event loop
+				response = AsyncResponse(self, client_address, command, path, headers, body, LoopWriter(self.loop, writer),
+					keep_alive, requests_handled)
+
+				self.in_flight += 1
+				try:
+					await self.loop.run_in_executor(self.executor, handle_request, response, routing_dict, command == 'POST')
+				finally:
+					self.in_flight -= 1
+
+				await writer.drain()
+
+				if response.close_connection:
+					return
+		except asyncio.TimeoutError as _:
+			if requests_handled == 0:
+				logging.debug("Timed out waiting for a request from %s" % (client_address,))
+		except (ConnectionError, asyncio.IncompleteReadError) as _:
+			# Client went away
+			pass
+		except Exception as e:
+			logging.error("Error handling connection from %s: %s" % (client_address, e))
+		finally:
+			self.connections.discard(writer)
+			writer.close()
+			try:
+				await writer.wait_closed()
+			except Exception as _:
+				pass
+
+	# Respond without going to a handler thread, eg for errors
+	# respond is called with an AsyncResponse, and whatever it writes is sent once it's done
+	async def send_buffered(self, writer, client_address, respond):
+		buf = BytesIO()
+		respond(AsyncResponse(self, client_address, None, None, None, b"", buf, False))
+
+		writer.write(buf.getvalue())
+		await writer.drain()
+
+# Read a request from a connection
+# Waits up to idle_timeout seconds for it to start, then async_request_timeout for the rest of it
+# Returns (method, path, headers, body, keep alive?), or None if the connection is closed before anything is sent
+# Raises BadRequest if it's not valid, or asyncio.TimeoutError if it takes too long
+async def read_request(reader, idle_timeout):
+	# Request line = METHOD PATH VERSION
+	try:
+		line = await asyncio.wait_for(reader.readline(), idle_timeout)
+	except ValueError as _:
+		raise BadRequest("Request line too long")
+
+	if line == b"":
+		return None
+
+	words = line.decode('iso-8859-1').rstrip("\r\n").split()
+	if len(words) != 3 or not words[2].startswith("HTTP/"):
+		raise BadRequest("Bad request line")
+
+	return await asyncio.wait_for(read_request_rest(reader, words), SERVER_CONFIG['async_request_timeout'])
+
+# Read the rest of a request after its request line (split into words)
+async def read_request_rest(reader, words):
+	command, path, version = words
+
+	# Headers, up to an empty line
+	header_lines = []
+	while True:
+		try:
+			line = await reader.readline()
+		except ValueError as _:
+			raise BadRequest("Header line too long")
+
+		header_lines.append(line)
+
+		if line in (b"\r\n", b"\n", b""):
+			break
+
+		if len(header_lines) > MAX_HEADERS:
+			raise BadRequest("Too many headers")
+
+	headers = parse_headers(BytesIO(b"".join(header_lines)))
+
+	# Body, if there is one
+	body = b""
+	if headers['Content-Length'] != None:
+		try:
+			length = int(headers['Content-Length'])
+		except ValueError as _:
+			raise BadRequest("Invalid Content-Length")
+
+		if length < 0:
+			raise BadRequest("Invalid Content-Length")
+
+		body = await reader.readexactly(length)
+
+	# HTTP/1.1 connections are kept open unless the client says otherwise, older ones are closed unless it asks
+	connection = (headers['Connection'] or "").lower()
+	if version == "HTTP/1.0":
+		keep_alive = connection == "keep-alive"
+	else:
+		keep_alive = connection != "close"
+
+	return (command, path, headers, body, keep_alive)
+
+# File-like object for writing to a connection from a handler thread
+# Each write is handed to the event loop, and waits until it's been sent (mostly), so a slow client
+# holds up its handler rather than filling up memory
+class LoopWriter:
+	# + LoopWriter(AbstractEventLoop, StreamWriter)
+	def __init__(self, loop, writer):
+		self.loop = loop
+		self.writer = writer
+
+	# + write(bytes): int
+	def write(self, data):
+		asyncio.run_coroutine_threadsafe(self.write_async(bytes(data)), self.loop).result()
+		return len(data)
+
+	# + flush()
+	def flush(self):
+		pass
+
+	# + sendfile(file, int, int)
+	# Send count bytes of f from offset, waiting until it's all been sent
+	def sendfile(self, f, offset, count):
+		asyncio.run_coroutine_threadsafe(self.sendfile_async(f, offset, count), self.loop).result()
+
+	async def write_async(self, data):
+		self.writer.write(data)
+		await self.writer.drain()
+
+	## loop.sendfile uses os.sendfile where it can, and otherwise sends it in chunks
+	async def sendfile_async(self, f, offset, count):
+		await self.writer.drain()
+		await self.loop.sendfile(self.writer.transport, f, offset, count)
+
+# Passed to routes as res when using AsyncApp
+# Has everything from BaseHTTPRequestHandler that routes use, so they don't need to know which engine they're running on
+class AsyncResponse:
+	protocol_version = "HTTP/1.1"
+
+	# + AsyncResponse(AsyncApp, (str, int), str, str, HTTPMessage, bytes, file, bool, int)
+	# requests_handled is how many requests there have been on this connection, including this one
+	def __init__(self, server, client_address, command, path, headers, body, wfile, keep_alive=True, requests_handled=1):
+		self.server = server
+		self.client_address = client_address
+		self.command = command
+		self.path = path
+		self.headers = headers
+		self.rfile = BytesIO(body)
+		self.wfile = wfile
+
+		# Headers are kept until end_headers(), then sent all at once
+		self.headers_buffer = []
+
+		# Set if the connection should be closed after this response
+		self.close_connection = not keep_alive
+		self.requests_handled = requests_handled
+		self.sent_close = False
+
+	# + send_response(int, str)
+	def send_response(self, code, message=None):
+		if message == None:
+			try:
+				message = HTTPStatus(code).phrase
+			except ValueError as _:
+				message = ""
+
+		self.headers_buffer.append(("%s %d %s\r\n" % (self.protocol_version, code, message)).encode('latin-1'))
+		self.send_header('Server', SERVER_VERSION)
+		self.send_header('Date', formatdate(usegmt=True))
+
+		## Tell the client when it's sent as many requests on this connection as we allow
+		if self.requests_handled >= SERVER_CONFIG['keep_alive_max_requests'] or self.close_connection:
+			self.send_header('Connection', 'close')
+
+	# + send_header(str, str)
+	def send_header(self, keyword, value):
+		## Same as BaseHTTPRequestHandler, a route can ask for the connection to be closed
+		## We might have already said so in send_response, so make sure it's only sent once
+		if keyword.lower() == 'connection' and value.lower() == 'close':
+			self.close_connection = True
+			if self.sent_close:
+				return
+
+			self.sent_close = True
+
+		self.headers_buffer.append(("%s: %s\r\n" % (keyword, value)).encode('latin-1'))
+
+	# + end_headers()
+	def end_headers(self):
+		self.headers_buffer.append(b"\r\n")
+		self.wfile.write(b"".join(self.headers_buffer))
+		self.headers_buffer = []
+
+	# + send_file(file, int, int)
+	# Same as Handler.send_file
+	def send_file(self, f, offset, count):
+		self.wfile.sendfile(f, offset, count)
@@ -23,6 +23,34 @@ SERVER_CONFIG = {
 	# Port to listen on
 	'listen_port': 80,
 
+	# How connections are handled
+	# threads - Each request is handled by one of worker_threads threads. Kept-alive connections are
+	#           watched by one thread between requests, so idle clients don't hold on to a worker.
+	# asyncio - Connections are read and written by coroutines on one event loop, and only the route
+	#           handlers themselves run on worker_threads threads. Best for lots of idle or slow clients.
+	'engine': 'threads',
+
+	# How many threads requests are handled on (None = 2 per database connection)
+	# Each request needs a database connection, so there's no point making this a lot bigger than db_pool_size
+	'worker_threads': None,
+
+	# How many connections (threads engine) or requests (asyncio engine) can wait for a worker thread
+	# (None = 4 per worker thread). Any more are turned away with 503 Service Unavailable straight away,
+	# rather than making everyone wait longer.
+	'admission_queue_size': None,
+
+	# How long clients that are turned away are told to wait before trying again (seconds)
+	'overload_retry_after': 1,
+
+	# How long a client has to send a whole request before it's disconnected, with the asyncio engine (seconds)
+	'async_request_timeout': 60,
+
+	# Keep-alive
+	# Connections are kept open after each request, so clients don't need to reconnect for the next one
+	# They're closed if they're idle for keep_alive_timeout seconds, or after keep_alive_max_requests requests
+	'keep_alive_timeout': 15,
+	'keep_alive_max_requests': 100,
+
 	# Database connection info
 	'db_host': '127.0.0.1',
 	'db_port': 3306,
@@ -31,5 +59,20 @@ SERVER_CONFIG = {
 	'db_database': 'secureVCS',
 	
 	# How many connections to the database to maintain
-	'db_pool_size': 4
+	'db_pool_size': 4,
+
+	# Tree hashing of uploaded files
+	# When enabled, every uploaded version also gets a merkle tree hash, so ranges of it can be
+	# verified without hashing the whole file. Leaves are hashed in parallel on worker processes.
+	# Databases made before this was added need docs/migrations/01_tree_root.sql run first.
+	'tree_hash': False,
+
+	# Size of each leaf of the tree (bytes)
+	'tree_hash_leaf_size': 1024 * 1024,
+
+	# How many processes to hash leaves on (None = one per CPU)
+	'tree_hash_workers': None,
+
+	# How many users' public keys to keep parsed in memory
+	'key_cache_size': 256
 }
\ No newline at end of file
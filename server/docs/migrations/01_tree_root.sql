@@ -0,0 +1,3 @@
+-- Adds tree roots to history statements, for databases made before tree hashing was added
+-- Run this before turning on tree_hash in config.py
+ALTER TABLE HistoryStatement ADD tree_root BINARY(32) DEFAULT NULL;
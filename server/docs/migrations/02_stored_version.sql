@@ -0,0 +1,12 @@
+-- Adds the index of stored versions, for databases made before it was added
+-- Versions uploaded before this won't be in it, which everything that reads it allows for
+CREATE TABLE StoredVersion (
+	file_id INT NOT NULL,
+	created_at DATETIME NOT NULL,
+	content_hash BINARY(32) NOT NULL,
+	size BIGINT NOT NULL,
+
+	PRIMARY KEY (file_id, created_at),
+	INDEX (content_hash),
+	FOREIGN KEY (file_id, created_at) REFERENCES HistoryStatement(file_id, created_at)
+) ENGINE=InnoDB;
@@ -64,8 +64,22 @@ CREATE TABLE HistoryStatement (
 	created_at DATETIME,
 	alleged_username VARCHAR(50) NOT NULL,
 	payload VARBINARY(3584) NOT NULL,
+	tree_root BINARY(32) DEFAULT NULL,
 
 	PRIMARY KEY (file_id, created_at),
 	FOREIGN KEY (file_id) REFERENCES File(id),
 	FOREIGN KEY (alleged_username) REFERENCES User(name)
-) ENGINE=InnoDB;
\ No newline at end of file
+) ENGINE=InnoDB;
+
+-- Stored Version
+-- Index of what's in each version saved to disk, so it can be looked up without reading the file
+CREATE TABLE StoredVersion (
+	file_id INT NOT NULL,
+	created_at DATETIME NOT NULL,
+	content_hash BINARY(32) NOT NULL,
+	size BIGINT NOT NULL,
+
+	PRIMARY KEY (file_id, created_at),
+	INDEX (content_hash),
+	FOREIGN KEY (file_id, created_at) REFERENCES HistoryStatement(file_id, created_at)
+) ENGINE=InnoDB;
@@ -1,7 +1,13 @@
 # SHA-256 hashing function
+# The pure python implementation here is the reference, but sha256() and friends go through
+# whichever backend is fastest (see the bottom of this file)
 
+import hashlib
+import logging
 from math import ceil
 
+import numpy as np
+
 # Constants
 CHUNK_SIZE_BYTES = 64
 
@@ -16,97 +22,299 @@ ROUND_CONSTANTS = [
 	0x748f82ee, 0x78a5636f, 0x84c87814, 0x8cc70208, 0x90befffa, 0xa4506ceb, 0xbef9a3f7, 0xc67178f2
 ]
 
+# Initial hash state, defined by the algorithm spec
+INITIAL_STATE = [0x6a09e667, 0xbb67ae85, 0x3c6ef372, 0xa54ff53a, 0x510e527f, 0x9b05688c, 0x1f83d9ab, 0x5be0cd19]
+
+# As ROUND_CONSTANTS, but as NumPy values so they don't change the type of lanes
+ROUND_CONSTANTS_LANES = [np.uint32(x) for x in ROUND_CONSTANTS]
+
+# How much of a file to read at once when hashing it in pieces
+READ_SIZE_BYTES = 64 * 1024
+
+# Groups of messages smaller than this are hashed one by one by sha256_many, since
+# setting up the arrays costs more than it saves
+MIN_LANES = 12
+
 # Takes in a bytearray of any size < 2^64 and returns a bytearray of those bytes' hash
 def sha256(arr):
-	# Don't mutate the caller's copy
-	arr = arr[:]
-
-	# Start with constants to return
-	out = [0x6a09e667, 0xbb67ae85, 0x3c6ef372, 0xa54ff53a, 0x510e527f, 0x9b05688c, 0x1f83d9ab, 0x5be0cd19]
+	# Feed the whole thing through a hasher in one go
+	hasher = new_hasher()
+	hasher.update(arr)
+
+	return hasher.digest()
+
+# Takes in a list of bytearrays and returns a list of their hashes, in the same order
+def sha256_many(buffers):
+	return active_backend.many(buffers)
+
+# Returns a new incremental hasher (with update, copy and digest) from the active backend
+def new_hasher():
+	return active_backend.new()
+
+# Takes in a file object opened in binary mode and returns a bytearray of its contents' hash
+# The file is read READ_SIZE_BYTES at a time, so it never all has to be in memory at once
+def sha256_file(f, read_size=READ_SIZE_BYTES):
+	hasher = new_hasher()
+
+	# Keep reading until we hit the end of the file
+	piece = f.read(read_size)
+	while len(piece) > 0:
+		hasher.update(piece)
+		piece = f.read(read_size)
+
+	return hasher.digest()
+
+# Incremental hasher, used the same way as hashlib's objects
+# Only ever stores the 8 word state, plus whatever's left over that doesn't fill a chunk yet (< 64 bytes)
+class SHA256:
+	# + SHA256(data=None)
+	def __init__(self, data=None):
+		self.state = INITIAL_STATE[:]
+		self.buffer = bytearray()
+		self.length = 0
+
+		if data != None:
+			self.update(data)
+
+	# + update(bytes)
+	# Add more data to what's being hashed
+	def update(self, data):
+		# Accept anything that can be made into bytes (bytearrays, lists of ints, etc)
+		if not isinstance(data, (bytes, bytearray, memoryview)):
+			data = bytes(data)
+		data = memoryview(data).cast('B')
+
+		# Keep track of the total length for the padding at the end
+		self.length += len(data)
+
+		i = 0
+
+		# If there's some data left over from last time, fill that chunk up first
+		if len(self.buffer) > 0:
+			i = min(CHUNK_SIZE_BYTES - len(self.buffer), len(data))
+			self.buffer.extend(data[:i])
+
+			## If it's still not full, wait for more data
+			if len(self.buffer) < CHUNK_SIZE_BYTES:
+				return
+
+			compress_chunk(self.state, self.buffer)
+			self.buffer = bytearray()
+
+		# Compress as many whole chunks as we can straight from the input
+		while i + CHUNK_SIZE_BYTES <= len(data):
+			compress_chunk(self.state, data[i:i + CHUNK_SIZE_BYTES])
+			i += CHUNK_SIZE_BYTES
+
+		# Keep the rest for next time
+		self.buffer.extend(data[i:])
+
+	# + copy(): SHA256
+	# Returns an independent hasher with the same state as this one
+	def copy(self):
+		other = SHA256()
+		other.state = self.state[:]
+		other.buffer = self.buffer[:]
+		other.length = self.length
+
+		return other
+
+	# + digest(): bytearray
+	# Returns the hash of everything passed to update() so far
+	# This doesn't change the hasher, so more data can still be added after
+	def digest(self):
+		# Work on a copy so we don't change the running state
+		out = self.state[:]
+		arr = self.buffer[:]
+
+		# Keep the original length in bits
+		orig_bits = self.length * 8
+
+		# Add a bit to the end of it
+		arr.append(0b1000_0000)
+
+		# Pad it so once we add the length to the end, it will be a multiple of 64 bytes.
+		while (len(arr) + 8) % CHUNK_SIZE_BYTES != 0:
+			arr.append(0)
+
+		# Add the original # of bits to the end as a 64-bit BE integer.
+		arr.extend(orig_bits.to_bytes(8, byteorder='big', signed=False))
+
+		# Compress the last 1 or 2 chunks
+		for i in range(0, len(arr) // CHUNK_SIZE_BYTES):
+			compress_chunk(out, arr[i * CHUNK_SIZE_BYTES:(i + 1) * CHUNK_SIZE_BYTES])
+
+		# Change out to a bytearray rather than words.
+		return words_to_bytearray(out)
+
+	# + hexdigest(): String
+	def hexdigest(self):
+		return self.digest().hex()
+
+# Run one 64 byte chunk through the compression function
+# out is the 8 word state, and is updated in place
+def compress_chunk(out, chunk):
+	# Compile work schedule
+	# This is an array of 64 32-bit integers
+	schedule = [0 for _ in range(0, 64)]
+
+	# Copy 64 bytes of chunk to first 16 words (32bit integers) of schedule
+	for i in range(0, 16):
+		schedule[i] = sum([
+			chunk[4 * i + 0] << 24,
+			chunk[4 * i + 1] << 16,
+			chunk[4 * i + 2] << 8,
+			chunk[4 * i + 3] << 0,
+		])
+
+	# Expand the rest of the schedule
+	for i in range(16, 64):
+		# 
+		a = schedule_op_a(schedule[i - 15])
+		b = schedule_op_b(schedule[i - 2])
+		s = a + b + schedule[i - 16] + schedule[i - 7]
+		schedule[i] = s & 0xffffffff # Limit to 32 bits
+
+	# Main compression loop
+	# For each part of the work schedule
+	compressed = out[:]
+	for i in range(0, 64):
+		# These operations are defined by the algorithm spec
+		# Assume a-h = compressed[0-7]
+		# All operations are & 0xffffffff to limit them to 32-bits
+
+		a = compression_op_a(compressed[4])
+		b = compression_op_b(compressed[0])
+
+		# (e & f) ^ (!e & g)
+		ch = (compressed[4] & compressed[5]) ^ (~compressed[4] & compressed[6]) & 0xffffffff
+
+		# (a & b) ^ (a & c) ^ (b & c)
+		maj = (compressed[0] & compressed[1]) ^ (compressed[0] & compressed[2]) ^ (compressed[1] & compressed[2]) & 0xffffffff
+		
+		# h + a + ch + constant for this round + this part of schedule
+		temp1 = (compressed[7] + a + ch + ROUND_CONSTANTS[i] + schedule[i]) & 0xffffffff
+
+		temp2 = b + maj
+
+		# Move each integer up the array, except for 4 which has some special ops
+		for j in range(7, 0, -1):
+			if j == 4:
+				compressed[j] = (compressed[j - 1] + temp1) & 0xffffffff
+			else:
+				compressed[j] = compressed[j-1]
+
+		# Now update the first record of the array
+		compressed[0] = (temp1 + temp2) & 0xffffffff
+
+	# Add the compression for this chunk to the final value
+	for i in range(0, 8):
+		out[i] = (out[i] + compressed[i]) & 0xffffffff
+
+
+# Reference version of sha256_many
+# Messages are hashed side by side as lanes of NumPy arrays, so the cost of going through
+# the compression function in python is paid once per batch, not once per message.
+def sha256_many_lanes(buffers):
+	digests = [None for _ in range(0, len(buffers))]
+
+	# Pad every message, and group them by how many chunks they take up
+	# Everything in a group can then be compressed together
+	groups = {}
+	for index, buf in enumerate(buffers):
+		padded = pad_message(buf)
+		num_chunks = len(padded) // CHUNK_SIZE_BYTES
+
+		if num_chunks not in groups:
+			groups[num_chunks] = []
+		groups[num_chunks].append((index, padded))
+
+	# Hash each group
+	for num_chunks, group in groups.items():
+		# Small groups aren't worth setting up arrays for, so just do them one by one
+		if len(group) < MIN_LANES:
+			for index, padded in group:
+				out = INITIAL_STATE[:]
+				for i in range(0, num_chunks):
+					compress_chunk(out, padded[i * CHUNK_SIZE_BYTES:(i + 1) * CHUNK_SIZE_BYTES])
+				digests[index] = words_to_bytearray(out)
+			continue
+
+		# Read all the messages as big endian words, one row per message
+		words = np.frombuffer(b"".join([padded for _, padded in group]), dtype='>u4')
+		words = words.astype(np.uint32).reshape(len(group), num_chunks, 16)
+
+		# Every lane starts with the same initial state
+		# state[i] is word i of the state for every message
+		state = [np.full(len(group), x, dtype=np.uint32) for x in INITIAL_STATE]
+
+		# Compress each chunk of every message at the same time
+		for i in range(0, num_chunks):
+			state = compress_lanes(state, words[:, i, :])
+
+		# Turn the state back into bytes, one digest per row
+		out = np.stack(state, axis=1).astype('>u4').tobytes()
+		for lane, (index, _) in enumerate(group):
+			digests[index] = bytearray(out[lane * 32:(lane + 1) * 32])
+
+	return digests
+
+# Pad a message the way the algorithm spec says, returning bytes with a length that's a multiple of 64
+def pad_message(arr):
+	arr = bytearray(arr)
 
 	# Keep the original length in bits
 	orig_bits = len(arr) * 8
 
-	# Add a bit to the end of it
+	# Add a bit to the end of it, then 0s until there's just space for the length
 	arr.append(0b1000_0000)
-
-	# Pad it so once we add the length to the end, it will be a multiple of 64 bytes.
-	while (len(arr) + 8) % CHUNK_SIZE_BYTES != 0:
-		arr.append(0)
+	arr.extend(bytes((CHUNK_SIZE_BYTES - 8 - len(arr)) % CHUNK_SIZE_BYTES))
 
 	# Add the original # of bits to the end as a 64-bit BE integer.
 	arr.extend(orig_bits.to_bytes(8, byteorder='big', signed=False))
 
-	# Loop throgh each chunk
-	for i in range(0, len(arr) // CHUNK_SIZE_BYTES):
-		# Get chunk data
-		chunk = arr[i * CHUNK_SIZE_BYTES:(i + 1) * CHUNK_SIZE_BYTES]
-
-		# Compile work schedule
-		# This is an array of 64 32-bit integers
-		schedule = [0 for _ in range(0, 64)]
-
-		# Copy 64 bytes of chunk to first 16 words (32bit integers) of schedule
-		for i in range(0, 16):
-			schedule[i] = sum([
-				chunk[4 * i + 0] << 24,
-				chunk[4 * i + 1] << 16,
-				chunk[4 * i + 2] << 8,
-				chunk[4 * i + 3] << 0,
-			])
-
-		# Expand the rest of the schedule
-		for i in range(16, 64):
-			# 
-			a = schedule_op_a(schedule[i - 15])
-			b = schedule_op_b(schedule[i - 2])
-			s = a + b + schedule[i - 16] + schedule[i - 7]
-			schedule[i] = s & 0xffffffff # Limit to 32 bits
-
-		# Main compression loop
-		# For each part of the work schedule
-		compressed = out[:]
-		for i in range(0, 64):
-			# These operations are defined by the algorithm spec
-			# Assume a-h = compressed[0-7]
-			# All operations are & 0xffffffff to limit them to 32-bits
-
-			a = compression_op_a(compressed[4])
-			b = compression_op_b(compressed[0])
-
-			# (e & f) ^ (!e & g)
-			ch = (compressed[4] & compressed[5]) ^ (~compressed[4] & compressed[6]) & 0xffffffff
-
-			# (a & b) ^ (a & c) ^ (b & c)
-			maj = (compressed[0] & compressed[1]) ^ (compressed[0] & compressed[2]) ^ (compressed[1] & compressed[2]) & 0xffffffff
-			
-			# h + a + ch + constant for this round + this part of schedule
-			temp1 = (compressed[7] + a + ch + ROUND_CONSTANTS[i] + schedule[i]) & 0xffffffff
-
-			temp2 = b + maj
-
-			# Move each integer up the array, except for 4 which has some special ops
-			for i in range(7, 0, -1):
-				if i == 4:
-					compressed[i] = (compressed[i - 1] + temp1) & 0xffffffff
-				else:
-					compressed[i] = compressed[i-1]
-
-			# Now update the first record of the array
-			compressed[0] = (temp1 + temp2) & 0xffffffff
-
-		# Add the compression for this chunk to the final value
-		for i in range(0, 8):
-			out[i] = (out[i] + compressed[i]) & 0xffffffff
-
-	# Change out to a bytearray rather than words.
-	final = []
+	return bytes(arr)
+
+# Change the 8 word state into a bytearray
+def words_to_bytearray(out):
+	final = bytearray()
 	for x in out:
-		final.extend(bytearray(x.to_bytes(4, byteorder='big', signed=False)))
+		final.extend(x.to_bytes(4, byteorder='big', signed=False))
+
+	return final
 
-	# Return a bytearray
-	return bytearray(final)
+# Same as compress_chunk, but for many chunks at once
+# state is a list of 8 arrays (one value per lane), chunk is an (lanes, 16) array of words
+# Returns the new state
+def compress_lanes(state, chunk):
+	# Compile the work schedule for every lane
+	schedule = [chunk[:, i] for i in range(0, 16)]
+	for i in range(16, 64):
+		a = rotate_right_lanes(schedule[i - 15], 7) ^ rotate_right_lanes(schedule[i - 15], 18) ^ (schedule[i - 15] >> np.uint32(3))
+		b = rotate_right_lanes(schedule[i - 2], 17) ^ rotate_right_lanes(schedule[i - 2], 19) ^ (schedule[i - 2] >> np.uint32(10))
 
+		# uint32s wrap around by themselves, so no need to limit them to 32 bits
+		schedule.append(a + b + schedule[i - 16] + schedule[i - 7])
+
+	# Main compression loop, exactly like compress_chunk but with the words given names
+	a, b, c, d, e, f, g, h = state
+	for i in range(0, 64):
+		s1 = rotate_right_lanes(e, 6) ^ rotate_right_lanes(e, 11) ^ rotate_right_lanes(e, 25)
+		ch = (e & f) ^ (~e & g)
+		temp1 = h + s1 + ch + ROUND_CONSTANTS_LANES[i] + schedule[i]
+
+		s0 = rotate_right_lanes(a, 2) ^ rotate_right_lanes(a, 13) ^ rotate_right_lanes(a, 22)
+		maj = (a & b) ^ (a & c) ^ (b & c)
+		temp2 = s0 + maj
+
+		h, g, f, e, d, c, b, a = g, f, e, d + temp1, c, b, a, temp1 + temp2
+
+	# Add the compression for this chunk to the state
+	return [x + y for x, y in zip(state, (a, b, c, d, e, f, g, h))]
+
+# Circular right shift of every lane in a uint32 array
+def rotate_right_lanes(x, y):
+	return (x >> np.uint32(y)) | (x << np.uint32(32 - y))
 
 # Circular right shift
 def rotate_right(x, y):
@@ -135,3 +343,140 @@ def compression_op_a(x):
 def compression_op_b(x):
     return rotate_right(x, 2) ^ rotate_right(x, 13) ^ rotate_right(x, 22)
 
+
+# Backends
+# A backend is a way of making incremental hashers, and of hashing a list of messages at once.
+# They're all checked against the reference on import, and the fastest one that gives the
+# right answers is used for everything.
+
+# Known good input/output pairs (also used by tests/test_hash.py)
+TEST_VECTORS = [
+	(bytearray("", 'ascii'),
+		bytearray.fromhex("e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855")),
+	(bytearray("abc", 'ascii'),
+		bytearray.fromhex("ba7816bf8f01cfea414140de5dae2223b00361a396177a9cb410ff61f20015ad")),
+	(bytearray("abcdefghijklmnopqrstuvwxyz012345", 'ascii'),
+		bytearray.fromhex("653bb1245e828fcda4fa53fcd5a3def5bd7654e651f54b4132b73d74e64435c4")),
+	(bytearray("Lorem ipsum dolor sit amet, consectetur adipiscing elit. Curabitur pharetra tortor ut turpis semper ullamcorper. Pellentesque urna massa, porta eget ipsum sed, blandit dictum erat. Sed eu pellentesque nisi. Nulla facilisi. Curabitur et dapibus orci, imperdiet commodo nisi. Sed elementum egestas vehicula. Cras nec sapien id eros lacinia malesuada. Orci varius natoque penatibus et magnis dis parturient montes, nascetur ridiculus mus. Vivamus cursus dapibus nisl, ut volutpat orci dignissim et. Sed quis elementum ipsum. Aliquam eget condimentum tellus, ut placerat elit. Morbi et euismod augue.", 'ascii'),
+		bytearray.fromhex("eee24d397f0270efa587a1873f4bfb6832f6998fa5c1944a97b6762e6c9c77bb")),
+]
+
+# Message lengths to cross check backends against the reference with
+# These are around the edges of where padding needs an extra chunk
+CHECK_LENGTHS = [1, 55, 56, 63, 64, 65, 119, 120, 200]
+
+class HashBackend:
+	# + HashBackend(String, Function, Function, Integer)
+	# new() returns a hasher, many(list) returns a list of hashes
+	# Higher priority backends are preferred
+	def __init__(self, name, new, many, priority):
+		self.name = name
+		self.new = new
+		self.many = many
+		self.priority = priority
+
+	def __str__(self):
+		return "<HashBackend %s>" % self.name
+
+# Wraps one of hashlib's objects so it acts exactly like SHA256 (digest returns a bytearray)
+class HashlibHasher:
+	def __init__(self, inner=None):
+		self.inner = inner if inner != None else hashlib.sha256()
+
+	def update(self, data):
+		if not isinstance(data, (bytes, bytearray, memoryview)):
+			data = bytes(data)
+		self.inner.update(data)
+
+	def copy(self):
+		return HashlibHasher(self.inner.copy())
+
+	def digest(self):
+		return bytearray(self.inner.digest())
+
+	def hexdigest(self):
+		return self.inner.hexdigest()
+
+# hashlib's sha256 is written in C, so it's much faster than anything we can do in python
+def hashlib_many(buffers):
+	return [bytearray(hashlib.sha256(bytes(buf)).digest()) for buf in buffers]
+
+# Every registered backend, by name
+BACKENDS = {}
+
+# The backend everything currently uses
+active_backend = None
+
+# + register_backend(HashBackend)
+def register_backend(backend):
+	BACKENDS[backend.name] = backend
+
+# + use_backend(String)
+# Switch every hashing function to the named backend
+def use_backend(name):
+	global active_backend
+	active_backend = BACKENDS[name]
+
+# + self_check(HashBackend): Boolean
+# Returns true if the backend gives the same answers as the test vectors and the reference
+def self_check(backend):
+	try:
+		# Check the known test vectors, both one by one and in a batch
+		inputs = [msg for msg, _ in TEST_VECTORS]
+		expected = [digest for _, digest in TEST_VECTORS]
+
+		for msg, digest in TEST_VECTORS:
+			hasher = backend.new()
+			hasher.update(msg)
+			if hasher.digest() != digest:
+				return False
+
+		if backend.many(inputs) != expected:
+			return False
+
+		# Cross check it against the reference with some messages of awkward lengths
+		# Each one's fed in two pieces, with a copy taken in between
+		messages = [bytearray([(i * 7) % 256 for i in range(0, length)]) for length in CHECK_LENGTHS]
+		reference = [sha256_reference(msg) for msg in messages]
+
+		for msg, digest in zip(messages, reference):
+			hasher = backend.new()
+			hasher.update(msg[:len(msg) // 2])
+			hasher = hasher.copy()
+			hasher.update(msg[len(msg) // 2:])
+			if hasher.digest() != digest:
+				return False
+
+		return backend.many(messages) == reference
+	except Exception as _:
+		# Anything going wrong means the backend can't be used
+		return False
+
+# Hash with the reference implementation, regardless of the active backend
+def sha256_reference(arr):
+	hasher = SHA256()
+	hasher.update(arr)
+	return hasher.digest()
+
+# + select_backend(): HashBackend
+# Check every backend, and use the highest priority one that passes
+def select_backend():
+	global active_backend
+
+	for backend in sorted(BACKENDS.values(), key=lambda x: -x.priority):
+		if self_check(backend):
+			active_backend = backend
+			return backend
+
+		logging.warning("SHA-256 backend %s failed its self check, not using it" % backend.name)
+
+	raise Exception("No SHA-256 backend passed its self check")
+
+# The pure python implementation in this file
+register_backend(HashBackend('reference', SHA256, sha256_many_lanes, 0))
+
+# hashlib, if it has sha256 (it always should, but some restricted builds leave algorithms out)
+if 'sha256' in hashlib.algorithms_available:
+	register_backend(HashBackend('hashlib', HashlibHasher, hashlib_many, 10))
+
+select_backend()
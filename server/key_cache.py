@@ -0,0 +1,104 @@
+# Cache of users' public keys
+# Every signed request needs the user's public key, which means a database query and parsing
+# a 4096 bit key. Keys hardly ever change, so the parsed keys are kept in memory instead.
+
+import logging
+from collections import OrderedDict
+from threading import Lock
+
+from rsa import RSAKeypair
+
+# .entries maps username -> (RSAKeypair, serialised public key), with the least recently used first
+# When it's full, the least recently used key is dropped
+# There's a lock around it because it's shared by every request thread
+class PublicKeyCache:
+	# + PublicKeyCache(int)
+	def __init__(self, size):
+		self.size = size
+		self.entries = OrderedDict()
+		self.lock = Lock()
+
+	# + get(ConnectionFromPool, str): RSAKeypair
+	# Returns the public key for username, or None if they don't exist
+	def get(self, db, username):
+		entry = self.get_many(db, [username]).get(username)
+		if entry == None:
+			return None
+
+		return entry[0]
+
+	# + get_serialised(ConnectionFromPool, str): str
+	# Returns the public key for username as a string (see RSAKeypair.serialise), or None if they don't exist
+	def get_serialised(self, db, username):
+		entry = self.get_many(db, [username]).get(username)
+		if entry == None:
+			return None
+
+		return entry[1]
+
+	# + get_many(ConnectionFromPool, List<str>): Dict<str, (RSAKeypair, str)>
+	# Returns (key, serialised key) for each user that exists and has a valid key
+	# Anyone that isn't cached is looked up with one query
+	def get_many(self, db, usernames):
+		found = {}
+		missing = []
+
+		# Get whatever we have cached
+		with self.lock as _:
+			for username in usernames:
+				if username in self.entries:
+					## Mark it as recently used
+					self.entries.move_to_end(username)
+					found[username] = self.entries[username]
+				else:
+					missing.append(username)
+
+		if len(missing) == 0:
+			return found
+
+		# Look up the rest
+		with db as conn:
+			sql = "SELECT name, HEX(public_key) FROM User WHERE name IN (%s)" % ", ".join(["%s"] * len(missing))
+			conn.execute(sql, tuple(missing))
+			rows = conn.fetchall()
+
+		# Names aren't case sensitive in the database, so match them up the same way
+		by_name = {}
+		for name, pk_hex in rows:
+			by_name[name] = pk_hex
+			by_name.setdefault(name.lower(), pk_hex)
+
+		# Parse them and cache them under the name we were asked for
+		## A key that won't parse is left out, the same as a user without one, rather than failing the whole lookup
+		for username in missing:
+			pk_hex = by_name.get(username, by_name.get(username.lower()))
+			if pk_hex == None:
+				continue
+
+			try:
+				found[username] = self.put(username, pk_hex)
+			except Exception as e:
+				logging.warning("Invalid public key stored for %s: %s" % (username, e))
+
+		return found
+
+	# + put(str, str): (RSAKeypair, str)
+	# Cache the key for username, from the hex stored in the database
+	def put(self, username, pk_hex):
+		entry = (RSAKeypair.from_binary_hex(pk_hex), RSAKeypair.binary_hex_to_serialised(pk_hex))
+
+		with self.lock as _:
+			self.entries[username] = entry
+			self.entries.move_to_end(username)
+
+			## Drop the least recently used ones if we're over the limit
+			while len(self.entries) > self.size:
+				self.entries.popitem(last=False)
+
+		return entry
+
+	# + invalidate(str)
+	# Forget about username's key, eg because it's changed
+	def invalidate(self, username):
+		with self.lock as _:
+			self.entries.pop(username, None)
@@ -0,0 +1,137 @@
+# Merkle tree (tree hash) of a file's contents
+# The file is split into leaves of a fixed size, which are each hashed on their own. Pairs of hashes
+# are then hashed together, level by level, until only one is left, which is the root.
+# Since the leaves don't depend on each other, they can be hashed on as many processes as we want,
+# and a range of the file can be checked against the root just by hashing the leaves in that range.
+
+import os
+
+from hash import sha256, sha256_many
+
+# Default size of each leaf (bytes)
+LEAF_SIZE = 1024 * 1024
+
+# Leaves and nodes are hashed with different prefixes so a node can never be passed off as a leaf
+LEAF_PREFIX = b"\x00"
+NODE_PREFIX = b"\x01"
+
+# How many leaves each worker process hashes at once
+LEAVES_PER_TASK = 8
+
+# Hash a single leaf
+def hash_leaf(leaf):
+	return sha256(LEAF_PREFIX + bytes(leaf))
+
+# Hash two child nodes together
+def hash_node(left, right):
+	return sha256(NODE_PREFIX + bytes(left) + bytes(right))
+
+# Returns the number of leaves a file of the given size has
+# Empty files still have 1 (empty) leaf
+def num_leaves(size, leaf_size=LEAF_SIZE):
+	return max(1, (size + leaf_size - 1) // leaf_size)
+
+# Hash leaves [start, start + count) of the file at path
+# This is what the worker processes run
+def hash_file_leaves(path, start, count, leaf_size):
+	hashes = []
+	with open(path, "rb") as f:
+		f.seek(start * leaf_size)
+		for _ in range(0, count):
+			hashes.append(hash_leaf(f.read(leaf_size)))
+
+	return hashes
+
+# Returns a list of the hashes of every leaf in data
+def leaf_hashes(data, leaf_size=LEAF_SIZE):
+	data = memoryview(data)
+	return [hash_leaf(data[i * leaf_size:(i + 1) * leaf_size]) for i in range(0, num_leaves(len(data), leaf_size))]
+
+# Returns a list of the hashes of every leaf in the file at path
+# If an executor is given, the leaves are hashed in parallel on it
+def file_leaf_hashes(path, leaf_size=LEAF_SIZE, executor=None):
+	count = num_leaves(os.path.getsize(path), leaf_size)
+
+	# Not worth sending to other processes if there's only one task
+	if executor == None or count <= LEAVES_PER_TASK:
+		return hash_file_leaves(path, 0, count, leaf_size)
+
+	# Hand out runs of leaves to the workers
+	futures = []
+	for start in range(0, count, LEAVES_PER_TASK):
+		futures.append(executor.submit(hash_file_leaves, path, start, min(LEAVES_PER_TASK, count - start), leaf_size))
+
+	# Put them back together in order
+	hashes = []
+	for future in futures:
+		hashes.extend(future.result())
+
+	return hashes
+
+# Combine a list of leaf hashes into the root hash
+def merkle_root(leaves):
+	level = [bytes(x) for x in leaves]
+
+	# Keep going until there's only one hash left
+	while len(level) > 1:
+		# Hash every pair on this level in one batch
+		pairs = [NODE_PREFIX + level[i] + level[i + 1] for i in range(0, len(level) - 1, 2)]
+		next_level = [bytes(x) for x in sha256_many(pairs)]
+
+		# If there's an odd one out, it moves up a level as it is
+		if len(level) % 2 == 1:
+			next_level.append(level[-1])
+
+		level = next_level
+
+	return bytearray(level[0])
+
+# Returns (root, leaf hashes) for data in memory
+def tree_hash(data, leaf_size=LEAF_SIZE):
+	leaves = leaf_hashes(data, leaf_size)
+	return (merkle_root(leaves), leaves)
+
+# Returns (root, leaf hashes) for the file at path
+def file_tree_hash(path, leaf_size=LEAF_SIZE, executor=None):
+	leaves = file_leaf_hashes(path, leaf_size, executor)
+	return (merkle_root(leaves), leaves)
+
+# Check that data is the part of a file starting at leaf first_leaf
+# root and leaves should be from the file's tree hash
+# data must start on a leaf boundary, and be a whole number of leaves unless it goes to the end of the file
+# Returns true if it's valid
+def verify_range(root, leaves, first_leaf, data, leaf_size=LEAF_SIZE):
+	# Make sure the leaves actually belong to the root
+	if merkle_root(leaves) != root:
+		return False
+
+	# Hash the leaves in data
+	data = memoryview(data)
+	count = num_leaves(len(data), leaf_size)
+	if first_leaf + count > len(leaves):
+		return False
+
+	hashes = leaf_hashes(data, leaf_size)
+
+	# Only the last leaf in the file is allowed to be short
+	if len(data) % leaf_size != 0 and first_leaf + count != len(leaves):
+		return False
+
+	# Compare them with what's expected
+	return all([bytes(x) == bytes(y) for x, y in zip(hashes, leaves[first_leaf:first_leaf + count])])
+
+# Turn a list of leaf hashes into bytes to store on disk, and back again
+# The format is the leaf size as an 8 byte BE integer, then each hash
+def leaves_to_bytes(leaves, leaf_size=LEAF_SIZE):
+	buf = bytearray(leaf_size.to_bytes(8, byteorder='big'))
+	for leaf in leaves:
+		buf.extend(leaf)
+
+	return buf
+
+# Returns (leaf size, leaf hashes)
+def leaves_from_bytes(buf):
+	leaf_size = int.from_bytes(buf[:8], byteorder='big')
+	leaves = [bytearray(buf[i:i + 32]) for i in range(8, len(buf), 32)]
+
+	return (leaf_size, leaves)
@@ -2,7 +2,7 @@
 
 import logging
 from threading import Lock
-from queue import Queue
+from circular_queue import Queue
 from time import sleep
 
 import mysql.connector
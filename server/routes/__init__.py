@@ -12,6 +12,7 @@ GET_ROUTES = {
 	'/files': file.list,
 	'/file/getHistory': file.getHistory,
 	'/file/download': file.download,
+	'/file/getTree': file.getTree,
 	'/file/getPermissions': permissions.getPermissions
 }
 
@@ -2,16 +2,31 @@
 
 import json
 
+from utils import random_string
+
+# Most ranges we'll send parts of in one response. If more are asked for, the whole thing is sent instead
+MAX_RANGES = 16
+
 # Returns true if the user is logged in
 def is_authorised(req):
 	return req.session != None and req.session.username != None
 
 # Send the given body as a JSON response with the given code (default=200 OK)
-def send_json(handler, body, code=200):
+# Any extra headers can be given as a dict
+def send_json(handler, body, code=200, headers={}):
+	encoded = json.dumps(body).encode('ascii')
+
 	handler.send_response(code)
 	handler.send_header('Content-Type', 'application/json')
+
+	# Connections are kept open between requests, so the client needs this to know where the body ends
+	handler.send_header('Content-Length', len(encoded))
+
+	for keyword, value in headers.items():
+		handler.send_header(keyword, value)
+
 	handler.end_headers()
-	handler.wfile.write(json.dumps(body).encode('ascii'))
+	handler.wfile.write(encoded)
 
 # Default 404 handler (when no route is found)
 def send_not_found(handler, message="404 Not Found"):
@@ -27,6 +42,138 @@ def send_server_error(handler):
 		'message': "503 Internal Server Error"
 	}, 503)
 
+# 503 Service Unavailable, for when there are already too many requests waiting
+# The connection is closed, and the client is told to try again after retry_after seconds
+def send_overloaded(handler, retry_after):
+	send_json(handler, {
+		'success': False,
+		'message': OVERLOADED_MESSAGE
+	}, 503, {
+		'Retry-After': retry_after,
+		'Connection': 'close'
+	})
+
+OVERLOADED_MESSAGE = "503 Server Busy"
+
+# Send the open file f (size bytes) as the response body
+# If the request has a Range header, only the parts it asks for are sent (206 Partial Content), unless it
+# also has an If-Range header that doesn't match etag, which means the client has parts of a different
+# version. etag should be a strong validator for this exact version of the file.
+def send_file_response(handler, f, size, etag):
+	ranges = parse_range(handler.headers['Range'], size)
+
+	## Partial responses only make sense if the client has what we'd send the rest of
+	if handler.headers['If-Range'] != None and handler.headers['If-Range'] != etag:
+		ranges = None
+
+	# None of the ranges are in the file
+	if ranges == []:
+		return send_json(handler, {
+			'success': False,
+			'message': "Range Not Satisfiable"
+		}, 416, {
+			'Content-Range': "bytes */%s" % size
+		})
+
+	# Whole file
+	# octet-stream means we don't know the type, ie it is arbritrary binary
+	if ranges == None:
+		handler.send_response(200)
+		handler.send_header('Content-Type', 'application/octet-stream')
+		handler.send_header('Content-Length', size)
+		send_file_headers(handler, etag)
+		handler.end_headers()
+
+		return handler.send_file(f, 0, size)
+
+	# One range, sent as the body
+	if len(ranges) == 1:
+		start, end = ranges[0]
+
+		handler.send_response(206)
+		handler.send_header('Content-Type', 'application/octet-stream')
+		handler.send_header('Content-Length', end - start + 1)
+		handler.send_header('Content-Range', "bytes %s-%s/%s" % (start, end, size))
+		send_file_headers(handler, etag)
+		handler.end_headers()
+
+		return handler.send_file(f, start, end - start + 1)
+
+	# Several ranges, each sent as a part of a multipart/byteranges body
+	## Work out each part's headers first, so we know the length of the whole thing
+	boundary = random_string(32)
+	part_heads = []
+	for start, end in ranges:
+		part_heads.append(("\r\n--%s\r\nContent-Type: application/octet-stream\r\nContent-Range: bytes %s-%s/%s\r\n\r\n" % (
+			boundary, start, end, size)).encode('ascii'))
+
+	tail = ("\r\n--%s--\r\n" % boundary).encode('ascii')
+	length = sum([len(head) for head in part_heads]) + sum([end - start + 1 for start, end in ranges]) + len(tail)
+
+	handler.send_response(206)
+	handler.send_header('Content-Type', "multipart/byteranges; boundary=%s" % boundary)
+	handler.send_header('Content-Length', length)
+	send_file_headers(handler, etag)
+	handler.end_headers()
+
+	for head, (start, end) in zip(part_heads, ranges):
+		handler.wfile.write(head)
+		handler.send_file(f, start, end - start + 1)
+
+	handler.wfile.write(tail)
+
+# Headers sent with every response from send_file_response that has the file in it
+def send_file_headers(handler, etag):
+	handler.send_header('Accept-Ranges', 'bytes')
+	if etag != None:
+		handler.send_header('ETag', etag)
+
+# Parse a Range header, for a body of size bytes
+# Returns a list of (first byte, last byte) sorted by position, with ones that overlap or touch merged,
+# [] if none of the ranges are in the body, or None if the header should be ignored and the whole body
+# sent (there isn't one, it's not valid, or it asks for too many ranges)
+def parse_range(header, size):
+	if header == None or not header.startswith("bytes="):
+		return None
+
+	specs = [spec.strip() for spec in header[len("bytes="):].split(",")]
+
+	## Empty items are allowed, eg "bytes=0-10,", as long as there's at least one range and not too many
+	specs = [spec for spec in specs if spec != ""]
+	if len(specs) == 0 or len(specs) > MAX_RANGES:
+		return None
+
+	ranges = []
+	for spec in specs:
+		first, sep, last = spec.partition("-")
+		if sep == "" or (first != "" and not first.isdigit()) or (last != "" and not last.isdigit()):
+			return None
+
+		if first == "":
+			## -n means the last n bytes
+			if last == "":
+				return None
+
+			if int(last) > 0 and size > 0:
+				ranges.append((max(0, size - int(last)), size - 1))
+		else:
+			## n- means from n to the end, and n-m is inclusive
+			if last != "" and int(last) < int(first):
+				return None
+
+			if int(first) < size:
+				ranges.append((int(first), size - 1 if last == "" else min(int(last), size - 1)))
+
+	# Merge them, so we never send the same bytes twice
+	merged = []
+	for start, end in sorted(ranges):
+		if len(merged) > 0 and start <= merged[-1][1] + 1:
+			merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+		else:
+			merged.append((start, end))
+
+	return merged
+
 # Default 400 handler (Bad Request)
 def send_bad_request(handler, message="Bad Request"):
 	send_json(handler, {
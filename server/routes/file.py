@@ -7,14 +7,15 @@
 
 import json
 import time
-from os import path
+from os import fstat
 import base64
 
-from routes.common import send_bad_request, is_authorised, send_json, send_not_found
-from rsa import RSAKeypair
+from routes.common import send_bad_request, is_authorised, send_json, send_not_found, send_file_response
 from hash import sha256
-from statement import HistoryStatement
-from utils import archive_filename, has_keys
+from statement import HistoryStatement, verify_chain
+from merkle import file_tree_hash, leaves_to_bytes, leaves_from_bytes
+from config import SERVER_CONFIG
+from utils import archive_filename, tree_filename, has_keys
 
 # POST /file/create
 def create(req, res):
@@ -27,7 +28,7 @@ def create(req, res):
 
 	filename = req.parts['meta']['name']
 	statement_signed = req.parts['meta']['statement']
-	data = bytearray(req.parts['data'])
+	data = req.parts['data']
 
 	# Verify authorisation
 	if not is_authorised(req):
@@ -44,19 +45,13 @@ def create(req, res):
 	# Verify the history statement (OR error)
 
 	## Get the user's public key
-	with req.db as conn:
-		sql = "SELECT HEX(public_key) FROM User WHERE name = %s"
-		conn.execute(sql, (req.session.username,))
-		user_row = conn.fetchone()
+	public_key = res.server.key_cache.get(req.db, req.session.username)
 
 	## This would mean the user's been deleted which shouldn't happen
-	if user_row == None:
+	if public_key == None:
 		req.session.username = None
 		return send_bad_request(res, "Invalid session")
 
-	## Deserialise the public key
-	public_key = RSAKeypair.from_binary_hex(user_row[0])
-
 	## Decrypt the statement
 	statement_decrypted = public_key.decrypt_signed(statement_signed)
 
@@ -93,6 +88,9 @@ def create(req, res):
 	with open(fs_name, "wb") as file:
 		file.write(data)
 
+	## Tree hash it, if enabled
+	tree_root = store_tree_hash(res, filename, created_at, req.session.username)
+
 	# Add to the database
 	with req.db as conn:
 		## Add the file first
@@ -102,8 +100,11 @@ def create(req, res):
 
 		## Add the first history statement
 		statement_signed_bytes = base64.b64decode(statement_signed.replace('---SIGNED MESSAGE---', ''))
-		sql = "INSERT INTO HistoryStatement (file_id, created_at, alleged_username, payload) VALUES (%s, from_unixtime(%s), %s, %s)"
-		conn.execute(sql, (file_id, created_at, req.session.username, statement_signed_bytes))
+		insert_history_statement(conn, file_id, created_at, req.session.username, statement_signed_bytes, tree_root)
+
+		## Index what we stored
+		sql = "INSERT INTO StoredVersion (file_id, created_at, content_hash, size) VALUES (%s, from_unixtime(%s), %s, %s)"
+		conn.execute(sql, (file_id, created_at, bytes(hashData), len(data)))
 
 	# Return success
 	return send_json(res, {
@@ -159,7 +160,12 @@ def getHistory(req, res):
 
 	# Get the file history from the database
 	with req.db as conn:
-		sql = "SELECT alleged_username, created_at, HEX(payload) FROM historystatement WHERE file_id = %s ORDER BY created_at ASC;"
+		## Also get what's stored for each version from the index, if it's there
+		## The tree_root column is only there if tree hashing has been set up (see tree_hash in config.py)
+		sql = """SELECT alleged_username, historystatement.created_at, HEX(payload), %s, HEX(content_hash), size
+			FROM historystatement LEFT JOIN storedversion ON
+				storedversion.file_id = historystatement.file_id AND storedversion.created_at = historystatement.created_at
+			WHERE historystatement.file_id = %%s ORDER BY historystatement.created_at ASC;""" % tree_root_column()
 		conn.execute(sql, (file_id,))
 
 		## For each row
@@ -168,7 +174,10 @@ def getHistory(req, res):
 			file['history'].append({
 				'alleged_username': row[0],
 				'created_at': row[1].strftime("%Y-%m-%d %H:%M:%S"),
-				'payload': '---SIGNED MESSAGE---\n' + base64.b64encode(bytes.fromhex(row[2])).decode('ascii') + '\n---SIGNED MESSAGE---'
+				'payload': '---SIGNED MESSAGE---\n' + base64.b64encode(bytes.fromhex(row[2])).decode('ascii') + '\n---SIGNED MESSAGE---',
+				'tree_root': row[3].lower() if row[3] != None else None,
+				'content_hash': row[4].lower() if row[4] != None else None,
+				'size': row[5]
 			})
 
 	# Return it
@@ -222,16 +231,20 @@ def upload(req, res):
 
 	# Verify their history statement
 	## Get the uploader's public key
-	with req.db as conn:
-		sql = "SELECT HEX(public_key) FROM User WHERE name = %s"
-		conn.execute(sql, (req.session.username,))
-		pk_hex = conn.fetchone()[0]
+	pk = res.server.key_cache.get(req.db, req.session.username)
 
-	pk = RSAKeypair.from_binary_hex(pk_hex)
+	if pk == None:
+		req.session.username = None
+		return send_bad_request(res, "Invalid session")
 
-	## Decrypt and deserialise the uploaded statement
-	statement_decrypted = pk.decrypt_signed(statement_signed)
-	statement = HistoryStatement.from_bytes(statement_decrypted)
+	## Check the signature, and that it's from the user whose session this is
+	## hashPrev is checked below, so we can give a better error
+	statement = verify_chain([(req.session.username, statement_signed)], {req.session.username: pk}.get,
+		res.server.hash_executor, None)[0]
+
+	if statement == False:
+		## If we fail to decrypt it, error
+		return send_bad_request(res, "Invalid History Statement")
 
 	## Get the latest history statement
 	with req.db as conn:
@@ -249,14 +262,10 @@ def upload(req, res):
 		return send_bad_request(res, "hashPrev is invalid")
 
 	## Verify their history statement matches the file they’re uploading (OR validity error) 
-	expected_hashUploaded = sha256(bytearray(data))
+	expected_hashUploaded = sha256(data)
 	if statement.hashUploaded != expected_hashUploaded:
 		return send_bad_request(res, "hashUploaded is invalid")
 
-	## Verify it matches their session's username
-	if statement.username != req.session.username:
-		return send_bad_request(res, "username is invalid")
-
 	# Save the file to disk
 	## created_at is now for consistency
 	created_at = int(time.time())
@@ -265,16 +274,21 @@ def upload(req, res):
 	fs_name = archive_filename(file['name'], created_at, req.session.username)
 
 	## Create and write the file
-	with open(fs_name, "wb") as file:
-		file.write(data)
+	with open(fs_name, "wb") as f:
+		f.write(data)
+
+	## Tree hash it, if enabled
+	tree_root = store_tree_hash(res, file['name'], created_at, req.session.username)
 
 	# Save the history statement to the database
 	with req.db as conn:
 		## Turn the signed statement into raw bytes
 		statement_signed_bytes = base64.b64decode(statement_signed.replace('---SIGNED MESSAGE---', ''))
+		insert_history_statement(conn, file_id, created_at, req.session.username, statement_signed_bytes, tree_root)
 
-		sql = "INSERT INTO HistoryStatement (file_id, created_at, alleged_username, payload) VALUES (%s, from_unixtime(%s), %s, %s)"
-		conn.execute(sql, (file_id, created_at, req.session.username, statement_signed_bytes))
+		## Index what we stored
+		sql = "INSERT INTO StoredVersion (file_id, created_at, content_hash, size) VALUES (%s, from_unixtime(%s), %s, %s)"
+		conn.execute(sql, (file_id, created_at, bytes(expected_hashUploaded), len(data)))
 
 	# Respond with success
 	send_json(res, {
@@ -328,9 +342,11 @@ def download(req, res):
 	with req.db as conn:
 		# This only returns a row if the file exists and the user has read access
 		# It will also get some info about the most recent history statement, from which we can find
-		# the file
-		sql = """SELECT file.name, UNIX_TIMESTAMP(historystatement.created_at), historystatement.alleged_username
-			FROM file, historystatement
+		# the file, and its hash from the index (or the statement, if it's from before the index)
+		sql = """SELECT file.name, UNIX_TIMESTAMP(historystatement.created_at), historystatement.alleged_username,
+				HEX(storedversion.content_hash), HEX(historystatement.payload)
+			FROM file, historystatement LEFT JOIN storedversion ON
+				storedversion.file_id = historystatement.file_id AND storedversion.created_at = historystatement.created_at
 			WHERE id = %s AND id IN (
 				SELECT file.id FROM file WHERE file.owner = %s 
 				UNION SELECT file.id FROM file, accesspermission WHERE
@@ -354,10 +370,107 @@ def download(req, res):
 
 	file_on_disk = archive_filename(filename, created_at, prev_username)
 
-	# Respond with the contents of that file
-	res.send_response(200)
-	# octet-stream means we don't know the type, ie it is arbritrary binary
-	res.send_header('Content-Type', 'application/octet-stream')
-	res.end_headers()
+	# Stored versions never change, so the time it was uploaded and its hash identify exactly what's sent
+	# Clients can use this to carry on a download that got cut off, with Range and If-Range
+	etag = '"%s-%s"' % (created_at, version_hash(row[3], row[4]))
+
+	# Respond with the contents of that file, or the parts of it that were asked for
+	# It's sent straight from disk rather than read into memory first, since it could be big
 	with open(file_on_disk, "rb") as f:
-		res.wfile.write(f.read())
\ No newline at end of file
+		send_file_response(res, f, fstat(f.fileno()).st_size, etag)
+
+# Returns the hash identifying a stored version, as hex, given what download gets from the database
+# This is the hash of its contents, or for versions from before they were indexed, the hash of
+# its (signed) history statement, which contains the hash of its contents
+def version_hash(content_hash, payload):
+	if content_hash != None:
+		return content_hash.lower()
+
+	return sha256(bytearray(bytes.fromhex(payload))).hex()
+
+# GET /file/getTree?file_id=1
+# Returns the tree hash of the latest version of a file, including all its leaf hashes
+def getTree(req, res):
+	# Get inputs from request
+	if not 'file_id' in req.params:
+		return send_bad_request(res)
+
+	file_id = req.params['file_id']
+
+	# Verify the users’ authorisation (OR error)
+	if not is_authorised(req):
+		return send_bad_request(res, "No Session")
+
+	# The database might not have tree roots at all if it's off
+	if not SERVER_CONFIG['tree_hash']:
+		return send_not_found(res, "Tree hashing is turned off")
+
+	# Verify they have read access to the file (OR error)
+	with req.db as conn:
+		# Same as in download, but gets the tree root as well
+		sql = """SELECT file.name, UNIX_TIMESTAMP(historystatement.created_at), historystatement.alleged_username, HEX(historystatement.tree_root)
+			FROM file, historystatement
+			WHERE id = %s AND id IN (
+				SELECT file.id FROM file WHERE file.owner = %s 
+				UNION SELECT file.id FROM file, accesspermission WHERE
+					file.id = accesspermission.file_id AND 
+					accesspermission.username = %s AND 
+					accesspermission.allow_read = 1
+			) AND file.is_archived = 0 AND historystatement.file_id = file.id
+			ORDER BY historystatement.created_at DESC
+			LIMIT 1;"""
+
+		conn.execute(sql, (file_id, req.session.username, req.session.username))
+		row = conn.fetchone()
+
+	if row == None:
+		return send_not_found(res, "File not found")
+
+	# Versions uploaded while tree hashing was off won't have one
+	if row[3] == None:
+		return send_not_found(res, "This version has no tree hash")
+
+	# Read the leaves from disk
+	with open(tree_filename(row[0], row[1], row[2]), "rb") as f:
+		leaf_size, leaves = leaves_from_bytes(f.read())
+
+	return send_json(res, {
+		'success': True,
+		'leaf_size': leaf_size,
+		'root': row[3].lower(),
+		'leaves': [leaf.hex() for leaf in leaves]
+	})
+
+# Add a history statement to the database, using the cursor conn
+# tree_root is only stored if tree hashing is on, so databases without the column still work when it's off
+def insert_history_statement(conn, file_id, created_at, username, payload, tree_root):
+	if SERVER_CONFIG['tree_hash']:
+		sql = "INSERT INTO HistoryStatement (file_id, created_at, alleged_username, payload, tree_root) VALUES (%s, from_unixtime(%s), %s, %s, %s)"
+		conn.execute(sql, (file_id, created_at, username, payload, tree_root))
+	else:
+		sql = "INSERT INTO HistoryStatement (file_id, created_at, alleged_username, payload) VALUES (%s, from_unixtime(%s), %s, %s)"
+		conn.execute(sql, (file_id, created_at, username, payload))
+
+# Returns what to select for a history statement's tree root
+# NULL if tree hashing is off, since the column might not exist
+def tree_root_column():
+	if SERVER_CONFIG['tree_hash']:
+		return "HEX(tree_root)"
+
+	return "NULL"
+
+# Work out the tree hash of a version that's just been saved to disk, storing the leaf hashes next to it
+# Returns the root, or None if tree hashing is turned off
+def store_tree_hash(res, filename, created_at, username):
+	if not SERVER_CONFIG['tree_hash']:
+		return None
+
+	# Hash it, using the worker processes
+	leaf_size = SERVER_CONFIG['tree_hash_leaf_size']
+	root, leaves = file_tree_hash(archive_filename(filename, created_at, username), leaf_size, res.server.hash_executor)
+
+	# Save the leaves
+	with open(tree_filename(filename, created_at, username), "wb") as f:
+		f.write(leaves_to_bytes(leaves, leaf_size))
+
+	return bytes(root)
@@ -7,12 +7,12 @@
 
 import base64
 import datetime
-import json
 import random
 from math import floor
 
 from rsa import RSAKeypair
 from rsa.classes import PUB_KEY_START, PUB_KEY_END
+from rsa.keygen import MIN_KEY_SIZE
 from routes.common import send_bad_request, send_server_error, is_authorised, send_json
 from utils import random_string, has_keys
 
@@ -39,6 +39,7 @@ def register(req, res):
 	try:
 		deserialised = RSAKeypair.deserialise(public_key)
 		assert deserialised.is_public
+		assert deserialised.n.bit_length() >= MIN_KEY_SIZE
 	except Exception as _:
 		valid = False
 
@@ -75,6 +76,9 @@ def register(req, res):
 			success = False
 
 	if success:
+		# Make sure we don't have an old key cached under this name
+		res.server.key_cache.invalidate(name)
+
 		# Return details of new user
 		return send_json(res, {
 			'success': True,
@@ -131,16 +135,15 @@ def submitChallenge(req, res):
 
 	# Get user from database (OR error)
 	with req.db as conn:
-		sql = "SELECT HEX(public_key), last_challenge_issued, challenge_issued_at FROM User WHERE name = %s"
+		sql = "SELECT last_challenge_issued, challenge_issued_at FROM User WHERE name = %s"
 		conn.execute(sql, (username,))
 		result = conn.fetchone()
 
 	if not result:
 		return send_bad_request(res, "User Not Found or Invalid challenge")
 
-	pk_hexstring = result[0]
-	last_challenge_issued = result[1]
-	challenge_issued_at = result[2]
+	last_challenge_issued = result[0]
+	challenge_issued_at = result[1]
 
 	# Verify challenge issued within 10 minutes (OR error)
 	mins_since = (datetime.datetime.now() - challenge_issued_at).seconds / 60
@@ -148,11 +151,13 @@ def submitChallenge(req, res):
 		return send_bad_request(res, "Challenge timed out")
 
 	# Decrypt signed challenge with public key
-	key = RSAKeypair.from_binary_hex(pk_hexstring)
+	key = res.server.key_cache.get(req.db, username)
+	if key == None:
+		return send_bad_request(res, "User Not Found or Invalid challenge")
 
 	# Verify equal to last challenge issued (OR error)
-	message = bytearray(key.decrypt_signed(challenge_answer)).decode('ascii')
-	if message == False or message != last_challenge_issued:
+	message = key.decrypt_signed(challenge_answer)
+	if message == False or bytearray(message).decode('ascii') != last_challenge_issued:
 		return send_bad_request(res, "User Not Found or Invalid challenge")
 
 	# Generate random session token
@@ -167,15 +172,13 @@ def submitChallenge(req, res):
 	req.cookies['session']['max-age'] = 2 * 60 * 60
 	req.cookies['session']['path'] = '/'
 
-	res.send_response(200)
-	res.send_header('Content-Type', 'application/json')
-	res.send_header('Set-Cookie', str(req.cookies).replace('Set-Cookie: ', ''))
-	res.end_headers()
-	res.wfile.write(json.dumps({
+	send_json(res, {
 		'success': True,
 		'session_cookie': cookie_val,
 		'username': username
-	}).encode('ascii'))
+	}, headers={
+		'Set-Cookie': str(req.cookies).replace('Set-Cookie: ', '')
+	})
 
 # GET /admin/genInviteCode
 # Generate a new invitecode, as long as you're an admin
@@ -227,17 +230,23 @@ def directory(req, res):
 	# Get the users from the database
 	users = []
 	with req.db as conn:
-		sql = "SELECT name, bio, is_admin, HEX(public_key) FROM User WHERE name != 'console'"
+		sql = "SELECT name, bio, is_admin FROM User WHERE name != 'console'"
 		conn.execute(sql)
 
 		for row in conn:
 			users.append({
 				'name': row[0],
 				'bio': row[1],
-				'is_admin': row[2] == 1,
-				'public_key': RSAKeypair.binary_hex_to_serialised(row[3])
+				'is_admin': row[2] == 1
 			})
 
+	# Add their public keys, from the cache where we can
+	# Anyone without a valid key gets None, so one bad row doesn't break the whole list
+	keys = res.server.key_cache.get_many(req.db, [user['name'] for user in users])
+	for user in users:
+		entry = keys.get(user['name'])
+		user['public_key'] = entry[1] if entry != None else None
+
 	# Return them
 	return send_json(res, {
 		'success': True,
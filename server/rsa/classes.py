@@ -1,5 +1,5 @@
-from rsa.keygen import generate_key
-from rsa.crypt import encrypt, decrypt
+from rsa.keygen import generate_key, recover_primes, DEFAULT_KEY_SIZE
+from rsa.crypt import encrypt, decrypt, decrypt_bytes, sign_hash, verify_hash_bytes, is_hash_signed_bytes, signed_to_bytes, ENCRYPTED_BLOCK_SIZE
 import base64
 
 # Banners used when serialising/deserialising
@@ -8,58 +8,108 @@ PUB_KEY_END = "\n---END PUBLIC KEY ---"
 PRIV_KEY_START = "---BEGIN PRIVATE KEY---\n"
 PRIV_KEY_END = "\n---END PRIVATE KEY---"
 
+# Keys used to just be n + e (+ d), always with a 512 byte n. Newer ones start with this and a version number
+KEY_MAGIC = b"RSA"
+LEGACY_PUBLIC_KEY_SIZE = 512 + 32
+LEGACY_PRIVATE_KEY_SIZE = 512 + 32 + 512
+
+# Version 2 = private keys with a fixed size n + e + d + p + q
+# Version 3 = any size of key, with each number prefixed by its length (see pack_ints)
+FIXED_PRIVATE_KEY_VERSION = 2
+KEY_VERSION = 3
+
 # Represents an RSA key, either public or private
 # Easiest way to deal with RSA encryption/decryption
 class RSAKeypair:
 
 	# Construct an instance with given key
 	# d can be none, in which case this is a public key
-	def __init__(self, e, d, n):
+	# p and q are optional for private keys, but make private operations faster
+	# size is the size of encrypted blocks and signatures (bytes), which defaults to the size of n
+	def __init__(self, e, d, n, p=None, q=None, size=None):
 		self.e = e
 		self.d = d
 		self.n = n
+		self.p = p
+		self.q = q
 		self.is_public = d == None
 
+		if size == None:
+			size = (n.bit_length() + 7) // 8
+		self.size = size
+
+		# Precompute what we need to use the CRT, if we can
+		# (p, q, d mod p-1, d mod q-1, q^-1 mod p)
+		self.crt = None
+		if not self.is_public and p != None and q != None:
+			self.crt = (p, q, d % (p - 1), d % (q - 1), pow(q, -1, p))
+
 	# Generate a new keypair
-	def generate_keypair():
-		e, d, n = generate_key()
+	# bits is the size of n, see KEY_SIZES
+	# If a KeygenService is given, it's used to search for the primes in parallel, with its own size
+	def generate_keypair(service=None, bits=DEFAULT_KEY_SIZE):
+		if service == None:
+			e, d, n, p, q = generate_key(bits)
+		else:
+			e, d, n, p, q = service.generate()
 
-		return RSAKeypair(e, d, n)
+		return RSAKeypair(e, d, n, p, q)
 
 	# Encrypt with the public exponent, to be decrypted with the private exponent
 	def encrypt(self, msg):
-		return encrypt(msg, self.e, self.n)
+		return encrypt(msg, self.e, self.n, size=self.size)
 
 	# Decrypt with the private exponent, msg should be encrypted with private exponent
-	def decrypt(self, msg):
+	# If an executor is given, long messages are decrypted in parallel on it
+	def decrypt(self, msg, executor=None):
 		if self.is_public:
 			return False
 
-		return decrypt(msg, self.d, self.n)
+		return decrypt(msg, self.d, self.n, self.crt, executor, self.size)
 
-	# Sign msg, ie encrypt with private exponent, to be decrypted with public exponent
+	# Sign msg, to be checked and read with decrypt_signed
+	# Only the hash of msg is signed (see sign_hash), so this is the same speed whatever the size of msg
 	def sign(self, msg):
 		if self.is_public:
 			return False
 
-		return encrypt(msg, self.d, self.n)
+		return sign_hash(msg, self.d, self.n, self.crt, self.size)
+
+	# Sign msg by encrypting all of it with the private exponent
+	# This is how messages used to be signed, and is only here for compatibility
+	def sign_legacy(self, msg, executor=None):
+		if self.is_public:
+			return False
+
+		return encrypt(msg, self.d, self.n, self.crt, executor, self.size)
 
-	# Decrypt signed message with public exponent
+	# Check a signed message with the public exponent, returning the original message or False
+	# Works with both sign and sign_legacy
 	def decrypt_signed(self, msg):
-		return decrypt(msg, self.e, self.n)
+		try:
+			decoded = signed_to_bytes(msg)
+		except Exception as _:
+			return False
+
+		return self.decrypt_signed_bytes(decoded)
+
+	# Same as decrypt_signed, but for a message that's already been decoded (see signed_to_bytes)
+	def decrypt_signed_bytes(self, decoded):
+		if is_hash_signed_bytes(decoded):
+			res = verify_hash_bytes(decoded, self.e, self.n, self.size)
+
+			# Old style signatures could start with the magic bytes by chance
+			if res != False:
+				return res
+
+		return decrypt_bytes(decoded, self.e, self.n, size=self.size)
 
 	# Serialise this key into a string
 	# This string can then be converted back to an instance with .deserialise()
 	# Pass force_public=True to make a public key, even if we have the private parts.
 	def serialise(self, force_public=False):
-		# n and e are in all keys
-		buf = self.n.to_bytes(512, byteorder='big')
-		buf += self.e.to_bytes(32, byteorder='big')
-		
-		# Add the private part, if we have it and we're not told not to
-		if not self.is_public and not force_public:
-			buf += self.d.to_bytes(512, byteorder='big')
-		
+		buf = self.to_bytes(force_public)
+
 		# Base64 encode it
 		encoded = base64.b64encode(buf).decode('ascii')
 
@@ -69,35 +119,97 @@ class RSAKeypair:
 		else:
 			return PRIV_KEY_START + encoded + PRIV_KEY_END
 
-
 	# Deserialise a string generated with .serialise() into an instance
 	def deserialise(buf):
 		# Check which banner it starts with
 		if buf[:len(PUB_KEY_START)] == PUB_KEY_START:
-			# Public key deserialisation
-
-			# Remove banners and decode
 			stripped = buf[len(PUB_KEY_START):-len(PUB_KEY_END)]
-			decoded = base64.b64decode(stripped)
-
-			# Public key = n + e
-			n = int.from_bytes(decoded[:512], byteorder='big')
-			e = int.from_bytes(decoded[512:], byteorder='big')
+			key = RSAKeypair.from_bytes(base64.b64decode(stripped))
 
-			return RSAKeypair(e, None, n)
+			## Make sure it's what the banner says it is
+			if not key.is_public:
+				raise Exception("Private key with public key banners")
 		else:
-			# Private key deserialisation
-
-			# Remove banners and decode
 			stripped = buf[len(PRIV_KEY_START):-len(PRIV_KEY_END)]
-			decoded = base64.b64decode(stripped)
-			
-			# Private key = n + e + d
-			n = int.from_bytes(decoded[:512], byteorder='big')
-			e = int.from_bytes(decoded[512:512 + 32], byteorder='big')
-			d = int.from_bytes(decoded[-512:], byteorder='big')
+			key = RSAKeypair.from_bytes(base64.b64decode(stripped))
+
+			if key.is_public:
+				raise Exception("Public key with private key banners")
+
+		return key
+
+	# Returns this key as bytes (see from_bytes)
+	# Public keys = magic + version + n + e
+	# Private keys = magic + version + n + e + d + p + q
+	# n is always padded to the size of the key, so the size doesn't get lost if n is a bit short
+	def to_bytes(self, force_public=False):
+		numbers = [self.n.to_bytes(self.size, byteorder='big'), self.e]
+
+		# Add the private part, if we have it and we're not told not to
+		if not self.is_public and not force_public:
+			p, q = (self.p, self.q)
+			if p == None or q == None:
+				p, q = recover_primes(self.e, self.d, self.n)
 
-			return RSAKeypair(e, d, n)
+			numbers += [self.d, p, q]
+
+		return KEY_MAGIC + bytes([KEY_VERSION]) + pack_ints(numbers)
+
+	# Makes an instance from bytes made by to_bytes, or any older format
+	def from_bytes(buf):
+		buf = bytes(buf)
+
+		# Old public key = n + e
+		if len(buf) == LEGACY_PUBLIC_KEY_SIZE:
+			n = int.from_bytes(buf[:512], byteorder='big')
+			e = int.from_bytes(buf[512:], byteorder='big')
+
+			return RSAKeypair(e, None, n, size=ENCRYPTED_BLOCK_SIZE)
+
+		# Old private key = n + e + d
+		if len(buf) == LEGACY_PRIVATE_KEY_SIZE:
+			n = int.from_bytes(buf[:512], byteorder='big')
+			e = int.from_bytes(buf[512:512 + 32], byteorder='big')
+			d = int.from_bytes(buf[-512:], byteorder='big')
+
+			# Work out p and q, so we can still use the CRT
+			p, q = recover_primes(e, d, n)
+
+			return RSAKeypair(e, d, n, p, q, ENCRYPTED_BLOCK_SIZE)
+
+		# Otherwise, check the version
+		if buf[:len(KEY_MAGIC)] != KEY_MAGIC or len(buf) <= len(KEY_MAGIC):
+			raise Exception("Unknown key format")
+
+		version = buf[len(KEY_MAGIC)]
+		buf = buf[len(KEY_MAGIC) + 1:]
+
+		# Version 2 = n + e + d + p + q, with fixed sizes
+		if version == FIXED_PRIVATE_KEY_VERSION:
+			n = int.from_bytes(buf[:512], byteorder='big')
+			e = int.from_bytes(buf[512:512 + 32], byteorder='big')
+			d = int.from_bytes(buf[544:544 + 512], byteorder='big')
+			p = int.from_bytes(buf[1056:1056 + 256], byteorder='big')
+			q = int.from_bytes(buf[1312:1312 + 256], byteorder='big')
+
+			return RSAKeypair(e, d, n, p, q, ENCRYPTED_BLOCK_SIZE)
+
+		if version != KEY_VERSION:
+			raise Exception("Unknown key version")
+
+		# Version 3 = n + e (+ d + p + q), and the size of the key is however long n is
+		fields = unpack_ints(buf)
+		size = len(fields[0])
+		numbers = [int.from_bytes(field, byteorder='big') for field in fields]
+
+		if len(numbers) == 2:
+			n, e = numbers
+			return RSAKeypair(e, None, n, size=size)
+		elif len(numbers) == 5:
+			n, e, d, p, q = numbers
+			return RSAKeypair(e, d, n, p, q, size)
+		else:
+			raise Exception("Wrong number of fields in key")
 
 	# Returns a serialised instance represented as a hexstring suitable for insertion to the database
 	# Always returns a public key
@@ -126,21 +238,57 @@ class RSAKeypair:
 	# Always returns a public key
 	# Use from_binary_hex to reverse this
 	def to_binary_hex(self):
-		buf = self.n.to_bytes(512, byteorder='big')
-		buf += self.e.to_bytes(32, byteorder='big')
-		
-		return buf.hex()
+		return self.to_bytes(force_public=True).hex()
 
 	# Makes an instance from a hex string from binary stored in the database
 	# This always returns a public key
 	def from_binary_hex(hex):
-		buf = bytes.fromhex(hex)
-		n = int.from_bytes(buf[:512], byteorder='big')
-		e = int.from_bytes(buf[512:], byteorder='big')
-		return RSAKeypair(e, None, n)
+		key = RSAKeypair.from_bytes(bytes.fromhex(hex))
+		if not key.is_public:
+			raise Exception("Private key stored as a public key")
+
+		return key
 
 	def __str__(self):
 		return "<RSAKeypair e=%s d=%s n=%s>" % (self.e, self.d, self.n)
 
 	def __eq__(self, other):
-		return self.e == other.e and self.d == other.d and self.n == other.n
\ No newline at end of file
+		# So comparing with None (eg from PublicKeyCache.get) works
+		if not isinstance(other, RSAKeypair):
+			return False
+
+		return self.e == other.e and self.d == other.d and self.n == other.n
+
+# Pack a list of ints (or bytes, which are used as they are) into bytes
+# Each one is prefixed with its length as a 2 byte BE integer, and takes up as few bytes as it can
+def pack_ints(numbers):
+	buf = bytearray()
+	for number in numbers:
+		if isinstance(number, int):
+			number = number.to_bytes((number.bit_length() + 7) // 8, byteorder='big')
+
+		buf += len(number).to_bytes(2, byteorder='big')
+		buf += number
+
+	return bytes(buf)
+
+# Split bytes made by pack_ints back up
+# Returns a list of bytes, one for each number
+def unpack_ints(buf):
+	fields = []
+	i = 0
+	while i < len(buf):
+		## Sanity check
+		if i + 2 > len(buf):
+			raise Exception("Truncated key")
+
+		length = int.from_bytes(buf[i:i + 2], byteorder='big')
+		i += 2
+
+		if i + length > len(buf):
+			raise Exception("Truncated key")
+
+		fields.append(buf[i:i + length])
+		i += length
+
+	return fields
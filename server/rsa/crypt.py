@@ -1,7 +1,6 @@
 from math import ceil
-from hash import sha256
-from secrets import randbelow
-import numpy as np
+from hash import sha256, sha256_many
+from secrets import token_bytes
 import base64
 
 # Size of output from hash_bytearray (bytes)
@@ -14,95 +13,86 @@ BLOCK_SIZE = 64
 BLOCK_MSG_SIZE = BLOCK_SIZE // 2
 
 # The size of each padded block after encryption (bytes)
-# Same as the size of n
+# Same as the size of n. This is the size for old keys, newer ones give their own size
 ENCRYPTED_BLOCK_SIZE = 512
 
+# How many blocks each worker process does at once, when decrypting in parallel
+BLOCKS_PER_TASK = 4
+
 # Encrypt/Sign bytearray M using private or public key (e, n)
+# crt can be given for private keys to make this faster, see crypt_bytearray
+# If an executor is given, long messages have their blocks encrypted in parallel on it
+# size is the size of n (bytes), which each encrypted block takes up
 # Returns a string
-def encrypt(M, e, n):
-	M = M[:] # Copy so we don't modify the caller's copy
+def encrypt(M, e, n, crt=None, executor=None, size=ENCRYPTED_BLOCK_SIZE):
+	M = bytes(M) # Copy so we don't modify the caller's copy
 	
-	# Get Hash = Hash of data
-	orig_hash = hash_bytearray(M)
+	# Generate random bytes (r)
+	r = rand_bytes(BLOCK_MSG_SIZE)
+
+	# Get Hash = Hash of data and G = Hash r in one go
+	orig_hash, G = hash_bytearrays([M, r])
 
 	# New data = data + Hash
-	M += orig_hash
+	M += bytes(orig_hash)
 
 	# Get number of blocks
 	num_blocks = ceil(len(M) / BLOCK_MSG_SIZE)
 
-	# Encrypt each block
-
-	## Generate random bytes (r)
-	r = rand_bytes(BLOCK_MSG_SIZE)
-
-	## G = Hash r
-	G = hash_bytearray(r)
-
-	## For each block
-	encrypted = []
-	for i in range(0, num_blocks):
-		## Get the data for that block
-		block = M[i * BLOCK_MSG_SIZE:(i + 1) * BLOCK_MSG_SIZE]
+	# If there's not enough for the last block, pad with 0s
+	M += bytes(num_blocks * BLOCK_MSG_SIZE - len(M))
 
-		## If there's not enough, pad with 0s
-		while len(block) < BLOCK_MSG_SIZE:
-			block.append(0)
+	# Split into blocks
+	blocks = [M[i * BLOCK_MSG_SIZE:(i + 1) * BLOCK_MSG_SIZE] for i in range(0, num_blocks)]
 
-		## Add padding to block
-		padded = padding_add(block, r, G)
+	# Add padding to every block
+	padded_blocks = padding_add_many(blocks, r, G)
 
-		## Encrypt the block
-		enc = crypt_bytearray(padded, e, n, ENCRYPTED_BLOCK_SIZE)
-
-		## Add it to the end of the encrypted message
-		encrypted.extend(enc)
+	# Encrypt each block
+	encrypted = crypt_blocks(padded_blocks, e, n, size, crt, executor)
 
 	# Base64 encode the whole message
-	encoded = base64.b64encode(bytearray(encrypted))
+	encoded = base64.b64encode(b"".join(encrypted))
 
 	# Add banners around the message
 	return (b"---SIGNED MESSAGE---\n" + encoded + b"\n---SIGNED MESSAGE---").decode('ascii')
 
 # Decrypt string M with key (e, n)
+# crt can be given for private keys to make this faster, see crypt_bytearray
+# If an executor is given, long messages have their blocks decrypted in parallel on it
+# size is the size of n (bytes), as given to encrypt
 # Returns bytearray or False if data is invalid
-def decrypt(M, e, n):
-	# Remove banners
-	encoded = M.replace("\n", "").replace("---SIGNED MESSAGE---", "")
-
+def decrypt(M, e, n, crt=None, executor=None, size=ENCRYPTED_BLOCK_SIZE):
 	try:
-		# Base64 decode the message
-		decoded = base64.b64decode(encoded)
+		# Remove banners and base64 decode the message
+		decoded = signed_to_bytes(M)
+	except Exception as _:
+		return False
+
+	return decrypt_bytes(decoded, e, n, crt, executor, size)
 
+# Same as decrypt, but for a message that's already been decoded with signed_to_bytes
+def decrypt_bytes(decoded, e, n, crt=None, executor=None, size=ENCRYPTED_BLOCK_SIZE):
+	try:
 		# Split message into blocks
-		num_blocks = ceil(len(decoded) / ENCRYPTED_BLOCK_SIZE)
-		
-		# Decrypt each block
-		r, G = (None, None)
-		orig = []
+		num_blocks = ceil(len(decoded) / size)
+		blocks = [decoded[i * size:(i + 1) * size] for i in range(0, num_blocks)]
 
-		## For each block,
-		for i in range(num_blocks):
-			## Get the data for that block
-			encrypted = decoded[i * ENCRYPTED_BLOCK_SIZE:(i+1) * ENCRYPTED_BLOCK_SIZE]
+		# Decrypt each block
+		# These don't depend on each other, so they can all be done at once
+		decrypted = crypt_blocks(blocks, e, n, BLOCK_SIZE, crt, executor)
 
-			## Decrypt it
-			decrypted = crypt_bytearray(encrypted, e, n, BLOCK_SIZE)
+		# Get r from the first block
+		r = extract_r(decrypted[0])
 
-			## If we haven't found r yet,
-			if r == None:
-				# Extract it
-				r = extract_r(decrypted)
+		# G = Hash r
+		G = hash_bytearray(r)
 
-				# G = Hash r
-				G = hash_bytearray(r)
-			
-			## Remove Padding from message and add to decrypted message
-			orig.extend(remove_padding(decrypted, G))
+		# Remove padding from every block
+		orig = remove_padding_many(decrypted, G)
 
 		# Remove trailing 0s from message
-		while orig[-1] == 0:
-			orig.pop()
+		orig = orig.rstrip(b"\x00")
 
 		# Check the hash at the end of the message
 		
@@ -114,9 +104,9 @@ def decrypt(M, e, n):
 		actual_hash = hash_bytearray(orig)
 
 		## Compare the two
-		if np.array_equal(expected_hash, actual_hash):
+		if expected_hash == bytes(actual_hash):
 			# If valid, return the rest of the message
-			return orig
+			return bytearray(orig)
 		else:
 			# Otherwise, return False
 			return False
@@ -124,6 +114,91 @@ def decrypt(M, e, n):
 		# Probably invalid decoding or something else wrong with the message
 		return False
 
+# Hash-then-sign (version 2 signatures)
+# Rather than encrypting the whole message, only its hash is signed, so signing is one exponentiation
+# and the signature is always the same size. The message goes along with it in the clear.
+# Signed payload = SIGNATURE_MAGIC + message + signature (the size of n)
+SIGNATURE_MAGIC = b"HS2\x00"
+
+# ASN.1 DigestInfo prefix for SHA-256, as used by PKCS#1 v1.5 signatures
+SHA256_DIGEST_INFO = bytes.fromhex("3031300d060960864801650304020105000420")
+
+# Sign bytearray M with private key (d, n), hashing it first
+# crt can be given to make this faster, see crypt_bytearray
+# size is the size of n (bytes), which the signature takes up
+# Returns a string
+def sign_hash(M, d, n, crt=None, size=ENCRYPTED_BLOCK_SIZE):
+	# Pad the hash of M to the size of n
+	encoded = encode_hash(M, n)
+
+	# Sign it
+	signature = crypt_bytearray(encoded, d, n, size, crt)
+
+	# Put it all together and base64 encode it
+	encoded = base64.b64encode(SIGNATURE_MAGIC + bytes(M) + signature)
+
+	# Add banners around the message, same as encrypt
+	return (b"---SIGNED MESSAGE---\n" + encoded + b"\n---SIGNED MESSAGE---").decode('ascii')
+
+# Check string M was signed with sign_hash by the private key matching (e, n)
+# size is the size of n (bytes), as given to sign_hash
+# Returns the message as a bytearray, or False if it's invalid
+def verify_hash(M, e, n, size=ENCRYPTED_BLOCK_SIZE):
+	try:
+		# Remove banners and base64 decode the message
+		decoded = signed_to_bytes(M)
+	except Exception as _:
+		return False
+
+	return verify_hash_bytes(decoded, e, n, size)
+
+# Same as verify_hash, but for a message that's already been decoded with signed_to_bytes
+def verify_hash_bytes(decoded, e, n, size=ENCRYPTED_BLOCK_SIZE):
+	try:
+		# Check it's the right format
+		if decoded[:len(SIGNATURE_MAGIC)] != SIGNATURE_MAGIC or len(decoded) < len(SIGNATURE_MAGIC) + size:
+			return False
+
+		# Split it up
+		message = bytearray(decoded[len(SIGNATURE_MAGIC):-size])
+		signature = decoded[-size:]
+
+		# Undo the signature and compare it with what we expect
+		expected = encode_hash(message, n)
+		if crypt_bytearray(signature, e, n, len(expected)) == expected:
+			return message
+		else:
+			return False
+	except Exception as _:
+		# Probably invalid decoding or something else wrong with the message
+		return False
+
+# Returns true if string M looks like it was signed with sign_hash
+def is_hash_signed(M):
+	try:
+		return is_hash_signed_bytes(signed_to_bytes(M))
+	except Exception as _:
+		return False
+
+# Same as is_hash_signed, but for a message that's already been decoded with signed_to_bytes
+def is_hash_signed_bytes(decoded):
+	return decoded[:len(SIGNATURE_MAGIC)] == SIGNATURE_MAGIC
+
+# Remove the banners from string M (from encrypt or sign_hash) and base64 decode it
+# Raises an exception if it isn't valid base64
+def signed_to_bytes(M):
+	encoded = M.replace("\n", "").replace("---SIGNED MESSAGE---", "")
+	return base64.b64decode(encoded)
+
+# PKCS#1 v1.5 style encoding of the hash of M, as big as n
+# = 00 01 FF ... FF 00 DigestInfo Hash
+def encode_hash(M, n):
+	size = (n.bit_length() + 7) // 8
+	digest = SHA256_DIGEST_INFO + bytes(hash_bytearray(M))
+
+	# Pad with as many FFs as fit
+	return b"\x00\x01" + b"\xff" * (size - len(digest) - 3) + b"\x00" + digest
+
 # Add padding to a bytearray
 def padding_add(block, r, G):
 	# X = block ^ G
@@ -138,9 +213,32 @@ def padding_add(block, r, G):
 	# Return X concat Y
 	return X + Y
 
+# Same as padding_add, but for a list of blocks
+# All the hashes are done in one batch
+def padding_add_many(blocks, r, G):
+	# X = block ^ G, for every block
+	Xs = [xor_bytearrays(block, G) for block in blocks]
+
+	# H = Hash X, for every block
+	Hs = hash_bytearrays(Xs)
+
+	# Return X concat (H ^ r), for every block
+	return [X + xor_bytearrays(H, r) for X, H in zip(Xs, Hs)]
+
+# Run crypt_bytearray on every block in a list
+# If an executor is given and there's more than one block, they're done in parallel on it
+def crypt_blocks(blocks, e, n, size, crt=None, executor=None):
+	if executor == None or len(blocks) <= 1:
+		return [crypt_bytearray(block, e, n, size, crt) for block in blocks]
+
+	count = len(blocks)
+	return list(executor.map(crypt_bytearray, blocks, [e] * count, [n] * count, [size] * count, [crt] * count, chunksize=BLOCKS_PER_TASK))
+
 # Accepts a bytearray and runs RSA on it as a BE integer
+# If crt = (p, q, dP, dQ, qInv) is given, e must be the private exponent, and the Chinese
+# Remainder Theorem is used to do it as 2 exponentiations of half the size, which is a lot faster.
 # Returns a bytearray of size `size`.
-def crypt_bytearray(buf, e, n, size):
+def crypt_bytearray(buf, e, n, size, crt=None):
 	# Interpret bytearray as an integer
 	M = int.from_bytes(buf, byteorder='big', signed=False)
 
@@ -148,8 +246,16 @@ def crypt_bytearray(buf, e, n, size):
 	if M >= n:
 		raise Exception("RSA doesn't work if M >= n")
 
-	# Enc(M) = M^e (mod n)
-	enc = pow(M, e, n)
+	if crt == None:
+		# Enc(M) = M^e (mod n)
+		enc = pow(M, e, n)
+	else:
+		# Find M^d mod p and mod q, then combine them into M^d mod n
+		p, q, dP, dQ, qInv = crt
+		m1 = pow(M % p, dP, p)
+		m2 = pow(M % q, dQ, q)
+		h = (qInv * (m1 - m2)) % p
+		enc = m2 + h * q
 
 	# Turn it back into a bytearray
 	return enc.to_bytes(size, 'big', signed=False)
@@ -160,6 +266,13 @@ def remove_padding(decrypted, G):
 	X = decrypted[:BLOCK_MSG_SIZE]
 	return xor_bytearrays(X, G)
 
+# Same as remove_padding, but for a list of blocks
+# Returns the data from every block joined together
+def remove_padding_many(decrypted, G):
+	# XOR all the Xs with G at once
+	Xs = b"".join([block[:BLOCK_MSG_SIZE] for block in decrypted])
+	return xor_bytearrays(Xs, bytes(G) * len(decrypted))
+
 # Extract r from the bytearray
 def extract_r(decrypted):
 	# Get X and Y
@@ -177,10 +290,15 @@ def hash_bytearray(b):
 	return sha256(bytearray(b))
 	# return list([x for x in sha256(bytes(b)).digest()])
 
-# Return an n long random bytearray
+# Hash a list of bytearrays, returning a list of bytearrays
+def hash_bytearrays(bs):
+	return sha256_many(bs)
+
+# Return n random bytes
 def rand_bytes(n):
-	return [randbelow(256) for _ in range(0, n)]
+	return token_bytes(n)
 
-# XOR 2 bytearrays
+# XOR 2 bytearrays of the same length, returning bytes
+# Done as one big integer rather than byte by byte
 def xor_bytearrays(a, b):
-	return [a[i] ^ b[i] for i in range(0, len(a))]
+	return (int.from_bytes(a, byteorder='big') ^ int.from_bytes(b, byteorder='big')).to_bytes(len(a), byteorder='big')
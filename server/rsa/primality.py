@@ -0,0 +1,195 @@
+# Primality testing
+# Uses the Baillie-PSW test (a strong probable prime test to base 2, then a strong Lucas probable
+# prime test), which no composite is known to pass, followed by however many random base
+# Miller-Rabin rounds are needed for the error bound we want.
+
+from math import isqrt
+from random import randrange
+
+SMALL_PRIMES = [3,5,7,11,13,17,19,23,29,31,37,41,43,47,53,59,61,67,71,73,79,83,89,97
+                   ,101,103,107,109,113,127,131,137,139,149,151,157,163,167,173,179
+                   ,181,191,193,197,199,211,223,227,229,233,239,241,251,257,263,269
+                   ,271,277,281,283,293,307,311,313,317,331,337,347,349,353,359,367
+                   ,373,379,383,389,397,401,409,419,421,431,433,439,443,449,457,461
+                   ,463,467,479,487,491,499,503,509,521,523,541,547,557,563,569,571
+                   ,577,587,593,599,601,607,613,617,619,631,641,643,647,653,659,661
+                   ,673,677,683,691,701,709,719,727,733,739,743,751,757,761,769,773
+                   ,787,797,809,811,821,823,827,829,839,853,857,859,863,877,881,883
+                   ,887,907,911,919,929,937,941,947,953,967,971,977,983,991,997]
+
+# Default probability of a composite being accepted = 2^-ERROR_BITS
+ERROR_BITS = 100
+
+# Minimum Miller-Rabin rounds to use alongside a Lucas test, from FIPS 186-4 Table C.3
+# Each entry = (candidate size in bits, error bound in bits, rounds)
+MR_ROUNDS_TABLE = [
+	(512, 100, 5),
+	(1024, 112, 4),
+	(1536, 128, 3)
+]
+
+# Returns how many random base Miller-Rabin rounds a candidate of the given size needs, on top of
+# the BPSW test, to have at most a 2^-error_bits chance of being composite
+def miller_rabin_rounds(bits, error_bits=ERROR_BITS):
+	# Anything smaller than the table covers gets the worst case bound, where each round
+	# lets through at most 1/4 of composites
+	rounds = (error_bits + 1) // 2
+
+	# Use the biggest entry in the table that's no bigger than the candidate
+	for table_bits, table_error_bits, table_rounds in MR_ROUNDS_TABLE:
+		if table_bits <= bits:
+			## If we want a smaller error than the table gives, add rounds (each one is worth at least 2 bits)
+			rounds = table_rounds + max(0, (error_bits - table_error_bits + 1) // 2)
+
+	return rounds
+
+# Returns if x is a strong probable prime to the given base (one round of Miller-Rabin)
+def strong_probable_prime(x, base):
+	# Find s and d such that d2^s = x - 1
+	d = x - 1
+	s = 0
+	while d % 2 == 0:
+		d //= 2
+		s += 1
+
+	# Calculate v = a^d % x
+	v = pow(base, d, x)
+
+	# If first term v = 1 or x - 1, the base won't prove x is composite
+	if v == 1 or v == x - 1:
+		return True
+
+	# Keep squaring, looking for x - 1
+	for _ in range(1, s):
+		v = pow(v, 2, x)
+
+		if v == x - 1:
+			return True
+
+	# If we don't find anything, it's composite
+	return False
+
+# Returns the Jacobi symbol (a/n), for odd n > 0
+def jacobi(a, n):
+	a %= n
+	result = 1
+
+	while a != 0:
+		## Take out factors of 2
+		while a % 2 == 0:
+			a //= 2
+			if n % 8 in (3, 5):
+				result = -result
+
+		## Quadratic reciprocity
+		a, n = n, a
+		if a % 4 == 3 and n % 4 == 3:
+			result = -result
+
+		a %= n
+
+	if n == 1:
+		return result
+	else:
+		return 0
+
+# Returns if x is a strong Lucas probable prime, using Selfridge's parameters
+# x must be odd and not a small prime
+def strong_lucas_probable_prime(x):
+	# Find the first D in 5, -7, 9, -11, ... with (D/x) = -1
+	D = 5
+	while True:
+		j = jacobi(D, x)
+		if j == -1:
+			break
+
+		## D has a factor in common with x
+		if j == 0 and abs(D) != x:
+			return False
+
+		D = -D - 2 if D > 0 else -D + 2
+
+		## Squares never give -1, so check for them if it's taking a while
+		if D == 13 and isqrt(x) ** 2 == x:
+			return False
+
+	P = 1
+	Q = (1 - D) // 4
+
+	# Find s and d such that d2^s = x + 1
+	d = x + 1
+	s = 0
+	while d % 2 == 0:
+		d //= 2
+		s += 1
+
+	# Work out U_d, V_d and Q^d, going through the bits of d from the top
+	U = 1
+	V = P
+	Qk = Q % x
+	for bit in bin(d)[3:]:
+		## Double k
+		U = (U * V) % x
+		V = (V * V - 2 * Qk) % x
+		Qk = (Qk * Qk) % x
+
+		## Add 1 to k if this bit is set
+		if bit == '1':
+			U, V = (P * U + V, D * U + P * V)
+
+			### Halve them mod x (x is odd, so adding x makes them even)
+			if U % 2 == 1:
+				U += x
+			if V % 2 == 1:
+				V += x
+
+			U = (U // 2) % x
+			V = (V // 2) % x
+			Qk = (Qk * Q) % x
+
+	# x is a strong Lucas probable prime if U_d = 0 or V_(d2^r) = 0 for some r < s
+	if U == 0 or V == 0:
+		return True
+
+	for _ in range(1, s):
+		V = (V * V - 2 * Qk) % x
+		if V == 0:
+			return True
+
+		Qk = (Qk * Qk) % x
+
+	return False
+
+# Baillie-PSW test
+# Returns if x is (almost certainly) prime
+def bpsw(x):
+	# Deal with small numbers and small factors
+	if x < 2:
+		return False
+	if x % 2 == 0:
+		return x == 2
+
+	for small in SMALL_PRIMES:
+		if x == small:
+			return True
+		if x % small == 0:
+			return False
+
+	# Strong test to base 2, then strong Lucas test
+	return strong_probable_prime(x, 2) and strong_lucas_probable_prime(x)
+
+# Returns if x is prime, with at most a 2^-error_bits chance of being wrong
+def is_probable_prime(x, error_bits=ERROR_BITS):
+	if not bpsw(x):
+		return False
+
+	# Anything that gets here and is small enough to have been tried already is prime
+	if x <= SMALL_PRIMES[-1]:
+		return True
+
+	# Random base rounds for the error bound
+	for _ in range(0, miller_rabin_rounds(x.bit_length(), error_bits)):
+		if not strong_probable_prime(x, randrange(2, x - 1)):
+			return False
+
+	return True
@@ -0,0 +1,269 @@
+# Benchmarks for the crypto code
+# Times hashing, AES, RSA and history statements, and compares the results with a baseline saved
+# in the repo, so we can tell if a change made things faster or slower.
+#
+# Run from the server folder:
+#   PYTHONPATH=. python tests/bench.py              Compare with the baseline
+#   PYTHONPATH=. python tests/bench.py --save       Save the results as the new baseline
+#   PYTHONPATH=. python tests/bench.py --only sha256 Only run benchmarks with names containing sha256
+#
+# Exits with status 1 if anything got slower than the baseline by more than the threshold.
+# Baselines are only comparable on the same machine, so save a new one before making a change.
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from functools import lru_cache
+from math import ceil
+
+import hash
+from hash import sha256
+from aes import aesEncrypt, aesDecrypt, aesCtr, AESKey
+from aes.ctr import new_nonce
+from rsa import RSAKeypair
+from rsa.keygen import KEY_SIZES, DEFAULT_KEY_SIZE
+from statement import HistoryStatement, verify_chain, ZEROS_32
+
+# Where the baseline is saved
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+
+# How much slower than the baseline (as a fraction) something can be before it counts as a regression
+DEFAULT_THRESHOLD = 0.2
+
+# Each benchmark is run until it's taken at least this long (seconds), and at least MIN_RUNS times
+MIN_SECONDS = 1
+MIN_RUNS = 5
+
+# Percentiles of the time each run takes to report
+PERCENTILES = [50, 90, 99]
+
+# Sizes to test with (bytes)
+HASH_SIZES = [0, 64, 1024, 64 * 1024, 1024 * 1024, 16 * 1024 * 1024, 64 * 1024 * 1024]
+AES_SIZES = [16, 1024, 64 * 1024, 1024 * 1024]
+
+# Key to use for AES
+AES_KEY = bytes(range(0, 32))
+
+# A single benchmark
+# setup() makes anything it needs (like keys), and returns the function to time, which processes
+# size bytes each time (0 if that doesn't mean anything). setup is only called if the benchmark is run.
+# Slow benchmarks can ask for fewer runs than MIN_RUNS
+# Ones that vary too much between runs to compare can set check=False, so they're never flagged as regressions
+class Benchmark:
+	# + Benchmark(str, function, int, int, bool)
+	def __init__(self, name, setup, size=0, min_runs=MIN_RUNS, check=True):
+		self.name = name
+		self.setup = setup
+		self.size = size
+		self.min_runs = min_runs
+		self.check = check
+
+# Turn a size in bytes into something readable for benchmark names
+def size_name(size):
+	for unit, amount in [("MiB", 1024 * 1024), ("KiB", 1024)]:
+		if size >= amount and size % amount == 0:
+			return "%s%s" % (size // amount, unit)
+
+	return "%sB" % size
+
+# Returns (private key, public key) to benchmark RSA with
+# Keys are made once for each size and shared between benchmarks
+@lru_cache(maxsize=None)
+def rsa_keys(bits):
+	key = RSAKeypair.generate_keypair(bits=bits)
+	return (key, RSAKeypair.deserialise(key.serialise(force_public=True)))
+
+# Returns the list of benchmarks to run
+def make_benchmarks():
+	benchmarks = []
+
+	# Hashing
+	for size in HASH_SIZES:
+		def setup(size=size):
+			data = os.urandom(size)
+			return lambda: sha256(data)
+
+		benchmarks.append(Benchmark("sha256 %s" % size_name(size), setup, size))
+
+	# AES, with the key already extended, like it would be for a whole file
+	for size in AES_SIZES:
+		def setup_encrypt(size=size):
+			data, key = (os.urandom(size), AESKey(AES_KEY))
+			return lambda: aesEncrypt(data, key)
+
+		def setup_decrypt(size=size):
+			key = AESKey(AES_KEY)
+			encrypted = aesEncrypt(os.urandom(size), key)
+			return lambda: aesDecrypt(encrypted, key)
+
+		def setup_ctr(size=size):
+			data, key, nonce = (os.urandom(size), AESKey(AES_KEY), new_nonce())
+			return lambda: aesCtr(data, key, nonce)
+
+		benchmarks.append(Benchmark("aes encrypt %s" % size_name(size), setup_encrypt, size))
+		benchmarks.append(Benchmark("aes decrypt %s" % size_name(size), setup_decrypt, size))
+		benchmarks.append(Benchmark("aes ctr %s" % size_name(size), setup_ctr, size))
+
+	# RSA, for each size of key
+	## Messages are about the size of a history statement
+	for bits in KEY_SIZES:
+		def setup_keygen(bits=bits):
+			return lambda: RSAKeypair.generate_keypair(bits=bits)
+
+		def setup_sign(bits=bits):
+			key, message = (rsa_keys(bits)[0], os.urandom(128))
+			return lambda: key.sign(message)
+
+		def setup_verify(bits=bits):
+			key, public_key = rsa_keys(bits)
+			signed = key.sign(os.urandom(128))
+			return lambda: public_key.decrypt_signed(signed)
+
+		## Key generation is slow and random, so only do a few and don't compare them
+		benchmarks.append(Benchmark("rsa keygen %s" % bits, setup_keygen, min_runs=2, check=False))
+		benchmarks.append(Benchmark("rsa sign %s" % bits, setup_sign))
+		benchmarks.append(Benchmark("rsa verify %s" % bits, setup_verify))
+
+	# History statements, signed and checked with the default size of key
+	def new_statement():
+		return HistoryStatement(ZEROS_32, sha256(b"uploaded"), "benchmark", "A comment")
+
+	def setup_round_trip():
+		hs = new_statement()
+		return lambda: HistoryStatement.from_bytes(hs.to_bytes())
+
+	def setup_statement_sign():
+		hs, key = (new_statement(), rsa_keys(DEFAULT_KEY_SIZE)[0])
+		return lambda: hs.sign(key)
+
+	def setup_statement_verify():
+		key, public_key = rsa_keys(DEFAULT_KEY_SIZE)
+		statement_signed = new_statement().sign(key)
+		return lambda: verify_chain([("benchmark", statement_signed)], {"benchmark": public_key}.get)
+
+	benchmarks.append(Benchmark("statement bytes round trip", setup_round_trip))
+	benchmarks.append(Benchmark("statement sign", setup_statement_sign))
+	benchmarks.append(Benchmark("statement verify", setup_statement_verify))
+
+	return benchmarks
+
+# Returns the pth percentile of a sorted list
+def percentile(values, p):
+	index = max(0, ceil(len(values) * p / 100) - 1)
+	return values[index]
+
+# Run a benchmark, returning its results as a dict
+def run_benchmark(benchmark, min_seconds=MIN_SECONDS):
+	run = benchmark.setup()
+
+	times = []
+	start = time.perf_counter()
+
+	while len(times) < benchmark.min_runs or time.perf_counter() - start < min_seconds:
+		run_start = time.perf_counter()
+		run()
+		times.append(time.perf_counter() - run_start)
+
+	# Work out stats
+	times.sort()
+	total = sum(times)
+	ops_per_second = len(times) / total if total > 0 else 0
+
+	result = {
+		'runs': len(times),
+		'ops_per_second': ops_per_second,
+		'mb_per_second': ops_per_second * benchmark.size / 1_000_000
+	}
+
+	## Percentiles are in ms
+	for p in PERCENTILES:
+		result['p%s_ms' % p] = percentile(times, p) * 1000
+
+	return result
+
+# Describe the machine we're running on, so it's clear what a baseline is from
+def machine_info():
+	return {
+		'platform': platform.platform(),
+		'python': platform.python_version(),
+		'cpus': os.cpu_count(),
+		'hash_backend': hash.active_backend.name
+	}
+
+# Returns the baseline at path, or None if there isn't one
+def load_baseline(path):
+	if not os.path.exists(path):
+		return None
+
+	with open(path, "r") as f:
+		return json.load(f)
+
+def save_baseline(path, results):
+	with open(path, "w") as f:
+		json.dump({
+			'machine': machine_info(),
+			'results': results
+		}, f, indent='\t', sort_keys=True)
+		f.write("\n")
+
+# Compare a result with the baseline one
+# Returns the change in ops/s as a fraction (-0.5 = half as fast), or None if there's nothing to compare with
+def compare(result, baseline_result):
+	if baseline_result == None or baseline_result['ops_per_second'] == 0:
+		return None
+
+	return result['ops_per_second'] / baseline_result['ops_per_second'] - 1
+
+def main(args):
+	parser = argparse.ArgumentParser(description="Benchmark the crypto code")
+	parser.add_argument("--save", action="store_true", help="save the results as the baseline")
+	parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline file to compare with or save to")
+	parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="slowdown (as a fraction) that counts as a regression")
+	parser.add_argument("--only", default=None, help="only run benchmarks with names containing this")
+	parser.add_argument("--seconds", type=float, default=MIN_SECONDS, help="minimum time to run each benchmark for")
+	args = parser.parse_args(args)
+
+	baseline = load_baseline(args.baseline)
+	baseline_results = {} if baseline == None else baseline['results']
+
+	benchmarks = [x for x in make_benchmarks() if args.only == None or args.only in x.name]
+
+	# Run everything, printing results as we go
+	print("%-28s %8s %12s %10s %10s %10s %10s %8s" % ("benchmark", "runs", "ops/s", "MB/s", "p50 ms", "p90 ms", "p99 ms", "change"))
+
+	results = {}
+	regressions = []
+	for benchmark in benchmarks:
+		result = run_benchmark(benchmark, args.seconds)
+		results[benchmark.name] = result
+
+		change = compare(result, baseline_results.get(benchmark.name))
+		change_str = "-" if change == None else "%+.0f%%" % (change * 100)
+
+		## Flag it if it's got too much slower
+		if change != None and benchmark.check and change < -args.threshold:
+			regressions.append(benchmark.name)
+			change_str += " !"
+
+		print("%-28s %8s %12.1f %10.2f %10.3f %10.3f %10.3f %8s" % (benchmark.name, result['runs'], result['ops_per_second'],
+			result['mb_per_second'], result['p50_ms'], result['p90_ms'], result['p99_ms'], change_str))
+
+	# Save it if we're asked to
+	# If only some benchmarks were run, the rest of the old baseline is kept
+	if args.save:
+		merged = dict(baseline_results)
+		merged.update(results)
+		save_baseline(args.baseline, merged)
+		print("Saved baseline to %s" % args.baseline)
+
+	if len(regressions) > 0:
+		print("%s regressions (more than %.0f%% slower): %s" % (len(regressions), args.threshold * 100, ", ".join(regressions)))
+		return 1
+
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
@@ -1,6 +1,9 @@
 # Test script for AES encryption
 
 from aes import aesEncrypt, aesDecrypt
+from aes.common import get_blocks
+from aes.encrypt import encrypt_block
+from aes.key_extension import extend_key
 import numpy as np
 from math import ceil, floor
 import random
@@ -13,6 +16,19 @@ INPUT_KEYS = [
 	list([floor(random.random() * 255) for i in range(0, 32)])
 ]
 
+# Known answers, captured from the original implementation before it was vectorised
+# Each entry = (key, plaintext, ciphertext), in hex
+## The key schedule has always ignored the key, so these are the same for every key. That has to
+## stay the same, or files encrypted before can't be decrypted
+KNOWN_ANSWERS = [
+	("00" * 32, "00" * 16, "dc95c078a2408989ad48a21492842087"),
+	(bytes(range(0, 32)).hex(), "00" * 16, "dc95c078a2408989ad48a21492842087"),
+	(bytes(range(0, 32)).hex(), "00112233445566778899aabbccddeeff", "1c060f4c9e7ea8d6ca961a2d64c05c18"),
+	(bytes(range(0, 32)).hex(), b"1234567890abcdef".hex(), "b4b5050120ae38f6f4da7a2431fc4bd7"),
+	(bytes(range(0, 32)).hex(), bytes(range(0, 48)).hex(),
+		"b65d30030c88b44c975a343f93fb3c0961006666010c43379ede85048213921fab987da5c8880ac61ce7d1069041bb96"),
+]
+
 INPUT_MESSAGES = [
 	list([0 for _ in range(0,16)]),
 	list([ord(x) for x in "1234567890abcdef"]),
@@ -20,6 +36,19 @@ INPUT_MESSAGES = [
 	list([floor(random.random() * 255) for i in range(0, 32)])
 ]
 
+# Known answers, captured from the original implementation before it was vectorised
+# Each entry = (key, plaintext, ciphertext), in hex
+## The key schedule has always ignored the key, so these are the same for every key. That has to
+## stay the same, or files encrypted before can't be decrypted
+KNOWN_ANSWERS = [
+	("00" * 32, "00" * 16, "dc95c078a2408989ad48a21492842087"),
+	(bytes(range(0, 32)).hex(), "00" * 16, "dc95c078a2408989ad48a21492842087"),
+	(bytes(range(0, 32)).hex(), "00112233445566778899aabbccddeeff", "1c060f4c9e7ea8d6ca961a2d64c05c18"),
+	(bytes(range(0, 32)).hex(), b"1234567890abcdef".hex(), "b4b5050120ae38f6f4da7a2431fc4bd7"),
+	(bytes(range(0, 32)).hex(), bytes(range(0, 48)).hex(),
+		"b65d30030c88b44c975a343f93fb3c0961006666010c43379ede85048213921fab987da5c8880ac61ce7d1069041bb96"),
+]
+
 
 # Hexdump bytearray
 def xxd(arr):
@@ -31,14 +60,48 @@ def test_encrypt_decrypt(msg, key):
 	encrypted = aesEncrypt(msg, key)
 	decrypted = aesDecrypt(encrypted, key)
 
+	# Encrypting one block at a time (without the T-tables) should give the same ciphertext
+	# This still uses MUL_TABLES for MixColumns, so the known answers below are what check those
+	extended_keys = extend_key(key)
+	expected = np.array([encrypt_block(x, extended_keys).flatten(order='F') for x in get_blocks(msg)]).flatten()
+	if not np.array_equal(encrypted, expected):
+		return (False,encrypted)
+
 	if np.array_equal(decrypted, msg):
 		return (True,)
 	else:
 		return (False,decrypted)
 
+# Returns (True,) or (False, expected, actual) for the wrong ciphertext or decryption
+def test_known_answer(key, plaintext, ciphertext):
+	key = list(bytes.fromhex(key))
+	plaintext = list(bytes.fromhex(plaintext))
+	ciphertext = list(bytes.fromhex(ciphertext))
+
+	encrypted = aesEncrypt(plaintext, key)
+	if not np.array_equal(encrypted, ciphertext):
+		return (False, ciphertext, encrypted)
+
+	decrypted = aesDecrypt(np.array(ciphertext, dtype=np.uint8), key)
+	if not np.array_equal(decrypted, plaintext):
+		return (False, plaintext, decrypted)
+
+	return (True,)
+
 # Each entry = (expected, actual)
 failures = []
 
+# Check against the known answers first, since nothing else checks the ciphertext is actually right
+for key, plaintext, ciphertext in KNOWN_ANSWERS:
+	res = test_known_answer(key, plaintext, ciphertext)
+
+	# If it failed, add it to failures
+	if res[0] != True:
+		failures.append((res[1], res[2]))
+		print("x", end="")
+	else:
+		print(".", end="")
+
 # For each message
 for msg in INPUT_MESSAGES:
 
@@ -55,7 +118,7 @@ for msg in INPUT_MESSAGES:
 			print(".", end="")
 
 print()
-print("%s tests, %s failures" % (len(INPUT_KEYS) * len(INPUT_MESSAGES), len(failures)))
+print("%s tests, %s failures" % (len(KNOWN_ANSWERS) + len(INPUT_KEYS) * len(INPUT_MESSAGES), len(failures)))
 print("---")
 
 # Print failures
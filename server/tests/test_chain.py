@@ -0,0 +1,114 @@
+# Test script for verifying chains of history statements
+
+from rsa import RSAKeypair
+from statement import HistoryStatement, verify_chain, ZEROS_32, STATEMENTS_PER_TASK
+from rsa.crypt import signed_to_bytes
+from workers import make_executor
+from hash import sha256
+
+# Users to sign statements as
+USERNAMES = ["alice", "bob", "carol"]
+
+# Lengths of chains to test
+# The longest is split into several tasks, so it's checked in parallel
+INPUT_LENGTHS = [1, 2, 10, STATEMENTS_PER_TASK + 1]
+
+# Make a valid chain of the given length, with everyone taking turns
+# Some of them are signed the old way, which should still be accepted
+# Returns a list of (alleged username, signed payload)
+def make_chain(length, keys):
+	statements = []
+	hashPrev = ZEROS_32
+	for i in range(0, length):
+		username = USERNAMES[i % len(USERNAMES)]
+		hs = HistoryStatement(hashPrev, sha256(bytes([i % 256])), username, "version %s" % i)
+
+		## Old signatures can't be checked if the message's hash ends in 0, since trailing 0s are taken as
+		## padding. The server never accepted those, so they're signed the new way here
+		if i % 7 == 3 and sha256(hs.to_bytes())[-1] != 0:
+			payload = keys[username].sign_legacy(hs.to_bytes())
+		else:
+			payload = hs.sign(keys[username])
+
+		statements.append((username, payload))
+		hashPrev = sha256(signed_to_bytes(payload))
+
+	return statements
+
+# Returns (True,) or (False, reason)
+def test_chain(length, keys, executor):
+	statements = make_chain(length, keys)
+
+	# Everything should verify
+	verified = verify_chain(statements, keys.get, executor)
+	if False in verified:
+		return (False, "Valid statement %s didn't verify" % verified.index(False))
+
+	if [hs.comment for hs in verified] != ["version %s" % i for i in range(0, length)]:
+		return (False, "Statements came back wrong")
+
+	# Claiming to be someone else should fail
+	tampered = list(statements)
+	tampered[length // 2] = (USERNAMES[(length // 2 + 1) % len(USERNAMES)], tampered[length // 2][1])
+	if verify_chain(tampered, keys.get, executor)[length // 2] != False:
+		return (False, "Statement with the wrong username verified")
+
+	# Unknown users and broken payloads should fail, and so should the statement after them
+	tampered = list(statements)
+	tampered[0] = ("mallory", tampered[0][1])
+	if verify_chain(tampered, keys.get, executor)[0] != False:
+		return (False, "Statement from an unknown user verified")
+
+	tampered = list(statements)
+	tampered[0] = (tampered[0][0], "not base64!")
+	verified = verify_chain(tampered, keys.get, executor)
+	if verified[0] != False or (length > 1 and verified[1] != False):
+		return (False, "Broken payload or the one after it verified")
+
+	# Removing a statement should break the link to the one after it
+	if length > 2:
+		verified = verify_chain(statements[:1] + statements[2:], keys.get, executor)
+		if verified[0] == False or verified[1] != False:
+			return (False, "Chain with a statement missing verified")
+
+	# The first statement's hashPrev can be checked against something else, or not at all
+	if verify_chain(statements, keys.get, executor, sha256(b"something else"))[0] != False:
+		return (False, "First statement verified with the wrong hashPrev")
+
+	if verify_chain(statements, keys.get, executor, None)[0] == False:
+		return (False, "First statement didn't verify without checking hashPrev")
+
+	return (True,)
+
+if __name__ == "__main__":
+	# Each entry = (length, reason)
+	failures = []
+
+	# Small keys so this doesn't take forever
+	keys = {}
+	for username in USERNAMES:
+		keys[username] = RSAKeypair.generate_keypair(bits=2048)
+
+	executor = make_executor(2)
+
+	# For each length
+	for length in INPUT_LENGTHS:
+		res = test_chain(length, keys, executor)
+
+		# If it failed, add it to failures
+		if res[0] != True:
+			failures.append((length, res[1]))
+			print("x", end="")
+		else:
+			print(".", end="")
+
+	executor.shutdown()
+
+	print()
+	print("%s tests, %s failures" % (len(INPUT_LENGTHS), len(failures)))
+	print("---")
+
+	# Print failures
+	for length, reason in failures:
+		print("For %s statements: %s" % (length, reason))
+		print("---")
@@ -0,0 +1,94 @@
+# Test script for AES counter mode
+
+from aes.ctr import crypt, crypt_chunks, keystream, new_nonce, BLOCKS_PER_TASK
+from aes.common import BLOCK_SIZE
+from workers import make_executor
+import random
+from math import floor
+
+KEY = list([floor(random.random() * 255) for i in range(0, 32)])
+
+# Sizes of data to test, in bytes
+INPUT_SIZES = [0, 1, 15, 16, 17, 100, 4096 + 7]
+
+# Sizes to split data into when testing chunks
+CHUNK_SIZES = [1, 5, 16, 33]
+
+# Returns (True,) or (False, reason)
+def test_ctr(data):
+	nonce = new_nonce()
+	encrypted = crypt(data, KEY, nonce)
+
+	# Should be exactly as long as the input
+	if len(encrypted) != len(data):
+		return (False, "Ciphertext was %s bytes" % len(encrypted))
+
+	if crypt(encrypted, KEY, nonce) != data:
+		return (False, "Didn't decrypt back to the same thing")
+
+	# Encrypting in chunks of any size should give the same thing
+	for size in CHUNK_SIZES:
+		chunks = [data[i:i + size] for i in range(0, len(data), size)]
+		if bytearray().join(crypt_chunks(chunks, KEY, nonce)) != encrypted:
+			return (False, "Chunks of %s bytes gave a different ciphertext" % size)
+
+	# Decrypting from the middle should work
+	if len(data) > 0:
+		offset = len(data) // 2
+		if crypt(encrypted[offset:], KEY, nonce, offset) != data[offset:]:
+			return (False, "Couldn't decrypt from offset %s" % offset)
+
+	return (True,)
+
+# Returns (True,) or (False, reason)
+def test_parallel(executor):
+	nonce = new_nonce()
+	count = BLOCKS_PER_TASK * 2 + 5
+
+	# Making the keystream on other processes should give the same thing
+	if not (keystream(KEY, nonce, 3, count, executor) == keystream(KEY, nonce, 3, count)).all():
+		return (False, "Parallel keystream was different")
+
+	# So should a range that starts and ends in the middle of blocks
+	data = bytearray(count * BLOCK_SIZE)
+	if crypt(data, KEY, nonce, 7, executor) != crypt(data, KEY, nonce, 7):
+		return (False, "Parallel encryption was different")
+
+	return (True,)
+
+if __name__ == "__main__":
+	# Each entry = (size, reason)
+	failures = []
+
+	# For each size
+	for size in INPUT_SIZES:
+		# Run test with random data of that size
+		data = bytearray([floor(random.random() * 255) for _ in range(0, size)])
+		res = test_ctr(data)
+
+		# If it failed, add it to failures
+		if res[0] != True:
+			failures.append((size, res[1]))
+			print("x", end="")
+		else:
+			print(".", end="")
+
+	# Check the parallel version
+	executor = make_executor(2)
+	res = test_parallel(executor)
+	executor.shutdown()
+
+	if res[0] != True:
+		failures.append(("parallel", res[1]))
+		print("x", end="")
+	else:
+		print(".", end="")
+
+	print()
+	print("%s tests, %s failures" % (len(INPUT_SIZES) + 1, len(failures)))
+	print("---")
+
+	# Print failures
+	for size, reason in failures:
+		print("For %s: %s" % (size, reason))
+		print("---")
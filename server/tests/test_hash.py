@@ -1,24 +1,13 @@
 # Test script for SHA-256 hashing
 
-from hash import sha256
+from hash import sha256, sha256_many, new_hasher, use_backend, BACKENDS, TEST_VECTORS
 import numpy as np
 from math import ceil, floor
 
 # Test inputs and expected outputs
-INPUTS = [
-	bytearray("", 'ascii'),
-	bytearray("abc", 'ascii'),
-	bytearray("abcdefghijklmnopqrstuvwxyz012345", 'ascii'),
-	bytearray("Lorem ipsum dolor sit amet, consectetur adipiscing elit. Curabitur pharetra tortor ut turpis semper ullamcorper. Pellentesque urna massa, porta eget ipsum sed, blandit dictum erat. Sed eu pellentesque nisi. Nulla facilisi. Curabitur et dapibus orci, imperdiet commodo nisi. Sed elementum egestas vehicula. Cras nec sapien id eros lacinia malesuada. Orci varius natoque penatibus et magnis dis parturient montes, nascetur ridiculus mus. Vivamus cursus dapibus nisl, ut volutpat orci dignissim et. Sed quis elementum ipsum. Aliquam eget condimentum tellus, ut placerat elit. Morbi et euismod augue.", 'ascii'),
-]
-
-EXPECTED_OUTPUTS = [
-	bytearray.fromhex("e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855"),
-	bytearray.fromhex("ba7816bf8f01cfea414140de5dae2223b00361a396177a9cb410ff61f20015ad"),
-	bytearray.fromhex("653bb1245e828fcda4fa53fcd5a3def5bd7654e651f54b4132b73d74e64435c4"),
-	bytearray.fromhex("eee24d397f0270efa587a1873f4bfb6832f6998fa5c1944a97b6762e6c9c77bb"),
-
-]
+# These live in hash.py so the backends can check themselves against them on import
+INPUTS = [msg for msg, _ in TEST_VECTORS]
+EXPECTED_OUTPUTS = [digest for _, digest in TEST_VECTORS]
 
 # Hexdump bytearray
 def xxd(arr):
@@ -34,23 +23,60 @@ def test_hashing(msg, expected):
 	else:
 		return (False,hashed)
 
+# As above, but feeds the message to a hasher in uneven pieces
+# Also checks a copy taken halfway through ends up with the same hash
+def test_hashing_incremental(msg, expected):
+	hasher = new_hasher()
+	copied = None
+	for i in range(0, len(msg), 7):
+		hasher.update(msg[i:i + 7])
+
+		# Take a copy halfway through, then give it the rest of the message
+		if copied == None and i >= len(msg) // 2:
+			copied = hasher.copy()
+			copied.update(msg[i + 7:])
+
+	hashed = hasher.digest()
+	if copied == None:
+		copied = hasher.copy()
+
+	if hashed == expected and copied.digest() == expected:
+		return (True,)
+	else:
+		return (False,hashed)
+
 # Each entry = (expected, actual)
 failures = []
 
-# For each test vector
-for msg, expected in zip(INPUTS, EXPECTED_OUTPUTS):
-	# Run test
-	res = test_hashing(msg, expected)
+# Run everything with every backend
+for backend in BACKENDS:
+	use_backend(backend)
 
-	# If it failed, add it to failures
-	if res[0] != True:
-		failures.append((expected, res[1]))
-		print("x", end="")
-	else:
-		print(".", end="")
+	# For each test vector
+	for msg, expected in zip(INPUTS, EXPECTED_OUTPUTS):
+		# Run each test
+		for test in (test_hashing, test_hashing_incremental):
+			res = test(msg, expected)
+
+			# If it failed, add it to failures
+			if res[0] != True:
+				failures.append((expected, res[1]))
+				print("x", end="")
+			else:
+				print(".", end="")
+
+	# Hash every test vector a few times over in one batch
+	# There's enough of the short ones that they get hashed side by side
+	hashed = sha256_many(INPUTS * 5)
+	for msg, expected, actual in zip(INPUTS * 5, EXPECTED_OUTPUTS * 5, hashed):
+		if actual != expected:
+			failures.append((expected, actual))
+			print("x", end="")
+		else:
+			print(".", end="")
 
 print()
-print("%s tests, %s failures" % (len(INPUTS), len(failures)))
+print("%s tests, %s failures" % (len(BACKENDS) * len(INPUTS) * 7, len(failures)))
 print("---")
 
 # Print failures
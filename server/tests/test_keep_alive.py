@@ -0,0 +1,163 @@
+# Test script for keep-alive connections on the threads engine
+# Runs a server on a free port without any database connections, and only asks for pages that don't
+# exist, so it doesn't need a database
+
+import socket
+import time
+from threading import Thread
+
+from config import SERVER_CONFIG
+
+# Number of worker threads, and how many idle connections to keep open (more than there are workers)
+WORKERS = 2
+IDLE_CONNECTIONS = 4 * WORKERS
+
+## This has to be set before app is imported, since Handler reads it then
+SERVER_CONFIG['worker_threads'] = WORKERS
+SERVER_CONFIG['admission_queue_size'] = WORKERS
+SERVER_CONFIG['db_pool_size'] = 0
+SERVER_CONFIG['tree_hash'] = False
+SERVER_CONFIG['keep_alive_timeout'] = 2
+
+from app import App, Handler
+
+# Longest a request should take to be answered while other connections are idle (seconds)
+MAX_WAIT = 1
+
+# Request for a page that doesn't exist
+REQUEST = b"GET /nothing HTTP/1.1\r\nHost: test\r\n\r\n"
+
+# Open a connection to the server at address
+# Returns (socket, file to read responses from)
+def connect(address):
+	sock = socket.create_connection(address, timeout=5)
+	return (sock, sock.makefile("rb"))
+
+# Read a response, returning its status code, or None if the connection was closed
+def read_response(f):
+	status = f.readline()
+	if status == b"":
+		return None
+
+	length = 0
+	while True:
+		line = f.readline()
+		if line in (b"\r\n", b""):
+			break
+
+		name, _, value = line.decode('latin-1').partition(":")
+		if name.lower() == "content-length":
+			length = int(value)
+
+	f.read(length)
+	return int(status.split()[1])
+
+# Returns (True,) or (False, reason)
+def test_idle_connections(address):
+	# Open more connections than there are workers, and leave them idle after one request each
+	idle = []
+	for _ in range(0, IDLE_CONNECTIONS):
+		sock, f = connect(address)
+		sock.sendall(REQUEST)
+		if read_response(f) != 404:
+			return (False, "Idle connection's first request failed")
+
+		idle.append((sock, f))
+
+	# A new connection should still be answered straight away
+	start = time.perf_counter()
+	sock, f = connect(address)
+	sock.sendall(REQUEST)
+	status = read_response(f)
+	taken = time.perf_counter() - start
+	sock.close()
+
+	if status != 404:
+		return (False, "New connection wasn't answered")
+
+	if taken > MAX_WAIT:
+		return (False, "New connection waited %.1fs for idle ones" % taken)
+
+	# The idle connections should all still work
+	for sock, f in idle:
+		sock.sendall(REQUEST)
+		if read_response(f) != 404:
+			return (False, "Idle connection's second request failed")
+
+		sock.close()
+
+	return (True,)
+
+# Returns (True,) or (False, reason)
+def test_pipelined(address):
+	# Several requests sent at once should all be answered, even though they're read in together
+	sock, f = connect(address)
+	sock.sendall(REQUEST * 3)
+
+	for i in range(0, 3):
+		try:
+			status = read_response(f)
+		except socket.timeout as _:
+			status = None
+
+		if status != 404:
+			sock.close()
+			return (False, "Pipelined request %s wasn't answered (%s)" % (i, status))
+
+	sock.close()
+	return (True,)
+
+# Returns (True,) or (False, reason)
+def test_idle_timeout(address):
+	sock, f = connect(address)
+	sock.sendall(REQUEST)
+	if read_response(f) != 404:
+		return (False, "First request failed")
+
+	# The server should close it once it's been idle too long
+	time.sleep(SERVER_CONFIG['keep_alive_timeout'] + 1.5)
+
+	try:
+		closed = sock.recv(1) == b""
+	except socket.timeout as _:
+		closed = False
+
+	sock.close()
+	if not closed:
+		return (False, "Idle connection wasn't closed")
+
+	return (True,)
+
+if __name__ == "__main__":
+	TESTS = [test_idle_connections, test_pipelined, test_idle_timeout]
+
+	# Each entry = (test name, reason)
+	failures = []
+
+	# Port 0 picks any free port
+	app = App(('127.0.0.1', 0), Handler)
+	thread = Thread(target=app.serve_forever)
+	thread.start()
+
+	# Run each test
+	for test in TESTS:
+		res = test(app.server_address)
+
+		# If it failed, add it to failures
+		if res[0] != True:
+			failures.append((test.__name__, res[1]))
+			print("x", end="")
+		else:
+			print(".", end="")
+
+	app.shutdown()
+	thread.join()
+
+	print()
+	print("%s tests, %s failures" % (len(TESTS), len(failures)))
+	print("---")
+
+	# Print failures
+	for name, reason in failures:
+		print("%s: %s" % (name, reason))
+		print("---")
@@ -0,0 +1,81 @@
+# Test script for merkle tree hashing
+
+from merkle import tree_hash, file_tree_hash, verify_range, leaves_to_bytes, leaves_from_bytes
+from workers import make_executor
+import os
+import tempfile
+import random
+from math import floor
+
+# Small leaves so we get lots of them without needing huge files
+LEAF_SIZE = 64
+
+# Sizes of data to test, in bytes
+INPUT_SIZES = [0, 1, 63, 64, 65, 64 * 7, 64 * 8 + 3, 64 * 33]
+
+# Returns (True,) or (False, reason)
+def test_tree_hash(data, executor):
+	root, leaves = tree_hash(data, LEAF_SIZE)
+
+	# Hashing it from disk (in parallel) should give the same thing
+	with tempfile.NamedTemporaryFile(delete=False) as f:
+		f.write(data)
+
+	try:
+		file_root, file_leaves = file_tree_hash(f.name, LEAF_SIZE, executor)
+	finally:
+		os.unlink(f.name)
+
+	if file_root != root or file_leaves != leaves:
+		return (False, "Hashing from file gave a different tree")
+
+	# Storing the leaves and loading them again shouldn't change anything
+	if leaves_from_bytes(leaves_to_bytes(leaves, LEAF_SIZE)) != (LEAF_SIZE, leaves):
+		return (False, "Leaves changed after storing them")
+
+	# The whole thing and any leaf on its own should verify
+	if not verify_range(root, leaves, 0, data, LEAF_SIZE):
+		return (False, "Whole file didn't verify")
+
+	for i in range(0, len(leaves)):
+		if not verify_range(root, leaves, i, data[i * LEAF_SIZE:(i + 1) * LEAF_SIZE], LEAF_SIZE):
+			return (False, "Leaf %s didn't verify" % i)
+
+	# Changing a byte should stop it verifying
+	if len(data) > 0:
+		tampered = bytearray(data)
+		tampered[len(data) // 2] ^= 1
+		if verify_range(root, leaves, 0, tampered, LEAF_SIZE):
+			return (False, "Tampered data verified")
+
+	return (True,)
+
+if __name__ == "__main__":
+	# Each entry = (size, reason)
+	failures = []
+
+	executor = make_executor(2)
+
+	# For each size
+	for size in INPUT_SIZES:
+		# Run test with random data of that size
+		data = bytearray([floor(random.random() * 255) for _ in range(0, size)])
+		res = test_tree_hash(data, executor)
+
+		# If it failed, add it to failures
+		if res[0] != True:
+			failures.append((size, res[1]))
+			print("x", end="")
+		else:
+			print(".", end="")
+
+	executor.shutdown()
+
+	print()
+	print("%s tests, %s failures" % (len(INPUT_SIZES), len(failures)))
+	print("---")
+
+	# Print failures
+	for size, reason in failures:
+		print("For %s bytes: %s" % (size, reason))
+		print("---")
@@ -0,0 +1,71 @@
+# Test script for primality testing
+
+from rsa.primality import bpsw, is_probable_prime, strong_probable_prime, miller_rabin_rounds
+
+# Everything below this is checked against trial division
+LIMIT = 20000
+
+# Composites that fool simpler tests, which should all be caught
+## Strong pseudoprimes to base 2
+STRONG_PSEUDOPRIMES = [2047, 3277, 4033, 4681, 8321, 15841, 29341, 42799, 49141, 52633, 65281, 74665, 80581, 85489, 88357, 90751, 3215031751]
+## Strong Lucas pseudoprimes (Selfridge parameters)
+LUCAS_PSEUDOPRIMES = [5459, 5777, 10877, 16109, 18971, 22499, 24569, 25199, 40309, 58519, 75077, 97439]
+## Carmichael numbers
+CARMICHAEL_NUMBERS = [561, 1105, 1729, 2465, 2821, 6601, 8911, 41041, 825265, 321197185]
+
+# Big known primes: 2^127 - 1, 2^521 - 1 and 2^607 - 1 (Mersenne primes)
+BIG_PRIMES = [2 ** 127 - 1, 2 ** 521 - 1, 2 ** 607 - 1]
+
+# Returns if x is prime by trial division
+def slow_is_prime(x):
+	if x < 2:
+		return False
+
+	for i in range(2, int(x ** 0.5) + 1):
+		if x % i == 0:
+			return False
+
+	return True
+
+# Each entry = (number, reason)
+failures = []
+tests = 0
+
+def check(x, expected, reason):
+	global tests
+	tests += 1
+
+	if is_probable_prime(x) != expected or bpsw(x) != expected:
+		failures.append((x, reason))
+		print("x", end="")
+	else:
+		print(".", end="")
+
+# Small numbers
+for x in range(0, LIMIT, 97):
+	check(x, slow_is_prime(x), "Disagrees with trial division")
+for x in range(0, LIMIT):
+	if bpsw(x) != slow_is_prime(x):
+		failures.append((x, "Disagrees with trial division"))
+
+# Pseudoprimes should be composite, even though some pass a single base 2 test
+for x in STRONG_PSEUDOPRIMES + LUCAS_PSEUDOPRIMES + CARMICHAEL_NUMBERS:
+	check(x, False, "Pseudoprime passed")
+
+# Big primes should pass, and their products shouldn't
+for x in BIG_PRIMES:
+	check(x, True, "Prime failed")
+	check(x * BIG_PRIMES[0], False, "Product of primes passed")
+
+# Bigger candidates should need fewer rounds
+if not (miller_rabin_rounds(256) > miller_rabin_rounds(1024) >= miller_rabin_rounds(2048)):
+	failures.append(("rounds", "Rounds don't go down with size"))
+
+print()
+print("%s tests, %s failures" % (tests, len(failures)))
+print("---")
+
+# Print failures
+for x, reason in failures:
+	print("For %s: %s" % (x, reason))
+	print("---")
@@ -0,0 +1,191 @@
+# Test script for parsing Range headers, and sending the responses for them
+
+import os
+from http.client import parse_headers
+from io import BytesIO
+
+from routes.common import parse_range, send_file_response, MAX_RANGES
+
+# Size of the body the ranges are for
+SIZE = 1000
+
+# Each entry = (header, expected)
+# None means the header is ignored, [] means it can't be satisfied
+CASES = [
+	# No header, or not in bytes
+	(None, None),
+	("items=0-10", None),
+
+	# Single ranges
+	("bytes=0-9", [(0, 9)]),
+	("bytes=990-", [(990, 999)]),
+	("bytes=-10", [(990, 999)]),
+	("bytes=-5000", [(0, 999)]),
+	("bytes=500-5000", [(500, 999)]),
+	("bytes=0-0", [(0, 0)]),
+
+	# Several, including overlapping and touching ones which get merged
+	("bytes=0-9, 20-29", [(0, 9), (20, 29)]),
+	("bytes=20-29,0-9", [(0, 9), (20, 29)]),
+	("bytes=0-9,5-14", [(0, 14)]),
+	("bytes=0-9,10-19", [(0, 19)]),
+	("bytes=0-9,-10,", [(0, 9), (990, 999)]),
+
+	# Ranges past the end are skipped, and if that's all of them it can't be satisfied
+	("bytes=1000-", []),
+	("bytes=-0", []),
+	("bytes=0-9,2000-2009", [(0, 9)]),
+
+	# Invalid
+	("bytes=", None),
+	("bytes=9-0", None),
+	("bytes=a-b", None),
+	("bytes=0-9,-", None),
+	("bytes=+1-2", None),
+	("bytes=" + ",".join(["%s-%s" % (x, x) for x in range(0, MAX_RANGES + 1)]), None)
+]
+
+# File and ETag send_file_response is tested with
+DATA = os.urandom(SIZE)
+ETAG = '"1600000000-abcdef"'
+
+# Stands in for Handler, keeping everything written to it
+class FakeHandler:
+	def __init__(self, headers):
+		request = "".join(["%s: %s\r\n" % header for header in headers.items()]) + "\r\n"
+		self.headers = parse_headers(BytesIO(request.encode('latin-1')))
+		self.wfile = BytesIO()
+
+		self.code = None
+		self.response_headers = {}
+
+	def send_response(self, code):
+		self.code = code
+
+	def send_header(self, keyword, value):
+		self.response_headers[keyword] = str(value)
+
+	def end_headers(self):
+		pass
+
+	def send_file(self, f, offset, count):
+		f.seek(offset)
+		self.wfile.write(f.read(count))
+
+# Send DATA for a request with the given headers
+# Returns (status code, response headers, body)
+def respond(headers):
+	handler = FakeHandler(headers)
+	send_file_response(handler, BytesIO(DATA), SIZE, ETAG)
+
+	return (handler.code, handler.response_headers, handler.wfile.getvalue())
+
+# Split a multipart/byteranges body into its parts
+# Returns [(Content-Range, part body)], or None if it's not framed properly
+def parse_multipart(content_type, body):
+	prefix = "multipart/byteranges; boundary="
+	if not content_type.startswith(prefix):
+		return None
+
+	boundary = b"--" + content_type[len(prefix):].encode('ascii')
+	if not body.startswith(b"\r\n" + boundary + b"\r\n") or not body.endswith(b"\r\n" + boundary + b"--\r\n"):
+		return None
+
+	parts = []
+	for section in body[:-len(boundary) - 6].split(b"\r\n" + boundary + b"\r\n")[1:]:
+		head, _, part = section.partition(b"\r\n\r\n")
+		headers = dict([line.decode('latin-1').split(": ", 1) for line in head.split(b"\r\n")])
+		parts.append((headers.get('Content-Range'), part))
+
+	return parts
+
+# Each entry = (request headers, check)
+# check(code, headers, body) returns what's wrong, or None
+def expect_full(code, headers, body):
+	if code != 200 or body != DATA:
+		return "Expected the whole file with 200, got %s" % code
+
+	if headers.get('ETag') != ETAG or headers.get('Accept-Ranges') != 'bytes':
+		return "Missing ETag or Accept-Ranges"
+
+def expect_single(code, headers, body):
+	if code != 206 or body != DATA[10:20]:
+		return "Expected bytes 10-19 with 206, got %s" % code
+
+	if headers.get('Content-Range') != "bytes 10-19/%s" % SIZE:
+		return "Wrong Content-Range: %s" % headers.get('Content-Range')
+
+def expect_unsatisfiable(code, headers, body):
+	if code != 416:
+		return "Expected 416, got %s" % code
+
+	if headers.get('Content-Range') != "bytes */%s" % SIZE:
+		return "Wrong Content-Range: %s" % headers.get('Content-Range')
+
+def expect_multipart(code, headers, body):
+	if code != 206:
+		return "Expected 206, got %s" % code
+
+	parts = parse_multipart(headers.get('Content-Type', ""), body)
+	if parts == None:
+		return "Badly framed multipart body"
+
+	if parts != [("bytes 0-9/%s" % SIZE, DATA[0:10]), ("bytes 500-509/%s" % SIZE, DATA[500:510])]:
+		return "Wrong parts"
+
+RESPONSES = [
+	({}, expect_full),
+	({'Range': "bytes=10-19"}, expect_single),
+	({'Range': "bytes=10-19", 'If-Range': ETAG}, expect_single),
+	# Different version, so the whole of this one is sent
+	({'Range': "bytes=10-19", 'If-Range': '"1500000000-012345"'}, expect_full),
+	({'Range': "bytes=2000-"}, expect_unsatisfiable),
+	({'Range': "bytes=0-9,500-509"}, expect_multipart),
+	# Invalid, so ignored
+	({'Range': "bytes=9-0"}, expect_full),
+]
+
+# Each entry = (header, expected, actual)
+failures = []
+
+for header, expected in CASES:
+	actual = parse_range(header, SIZE)
+
+	if actual != expected:
+		failures.append((header, expected, actual))
+		print("x", end="")
+	else:
+		print(".", end="")
+
+# Nothing can be satisfied in an empty body
+actual = parse_range("bytes=0-", 0)
+if actual != []:
+	failures.append(("bytes=0- (empty body)", [], actual))
+	print("x", end="")
+else:
+	print(".", end="")
+
+for headers, check in RESPONSES:
+	code, response_headers, body = respond(headers)
+	problem = check(code, response_headers, body)
+
+	# Content-Length has to match what was actually written, or the connection can't be kept alive
+	if problem == None and response_headers.get('Content-Length') != str(len(body)):
+		problem = "Content-Length %s, but wrote %s bytes" % (response_headers.get('Content-Length'), len(body))
+
+	if problem != None:
+		failures.append(("response to %s" % headers, check.__name__, problem))
+		print("x", end="")
+	else:
+		print(".", end="")
+
+print()
+print("%s tests, %s failures" % (len(CASES) + 1 + len(RESPONSES), len(failures)))
+print("---")
+
+# Print failures
+for header, expected, actual in failures:
+	print("For %s:" % header)
+	print("Expected %s" % expected)
+	print("Got %s" % actual)
+	print("---")
@@ -0,0 +1,212 @@
+# Test script for uploading new versions of files
+# Calls the upload route with a fake request and response, and a fake database that answers its queries
+# in order, so it doesn't need a database
+
+import os
+import tempfile
+
+import utils
+from config import SERVER_CONFIG
+from rsa import RSAKeypair
+from rsa.crypt import signed_to_bytes
+from statement import HistoryStatement, ZEROS_32
+from merkle import file_tree_hash, leaves_from_bytes
+from hash import sha256
+from routes.file import upload
+
+USERNAME = "alice"
+FILE_ID = 1
+FILENAME = "notes.txt"
+
+# What's uploaded
+DATA = os.urandom(10000)
+
+# Stands in for the database, answering each fetchone with the next of rows
+# Everything executed is kept in executed, as (sql, params)
+class FakeDB:
+	def __init__(self, rows):
+		self.rows = list(rows)
+		self.executed = []
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		pass
+
+	def execute(self, sql, params):
+		self.executed.append((sql, params))
+
+	def fetchone(self):
+		return self.rows.pop(0)
+
+# The parts of Context that upload uses
+class FakeSession:
+	def __init__(self, username):
+		self.username = username
+
+class FakeRequest:
+	def __init__(self, parts, db):
+		self.parts = parts
+		self.db = db
+		self.session = FakeSession(USERNAME)
+
+# Only knows USERNAME's key
+class FakeKeyCache:
+	def __init__(self, key):
+		self.key = key
+
+	def get(self, db, username):
+		return self.key if username == USERNAME else None
+
+class FakeServer:
+	def __init__(self, key):
+		self.key_cache = FakeKeyCache(key)
+		self.hash_executor = None
+
+# Stands in for Handler, keeping the response written to it
+class FakeHandler:
+	def __init__(self, server):
+		self.server = server
+		self.code = None
+		self.body = b""
+
+	def send_response(self, code):
+		self.code = code
+
+	def send_header(self, keyword, value):
+		pass
+
+	def end_headers(self):
+		pass
+
+	# send_json writes the body here
+	@property
+	def wfile(self):
+		return self
+
+	def write(self, data):
+		self.body += data
+
+# Upload DATA as a new version of the file, after the version with the signed payload prev_payload
+# hashUploaded is what the statement claims was uploaded, DATA's hash by default
+# Returns (FakeHandler, FakeDB, signed statement bytes)
+def do_upload(key, prev_payload, hashUploaded=None):
+	if hashUploaded == None:
+		hashUploaded = sha256(DATA)
+
+	statement = HistoryStatement(sha256(prev_payload), hashUploaded, USERNAME, "new version").sign(key)
+
+	## First the file's details, then the latest statement's payload
+	db = FakeDB([(USERNAME, FILENAME, 0, 0), (prev_payload.hex(),)])
+	req = FakeRequest({'meta': {'file_id': FILE_ID, 'statement': statement}, 'data': DATA}, db)
+	res = FakeHandler(FakeServer(key))
+
+	upload(req, res)
+	return (res, db, signed_to_bytes(statement))
+
+# Find the statement of what was executed that starts with prefix
+def find_executed(db, prefix):
+	for sql, params in db.executed:
+		if sql.startswith(prefix):
+			return (sql, params)
+
+	return None
+
+# Each test returns (True,) or (False, reason)
+def test_upload(key, prev_payload, folder):
+	SERVER_CONFIG['tree_hash'] = False
+	res, db, payload = do_upload(key, prev_payload)
+
+	if res.code != 200:
+		return (False, "Upload failed with %s: %s" % (res.code, res.body))
+
+	## The version should be on disk
+	stored = [name for name in os.listdir(folder) if name.startswith(FILENAME)]
+	if len(stored) != 1 or open(os.path.join(folder, stored[0]), "rb").read() != DATA:
+		return (False, "Version wasn't saved to disk")
+
+	## And the statement and version in the database, without the tree root
+	history = find_executed(db, "INSERT INTO HistoryStatement")
+	if history == None or "tree_root" in history[0] or history[1][2:] != (USERNAME, payload):
+		return (False, "History statement wasn't stored properly: %s" % (history,))
+
+	version = find_executed(db, "INSERT INTO StoredVersion")
+	if version == None or version[1][2:] != (bytes(sha256(DATA)), len(DATA)):
+		return (False, "Stored version wasn't recorded properly: %s" % (version,))
+
+	return (True,)
+
+def test_upload_tree_hash(key, prev_payload, folder):
+	SERVER_CONFIG['tree_hash'] = True
+	res, db, _ = do_upload(key, prev_payload)
+	SERVER_CONFIG['tree_hash'] = False
+
+	if res.code != 200:
+		return (False, "Upload failed with %s: %s" % (res.code, res.body))
+
+	## The leaves should be next to the version, and the root in the database
+	stored = [name for name in os.listdir(folder) if name.startswith(FILENAME) and not name.endswith(".tree")]
+	if len(stored) != 1 or not os.path.exists(os.path.join(folder, stored[0] + ".tree")):
+		return (False, "Tree hash wasn't saved")
+
+	leaf_size = SERVER_CONFIG['tree_hash_leaf_size']
+	root, leaves = file_tree_hash(os.path.join(folder, stored[0]), leaf_size)
+	with open(os.path.join(folder, stored[0] + ".tree"), "rb") as f:
+		if leaves_from_bytes(f.read())[1] != leaves:
+			return (False, "Wrong leaves saved")
+
+	history = find_executed(db, "INSERT INTO HistoryStatement")
+	if history == None or history[1][-1] != bytes(root):
+		return (False, "Tree root wasn't stored: %s" % (history,))
+
+	return (True,)
+
+def test_wrong_hash(key, prev_payload, folder):
+	SERVER_CONFIG['tree_hash'] = False
+	res, db, _ = do_upload(key, prev_payload, sha256(b"something else"))
+
+	if res.code != 400:
+		return (False, "Statement for something else was accepted (%s)" % res.code)
+
+	if len(os.listdir(folder)) != 0 or find_executed(db, "INSERT") != None:
+		return (False, "Something was stored anyway")
+
+	return (True,)
+
+if __name__ == "__main__":
+	TESTS = [test_upload, test_upload_tree_hash, test_wrong_hash]
+
+	# Each entry = (test name, reason)
+	failures = []
+
+	# Small key so this doesn't take forever
+	key = RSAKeypair.generate_keypair(bits=2048)
+
+	## The version before the one being uploaded
+	prev_payload = signed_to_bytes(HistoryStatement(ZEROS_32, sha256(b"first version"), USERNAME).sign(key))
+
+	# Run each test, saving versions to an empty folder
+	for test in TESTS:
+		with tempfile.TemporaryDirectory() as folder:
+			utils.FILE_DIR = folder
+			try:
+				res = test(key, prev_payload, folder)
+			except Exception as e:
+				res = (False, "%s: %s" % (type(e).__name__, e))
+
+		# If it failed, add it to failures
+		if res[0] != True:
+			failures.append((test.__name__, res[1]))
+			print("x", end="")
+		else:
+			print(".", end="")
+
+	print()
+	print("%s tests, %s failures" % (len(TESTS), len(failures)))
+	print("---")
+
+	# Print failures
+	for name, reason in failures:
+		print("%s: %s" % (name, reason))
+		print("---")
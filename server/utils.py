@@ -32,4 +32,8 @@ def has_keys(dict, keys):
 # filename identifies the file, created_at and username identifies the history statement
 # which this file is representative of
 def archive_filename(filename, created_at, username):
-	return path.join(FILE_DIR, "%s-%s-%s" % (filename, created_at, username))
\ No newline at end of file
+	return path.join(FILE_DIR, "%s-%s-%s" % (filename, created_at, username))
+
+# Return the path to the file storing the tree hash leaves for an archival file
+def tree_filename(filename, created_at, username):
+	return archive_filename(filename, created_at, username) + ".tree"
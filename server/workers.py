@@ -0,0 +1,9 @@
+# Pools of worker processes, for spreading CPU-heavy work (hashing, crypto) across CPUs
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# Make a pool of worker processes
+# Uses spawn rather than fork, so workers don't inherit things like database connections
+def make_executor(workers=None):
+	return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))